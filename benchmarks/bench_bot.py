@@ -0,0 +1,425 @@
+"""
+End-to-end benchmark of the bots hot paths against local fakes:
+a feed channel with a large history, a MAL API server and a mal-id-cache repo
+
+Reports wall time, throughput, latency percentiles and the number of
+requests each scenario made to discord and MAL
+
+python3 -m benchmarks.bench_bot --feed-size 100000 --new-ids 500
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import asyncio
+import argparse
+import tempfile
+import statistics
+
+import aiohttp
+from discord import Embed
+
+from typing import List, Dict, Any, Optional, Callable, Awaitable
+
+from .fakes import FakeChannel, FakeContext, FakeMalServer, FakeIdCache, CallCounter
+
+USERNAME = "bench"
+
+
+def percentiles(samples: List[float]) -> str:
+    if len(samples) < 2:
+        return " ".join(f"{s * 1000:.1f}ms" for s in samples)
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return f"p50={cuts[49] * 1000:.1f}ms p95={cuts[94] * 1000:.1f}ms p99={cuts[98] * 1000:.1f}ms"
+
+
+class Report:
+    def __init__(self, discord: CallCounter, mal: CallCounter) -> None:
+        self.discord = discord
+        self.mal = mal
+
+    async def run(
+        self,
+        name: str,
+        items: int,
+        func: Callable[[], Awaitable[Any]],
+    ) -> None:
+        from mal_notify_bot.utils.metrics import metrics
+
+        discord_before = self.discord.snapshot()
+        mal_before = self.mal.snapshot()
+        counters_before = dict(metrics.counters)
+        start = time.perf_counter()
+        samples: Optional[List[float]] = await func()
+        elapsed = time.perf_counter() - start
+        counters = {
+            k: v - counters_before.get(k, 0)
+            for k, v in metrics.counters.items()
+            if v != counters_before.get(k, 0)
+        }
+        print(f"{name}:")
+        print(
+            f"  {elapsed:.2f}s for {items} items ({items / elapsed:.1f}/s)"
+            + (f", {percentiles(samples)}" if samples else "")
+        )
+        print(f"  discord: {self.discord.since(discord_before)}")
+        print(f"  mal: {self.mal.since(mal_before)}")
+        print(f"  counters: {counters}")
+
+
+def _setup_env(root: str, server_url: str, args: argparse.Namespace) -> None:
+    """Environment for mal_notify_bot, has to be set before its imported"""
+    cfg = os.path.join(root, "malexport-cfg")
+    os.makedirs(os.path.join(cfg, "accounts"))
+    with open(os.path.join(cfg, "mal_client_id.json"), "w") as f:
+        json.dump({"client_id": "bench"}, f)
+    with open(os.path.join(cfg, "accounts", f"{USERNAME}_refresh_info.json"), "w") as f:
+        json.dump({"access_token": "bench", "refresh_token": "bench"}, f)
+    os.environ.update(
+        {
+            "MAL_NOTIFY_ROOT": root,
+            "MALEXPORT_CFG": cfg,
+            "MALEXPORT_DIR": os.path.join(root, "malexport-data"),
+            "MAL_USERNAME": USERNAME,
+            "MAL_API_URL": server_url + "/v2",
+            "DBSENTINEL_URL": server_url,
+            "MAL_RATE_LIMIT": str(args.mal_rate),
+            "MAL_BURST": str(int(args.mal_rate)),
+        }
+    )
+
+
+async def bench(args: argparse.Namespace) -> None:
+    random.seed(0)
+    root = tempfile.mkdtemp(prefix="mal-notify-bench-")
+    calls = CallCounter()
+    rate_limit = (args.rate_limit, 1.0) if args.rate_limit else None
+    feed = FakeChannel("feed", latency=args.latency, rate_limit=rate_limit, calls=calls)
+    nsfw_feed = FakeChannel(
+        "nsfw-feed", latency=args.latency, rate_limit=rate_limit, calls=calls
+    )
+    commands = FakeChannel("bot-commands", latency=args.latency, calls=calls)
+
+    sfw_ids = list(range(1, args.feed_size + 1))
+    nsfw_ids = [args.feed_size + 20 * i for i in range(1, args.feed_size // 20 + 1)]
+    for mal_id in sfw_ids:
+        feed.add_entry(mal_id, f"https://source/{mal_id}" if mal_id % 10 == 0 else None)
+    for mal_id in nsfw_ids:
+        nsfw_feed.add_entry(mal_id)
+    # an entry which was posted twice, the indexes should point at the repost
+    repost = feed.add_entry(sfw_ids[0])
+    # and one which is in both feeds
+    nsfw_feed.add_entry(sfw_ids[9], "https://source/nsfw")
+    with open(os.path.join(root, "old"), "w") as f:
+        f.write("\n".join(map(str, sfw_ids + nsfw_ids)))
+
+    user_list = {
+        mal_id: random.choice(["completed", "plan_to_watch", "dropped"])
+        for mal_id in random.sample(sfw_ids, min(args.list_size, len(sfw_ids)))
+    }
+    server = FakeMalServer(latency=args.mal_latency, user_lists={USERNAME: user_list})
+    server_url = await server.start()
+    _setup_env(root, server_url, args)
+
+    id_cache = FakeIdCache(root, os.path.join(root, "mal-id-cache"))
+    id_cache.create(sfw_ids, nsfw_ids)
+
+    import logzero  # type: ignore[import]
+
+    logzero.loglevel(logging.INFO)
+
+    from mal_notify_bot import main as bot
+    from mal_notify_bot.utils.old_db import OldDatabase
+    from mal_notify_bot.utils.feed_index import FeedIndex
+    from mal_notify_bot.utils.search_index import SearchIndex
+    from mal_notify_bot.utils.export import (
+        ExportCheckpoint,
+        read_export,
+        split_export,
+    )
+    from mal_notify_bot.utils import id_cache as id_cache_mod
+    from mal_notify_bot.utils.outbound import outbound
+    from mal_notify_bot.utils.user import mal_client
+    from mal_notify_bot.utils.guilds import GuildFeeds
+    from mal_notify_bot.utils.journal import PostingJournal
+    from mal_notify_bot.utils.server import start_server
+    from mal_notify_bot.utils.services import dbsentinel
+    from mal_notify_bot.utils.bulk_refresh import BulkRefresh, RefreshCheckpoint
+
+    # discords per-channel limit is much lower, this measures the bot, not the limit
+    outbound.route_rate = args.discord_rate
+    outbound.route_burst = int(args.discord_rate)
+
+    bot.Globals.feed_channel = feed
+    bot.Globals.nsfw_feed_channel = nsfw_feed
+    bot.Globals.mirrors = [
+        GuildFeeds(
+            guild_id=i,
+            feed=FakeChannel(f"feed-{i}", latency=args.latency, calls=calls),
+            nsfw_feed=FakeChannel(f"nsfw-feed-{i}", latency=args.latency, calls=calls),
+        )
+        for i in range(args.mirrors)
+    ]
+    bot.Globals.old_db = OldDatabase(
+        filepath=bot.old_db_snapshot_file, import_from=bot.old_db_file
+    )
+    await bot.Globals.old_db.load()
+    bot.Globals.journal = PostingJournal(filepath=bot.journal_file)
+
+    bot.Globals.export_checkpoint = ExportCheckpoint(
+        filepath=bot.export_checkpoint_file
+    )
+    bot.Globals.last_commit = id_cache_mod.LastCommit(filepath=bot.last_commit_file)
+    report = Report(calls, server.calls)
+    print(
+        f"{args.feed_size} messages in #feed, {len(nsfw_ids)} in #nsfw-feed, "
+        f"{args.latency * 1000:.0f}ms per discord request, "
+        f"{args.mal_latency * 1000:.0f}ms per MAL request, "
+        f"{args.mirrors} mirroring servers\n"
+    )
+
+    lookups = random.sample(sfw_ids, args.lookups)
+
+    async def search() -> List[float]:
+        samples = []
+        for mal_id in lookups:
+            start = time.perf_counter()
+            assert await bot.search_feed_for_mal_id(mal_id, feed) is not None
+            samples.append(time.perf_counter() - start)
+        return samples
+
+    bot.Globals.feed_index = None
+    await report.run("search_feed_for_mal_id (history scan)", len(lookups), search)
+
+    bot.Globals.feed_index = FeedIndex(filepath=bot.feed_index_file)
+    bot.Globals.search_index = SearchIndex(filepath=bot.search_index_file)
+
+    async def build_index() -> None:
+        await bot.build_feed_index(feed)
+        await bot.build_feed_index(nsfw_feed)
+        assert bot.Globals.search_index.is_built(feed.id)
+        assert (sfw_ids[0], repost.id) in {
+            (mal_id, message_id)
+            for mal_id, message_id, _, _ in bot.Globals.search_index.entries([feed.id])
+        }
+
+    await report.run("build_feed_index", args.feed_size + len(nsfw_ids), build_index)
+    await report.run("search_feed_for_mal_id (indexed)", len(lookups), search)
+
+    queries = ["entry", "synopsis 4242", "finished airing", "source"] + [
+        f"entry {mal_id}" for mal_id in lookups
+    ]
+
+    async def full_text_search() -> List[float]:
+        samples = []
+        for query in queries:
+            start = time.perf_counter()
+            assert bot.Globals.search_index.search(query)
+            samples.append(time.perf_counter() - start)
+        return samples
+
+    await report.run("SearchIndex.search", len(queries), full_text_search)
+
+    async def export_full() -> None:
+        await bot.run_export(full=True)
+        exported_ids = [record.mal_id for record in read_export(bot.export_file)]
+        assert exported_ids.count(sfw_ids[9]) == 1
+
+    await report.run("run_export (full)", args.feed_size + len(nsfw_ids), export_full)
+
+    # process the initial commit, so the new IDs are read from the diff
+    await bot.print_new_embeds()
+    new_ids = [args.feed_size * 2 + i for i in range(1, args.new_ids + 1)]
+    id_cache.add(
+        [i for i in new_ids if i % server.nsfw_every != 0],
+        [i for i in new_ids if i % server.nsfw_every == 0],
+    )
+
+    async def print_new() -> List[float]:
+        start = time.perf_counter()
+        sends = len(feed.sent_at), len(nsfw_feed.sent_at)
+        await bot.print_new_embeds()
+        posted = feed.sent_at[sends[0] :] + nsfw_feed.sent_at[sends[1] :]
+        assert len(posted) == len(new_ids), f"posted {len(posted)}/{len(new_ids)}"
+        for mirror in bot.Globals.mirrors:
+            posted.extend(mirror.feed.sent_at + mirror.nsfw_feed.sent_at)
+        # time from the start of the poll until each entry was visible in each server
+        return [t - start for t in posted]
+
+    await report.run("print_new_embeds (time to post)", len(new_ids), print_new)
+
+    async def export_incremental() -> None:
+        await bot.run_export()
+
+    await report.run("run_export (incremental)", len(new_ids), export_incremental)
+    # e.g. the export command while export_loop is running
+    await asyncio.gather(bot.run_export(), bot.run_export())
+    assert not [f for f in os.listdir(root) if f.endswith(".tmp")]
+
+    exported = sum(1 for _ in read_export(bot.export_file))
+    export_size = os.path.getsize(bot.export_file)
+    print(f"  {exported} sources exported, {export_size} bytes")
+
+    async def read_back() -> None:
+        assert sum(1 for _ in read_export(bot.export_file)) == exported
+
+    await report.run("read_export", exported, read_back)
+
+    async def split() -> None:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            parts = split_export(bot.export_file, export_size // 4 + 1, tmp_dir)
+            assert sum(1 for p in parts for _ in read_export(p)) == exported
+            print(f"  split into {len(parts)} parts")
+
+    await report.run("split_export", exported, split)
+
+    runner = await start_server(port=0, ingest=bot.ingest_ids)
+    ingest_url = f"http://127.0.0.1:{runner.addresses[0][1]}/ingest"
+    pushed_ids = [args.feed_size * 3 + i for i in range(1, args.pushed_ids + 1)]
+
+    async def push() -> List[float]:
+        sends = len(feed.sent_at), len(nsfw_feed.sent_at)
+        start = time.perf_counter()
+        async with aiohttp.ClientSession() as session:
+            async with session.post(ingest_url, json={"ids": pushed_ids}) as resp:
+                assert resp.status == 202, resp.status
+        posted: List[float] = []
+        while len(posted) < len(pushed_ids):
+            await asyncio.sleep(0.01)
+            posted = feed.sent_at[sends[0] :] + nsfw_feed.sent_at[sends[1] :]
+        # time from the checker pushing the IDs until each entry was visible
+        return [t - start for t in posted]
+
+    await report.run("POST /ingest (time to post)", len(pushed_ids), push)
+    await runner.cleanup()
+
+    # stop part way through posting a backlog: some entries were only fetched,
+    # some were sent right before stopping, some were sent but not indexed yet
+    journal = bot.Globals.journal
+    crash_ids = [args.feed_size * 4 + i for i in range(1, args.crash_ids + 1)]
+    assert not await bot.fetch_new_entries(crash_ids)
+    already_sent = 0
+    for n, mal_id in enumerate(crash_ids):
+        entry = journal.entries[mal_id]
+        channel = feed if entry.sfw else nsfw_feed
+        if n % 3 == 0:
+            continue
+        await journal.sending(mal_id, channel.id)
+        message = await channel.send(embed=Embed.from_dict(entry.embed))
+        if n % 3 == 2:
+            await journal.record(mal_id, "sent", message_id=message.id)
+        already_sent += 1
+    # as if the bot restarted
+    journal.load()
+
+    async def resume() -> None:
+        sends = len(feed.sent_at) + len(nsfw_feed.sent_at)
+        await bot.post_new_embeds()
+        sent = len(feed.sent_at) + len(nsfw_feed.sent_at) - sends
+        assert sent == len(crash_ids) - already_sent, f"sent {sent}"
+        assert len(journal) == 0
+        assert all(mal_id in bot.Globals.old_db for mal_id in crash_ids)
+
+    await report.run("post_new_embeds (resume after a crash)", len(crash_ids), resume)
+
+    ctx = FakeContext(commands, f"@mal-notify check {USERNAME} {args.check_num} all")
+
+    async def check() -> None:
+        await bot.check.callback(ctx, USERNAME, args.check_num)  # type: ignore[arg-type]
+
+    await report.run(
+        f"check (download {len(user_list)} list entries)", args.check_num, check
+    )
+    await report.run("check (cached list)", args.check_num, check)
+
+    refreshes = random.sample(sfw_ids, args.refreshes)
+
+    async def refresh() -> List[float]:
+        samples = []
+        for mal_id in refreshes:
+            refresh_ctx = FakeContext(commands, f"@mal-notify refresh {mal_id}")
+            start = time.perf_counter()
+            await bot.refresh.callback(refresh_ctx, mal_id)  # type: ignore[arg-type]
+            samples.append(time.perf_counter() - start)
+        return samples
+
+    await report.run("refresh", len(refreshes), refresh)
+
+    bot.Globals.bulk_refresh = BulkRefresh(
+        RefreshCheckpoint(filepath=bot.refresh_checkpoint_file),
+        bot.refresh_feed_entry,
+    )
+
+    async def bulk_refresh() -> None:
+        # the command checks roles, so start the job it would start
+        ids = bot.parse_bulk_refresh("last", (str(args.bulk_refreshes),))
+        bot.Globals.bulk_refresh.start(ids, None, logging.getLogger().debug)
+        await bot.Globals.bulk_refresh._task
+        # wait for the queued dbsentinel refreshes to be sent
+        while dbsentinel._flusher is not None and not dbsentinel._flusher.done():
+            await dbsentinel._flusher
+
+    await report.run("bulk_refresh", args.bulk_refreshes, bulk_refresh)
+
+    await dbsentinel.close()
+    await mal_client.close()
+    await server.stop()
+    print(f"\nfiles in {root}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--feed-size", type=int, default=100_000)
+    parser.add_argument("--new-ids", type=int, default=500)
+    parser.add_argument(
+        "--pushed-ids", type=int, default=20, help="IDs pushed to /ingest"
+    )
+    parser.add_argument("--lookups", type=int, default=20)
+    parser.add_argument("--refreshes", type=int, default=20)
+    parser.add_argument(
+        "--crash-ids",
+        type=int,
+        default=30,
+        help="entries left part way through posting, to resume",
+    )
+    parser.add_argument(
+        "--bulk-refreshes", type=int, default=200, help="entries to bulk_refresh"
+    )
+    parser.add_argument(
+        "--mirrors", type=int, default=0, help="other servers to fan new entries out to"
+    )
+    parser.add_argument("--list-size", type=int, default=3000)
+    parser.add_argument("--check-num", type=int, default=1000)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds per discord request"
+    )
+    parser.add_argument(
+        "--mal-latency", type=float, default=0.0, help="seconds per MAL request"
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=int,
+        default=0,
+        help="discord requests per second per channel and request type, before the fake channel waits",
+    )
+    parser.add_argument(
+        "--discord-rate",
+        type=float,
+        default=1000.0,
+        help="outgoing discord requests per second per route, in the bot's scheduler",
+    )
+    parser.add_argument(
+        "--mal-rate", type=float, default=1000.0, help="MAL requests per second"
+    )
+    args = parser.parse_args()
+    if args.feed_size < 10_000:
+        # print_new_embeds refuses to run with a small 'old' file
+        sys.exit("--feed-size has to be at least 10000")
+    asyncio.run(bench(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Compares the plaintext 'old' file (read into a set of strings,
+sorted and rewritten on every dump) against the bitmap OldDatabase
+
+python3 -m benchmarks.bench_old_db
+"""
+
+import os
+import time
+import random
+import asyncio
+import tempfile
+import tracemalloc
+
+from typing import Callable, Set, Any
+
+from mal_notify_bot.utils.old_db import OldDatabase
+
+
+def _measure_memory(build: Callable[[], Any]) -> int:
+    tracemalloc.start()
+    obj = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del obj
+    return current
+
+
+def _legacy_dump(filepath: str, contents: Set[str]) -> None:
+    with open(filepath, "w") as old_f:
+        old_f.write("\n".join(sorted(list(contents), key=int)))
+        old_f.flush()
+
+
+async def bench(count: int, adds: int = 50) -> None:
+    ids = random.sample(range(1, count * 2), count)
+    new_ids = [count * 2 + i for i in range(adds)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        text_file = os.path.join(tmp_dir, "old")
+        with open(text_file, "w") as f:
+            f.write("\n".join(map(str, sorted(ids))))
+
+        def _legacy_read() -> Set[str]:
+            with open(text_file) as f:
+                return set(f.read().splitlines())
+
+        db = OldDatabase(
+            filepath=os.path.join(tmp_dir, "old.bin"), import_from=text_file
+        )
+        await db.load()
+
+        legacy_mem = _measure_memory(_legacy_read)
+        legacy = _legacy_read()
+        start = time.perf_counter()
+        for new_id in new_ids:
+            legacy.add(str(new_id))
+            _legacy_dump(text_file, legacy)
+        legacy_dump = (time.perf_counter() - start) / adds
+
+        new_mem = _measure_memory(lambda: bytearray(db.ids.bitmap))
+        start = time.perf_counter()
+        for new_id in new_ids:
+            await db.add(new_id)
+        new_dump = (time.perf_counter() - start) / adds
+        start = time.perf_counter()
+        await db.compact()
+        compact = time.perf_counter() - start
+
+    print(f"{count} ids:")
+    print(
+        f"  memory:  set[str] {legacy_mem / 1024:.1f}KiB, bitmap {new_mem / 1024:.1f}KiB"
+    )
+    print(
+        f"  per-id dump: sort+rewrite {legacy_dump * 1e6:.0f}us, fsync'd append {new_dump * 1e6:.0f}us"
+    )
+    print(f"  compaction: {compact * 1000:.2f}ms")
+
+
+async def main() -> None:
+    for count in (30_000, 300_000):
+        await bench(count)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,99 @@
+"""
+Per-entry latency of printing new entries to a fake #feed, comparing
+the previous search/send/sleep/search pipeline to post_journaled, which
+also writes each stage to the posting journal
+
+python3 -m benchmarks.bench_posting
+"""
+
+import os
+import time
+import asyncio
+import tempfile
+
+from typing import Optional
+
+from discord import Embed
+
+from mal_notify_bot.utils import extract_mal_id_from_url
+from mal_notify_bot.utils.posting import publish
+
+from .fakes import FakeChannel, FakeMessage
+
+
+async def _search(
+    channel: FakeChannel, mal_id: int, limit: int
+) -> Optional[FakeMessage]:
+    async for message in channel.history(limit=limit, oldest_first=False):
+        if message.embeds and message.embeds[0].url is not None:
+            embed_id = extract_mal_id_from_url(message.embeds[0].url)
+            if embed_id is not None and int(embed_id) == mal_id:
+                return message
+    return None
+
+
+async def legacy_post(channel: FakeChannel, embed: Embed, mal_id: int) -> None:
+    if await _search(channel, mal_id, 1000) is None:
+        await channel.send(embed=embed)
+    await asyncio.sleep(2)
+    printed = await _search(channel, mal_id, 1000)
+    assert printed is not None
+    await publish(printed)
+
+
+def _embed(mal_id: int) -> Embed:
+    return Embed(title=str(mal_id), url=f"https://myanimelist.net/anime/{mal_id}")
+
+
+async def bench(entries: int) -> None:
+    root = tempfile.mkdtemp(prefix="mal-notify-bench-")
+    # the bot writes its state files to MAL_NOTIFY_ROOT, which is read on import
+    os.environ["MAL_NOTIFY_ROOT"] = root
+
+    from mal_notify_bot import main as bot
+    from mal_notify_bot.utils.feed_index import FeedIndex
+    from mal_notify_bot.utils.journal import PostingJournal
+    from mal_notify_bot.utils.old_db import OldDatabase
+    from mal_notify_bot.utils.posting import RecentIds
+
+    legacy_channel = FakeChannel(latency=0.02)
+    new_channel = FakeChannel(latency=0.02)
+    for mal_id in range(1, 5001):
+        legacy_channel.add_entry(mal_id)
+        new_channel.add_entry(mal_id)
+    new_ids = [10_000 + i for i in range(entries)]
+
+    start = time.perf_counter()
+    for mal_id in new_ids:
+        await legacy_post(legacy_channel, _embed(mal_id), mal_id)
+    legacy = (time.perf_counter() - start) / entries
+
+    bot.Globals.feed_channel = new_channel
+    bot.Globals.nsfw_feed_channel = FakeChannel("nsfw-feed", latency=0.02)
+    bot.Globals.mirrors = []
+    bot.Globals.feed_index = FeedIndex(filepath=":memory:")
+    bot.Globals.search_index = None
+    bot.Globals.recent_ids = RecentIds()
+    bot.Globals.old_db = OldDatabase(filepath=os.path.join(root, "old.bin"))
+    journal = PostingJournal(filepath=os.path.join(root, "journal.jsonl"))
+    bot.Globals.journal = journal
+    start = time.perf_counter()
+    for mal_id in new_ids:
+        await journal.record(
+            mal_id, "fetched", embed=_embed(mal_id).to_dict(), sfw=True
+        )
+        await bot.post_journaled(journal.entries[mal_id])
+    new = (time.perf_counter() - start) / entries
+    assert len(journal) == 0 and all(mal_id in bot.Globals.old_db for mal_id in new_ids)
+
+    print(f"{entries} entries, 20ms per discord request:")
+    print(
+        f"  search/send/sleep/search: {legacy * 1000:.0f}ms per entry, {legacy_channel.calls}"
+    )
+    print(
+        f"  post_journaled:           {new * 1000:.0f}ms per entry, {new_channel.calls}"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(bench(5))
@@ -0,0 +1,380 @@
+"""
+Local stand-ins for discord, the MAL API and mal-id-cache,
+so the bots hot paths can be measured offline
+"""
+
+import os
+import json
+import time
+import asyncio
+import itertools
+import subprocess
+from collections import deque
+
+from typing import List, Optional, AsyncIterator, Any, Dict, Deque, Tuple, Iterable
+
+from datetime import datetime, timedelta
+
+from aiohttp import web
+from discord import Embed
+from discord.utils import time_snowflake
+
+# messages added to the history directly were sent a day ago, like
+# discord IDs these are the milliseconds they were sent at << 22
+_history_ids = itertools.count(time_snowflake(datetime.now() - timedelta(days=1)))
+_last_id = 0
+
+
+def _snowflake() -> int:
+    """An ID for a message sent now"""
+    global _last_id
+    _last_id = max(_last_id + 1, time_snowflake(datetime.now()))
+    return _last_id
+
+
+# fields requested by mal_notify_bot.utils.embeds.ANIME_FIELDS
+_ANIME_GENRES = [{"id": 1, "name": "Action"}, {"id": 8, "name": "Drama"}]
+_NSFW_GENRES = [{"id": 12, "name": "Hentai"}]
+
+
+class CallCounter:
+    """Counts the requests made to the fake APIs"""
+
+    def __init__(self) -> None:
+        self.counts: Dict[str, int] = {}
+
+    def incr(self, name: str) -> None:
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+    def snapshot(self) -> Dict[str, int]:
+        return dict(self.counts)
+
+    def since(self, snapshot: Dict[str, int]) -> Dict[str, int]:
+        return {
+            k: v - snapshot.get(k, 0)
+            for k, v in self.counts.items()
+            if v - snapshot.get(k, 0) > 0
+        }
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.counts})"
+
+
+class FakeMessage:
+    def __init__(
+        self,
+        channel: "FakeChannel",
+        embed: Optional[Embed],
+        message_id: Optional[int] = None,
+    ) -> None:
+        self.id = message_id if message_id is not None else _snowflake()
+        self.channel = channel
+        self.author = None
+        self.embeds: List[Embed] = [embed] if embed is not None else []
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(id={self.id})"
+
+    async def publish(self) -> None:
+        await self.channel._request("publish")
+
+    async def edit(self, **kwargs: Any) -> "FakeMessage":
+        await self.channel._request("edit")
+        if kwargs.get("embed") is not None:
+            self.embeds = [kwargs["embed"]]
+        return self
+
+
+class FakeChannel:
+    """
+    A TextChannel which paginates its history like discord does,
+    sleeping 'latency' seconds for each request
+
+    If rate_limit is given as (requests, seconds), each kind of request
+    waits once it goes over that, like discord.py does when it gets a 429
+    """
+
+    def __init__(
+        self,
+        name: str = "feed",
+        *,
+        latency: float = 0.05,
+        page_size: int = 100,
+        rate_limit: Optional[Tuple[int, float]] = None,
+        calls: Optional[CallCounter] = None,
+    ) -> None:
+        self.id = _snowflake()
+        self.name = name
+        self.mention = f"#{name}"
+        self.latency = latency
+        self.page_size = page_size
+        self.rate_limit = rate_limit
+        self.calls = calls or CallCounter()
+        # oldest first
+        self.messages: List[FakeMessage] = []
+        self._by_id: Dict[int, FakeMessage] = {}
+        self._windows: Dict[str, Deque[float]] = {}
+        # time.perf_counter() of each send, to measure time-to-post
+        self.sent_at: List[float] = []
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(name={self.name}, messages={len(self.messages)})"
+
+    async def _request(self, name: str) -> None:
+        self.calls.incr(name)
+        if self.rate_limit is not None:
+            limit, per = self.rate_limit
+            window = self._windows.setdefault(name, deque())
+            now = time.monotonic()
+            while window and now - window[0] > per:
+                window.popleft()
+            if len(window) >= limit:
+                self.calls.incr("rate_limited")
+                await asyncio.sleep(per - (now - window[0]))
+                window.popleft()
+            window.append(time.monotonic())
+        await asyncio.sleep(self.latency)
+
+    def _append(self, message: FakeMessage) -> FakeMessage:
+        self.messages.append(message)
+        self._by_id[message.id] = message
+        return message
+
+    def add_entry(self, mal_id: int, source: Optional[str] = None) -> FakeMessage:
+        """
+        Adds an embed to the history without making a request, with the
+        data FakeMalServer has for it, other than the status of airing entries
+        """
+        embed = Embed(
+            title=f"Entry {mal_id}", url=f"https://myanimelist.net/anime/{mal_id}"
+        )
+        embed.set_thumbnail(
+            url=f"https://cdn.myanimelist.net/images/anime/{mal_id}.jpg"
+        )
+        embed.add_field(name="Status", value="Finished Airing", inline=True)
+        embed.add_field(name="Air Date", value="2020-01-01", inline=True)
+        embed.add_field(name="MAL ID", value=mal_id, inline=True)
+        embed.add_field(name="Synopsis", value=f"Synopsis for {mal_id}", inline=False)
+        if source is not None:
+            embed.add_field(name="Source", value=source, inline=False)
+        return self._append(FakeMessage(self, embed, next(_history_ids)))
+
+    async def send(
+        self, content: Any = None, *, embed: Optional[Embed] = None, **kwargs: Any
+    ) -> FakeMessage:
+        await self._request("send")
+        self.sent_at.append(time.perf_counter())
+        return self._append(FakeMessage(self, embed))
+
+    async def fetch_message(self, message_id: int) -> FakeMessage:
+        await self._request("fetch_message")
+        return self._by_id[message_id]
+
+    async def history(
+        self,
+        limit: Optional[int] = 100,
+        oldest_first: Optional[bool] = None,
+        before: Any = None,
+        after: Any = None,
+    ) -> AsyncIterator[FakeMessage]:
+        if oldest_first is None:
+            oldest_first = after is not None
+        messages: Iterable[FakeMessage] = (
+            self.messages if oldest_first else reversed(self.messages)
+        )
+        if after is not None:
+            messages = (m for m in messages if m.id > after.id)
+        if before is not None:
+            messages = (m for m in messages if m.id < before.id)
+        for i, message in enumerate(messages):
+            if limit is not None and i >= limit:
+                break
+            if i % self.page_size == 0:
+                await self._request("history")
+            yield message
+
+
+class FakeAuthor:
+    def __init__(self) -> None:
+        self.roles: List[Any] = []
+
+
+class FakeContext:
+    """The parts of commands.Context the bots commands use"""
+
+    def __init__(self, channel: FakeChannel, content: str) -> None:
+        self.channel = channel
+        self.author = FakeAuthor()
+        self.message = type("FakeCommandMessage", (), {"content": content})()
+
+
+def anime_payload(mal_id: int, nsfw: bool = False) -> Dict[str, Any]:
+    """A response shaped like the MAL v2 anime details endpoint"""
+    return {
+        "id": mal_id,
+        "title": f"Entry {mal_id}",
+        "main_picture": {
+            "medium": f"https://cdn.myanimelist.net/images/anime/{mal_id}.jpg",
+            "large": f"https://cdn.myanimelist.net/images/anime/{mal_id}l.jpg",
+        },
+        "alternative_titles": {"synonyms": [], "en": "", "ja": ""},
+        "start_date": "2020-01-01",
+        "end_date": "2020-03-01",
+        "synopsis": f"Synopsis for {mal_id}",
+        "mean": 7.5,
+        "rank": mal_id,
+        "popularity": mal_id,
+        "num_list_users": 1000,
+        "num_scoring_users": 500,
+        "nsfw": "black" if nsfw else "white",
+        "created_at": "2020-01-01T00:00:00+00:00",
+        "updated_at": "2020-06-01T00:00:00+00:00",
+        "media_type": "tv",
+        # so refreshing some entries changes them
+        "status": "currently_airing" if mal_id % 7 == 0 else "finished_airing",
+        "genres": _NSFW_GENRES if nsfw else _ANIME_GENRES,
+        "num_episodes": 12,
+        "start_season": {"year": 2020, "season": "winter"},
+        "broadcast": {"day_of_the_week": "monday", "start_time": "01:00"},
+        "source": "manga",
+        "average_episode_duration": 1440,
+        "rating": "pg_13",
+        "pictures": [],
+        "background": "",
+        "related_anime": [],
+        "related_manga": [],
+        "recommendations": [],
+        "studios": [{"id": 1, "name": "Studio"}],
+        "statistics": {"num_list_users": 1000, "status": {}},
+    }
+
+
+class FakeMalServer:
+    """
+    Serves the MAL v2 endpoints the bot uses, and dbsentinel's refresh endpoints
+    nsfw_every makes every nth ID a hentai, so it gets posted to #nsfw-feed
+    """
+
+    def __init__(
+        self,
+        *,
+        latency: float = 0.01,
+        nsfw_every: int = 20,
+        user_lists: Optional[Dict[str, Dict[int, str]]] = None,
+    ) -> None:
+        self.latency = latency
+        self.nsfw_every = nsfw_every
+        self.user_lists = user_lists or {}
+        self.calls = CallCounter()
+        self.url = ""
+        self._runner: Optional[web.AppRunner] = None
+
+    async def _anime(self, request: web.Request) -> web.Response:
+        self.calls.incr("mal_anime")
+        await asyncio.sleep(self.latency)
+        mal_id = int(request.match_info["mal_id"])
+        return web.json_response(anime_payload(mal_id, mal_id % self.nsfw_every == 0))
+
+    async def _animelist(self, request: web.Request) -> web.Response:
+        self.calls.incr("mal_animelist")
+        await asyncio.sleep(self.latency)
+        username = request.match_info["username"]
+        if username not in self.user_lists:
+            return web.json_response({"error": "not_found"}, status=404)
+        limit = int(request.query.get("limit", 100))
+        offset = int(request.query.get("offset", 0))
+        entries = sorted(self.user_lists[username].items())
+        data = [
+            {
+                "node": {
+                    "id": mal_id,
+                    "my_list_status": {
+                        "status": status,
+                        "updated_at": "2020-01-01T00:00:00+00:00",
+                    },
+                }
+            }
+            for mal_id, status in entries[offset : offset + limit]
+        ]
+        resp: Dict[str, Any] = {"data": data, "paging": {}}
+        if offset + limit < len(entries):
+            query = dict(request.query)
+            query["offset"] = str(offset + limit)
+            resp["paging"]["next"] = str(request.url.with_query(query))
+        return web.json_response(resp)
+
+    async def _dbsentinel(self, request: web.Request) -> web.Response:
+        self.calls.incr("dbsentinel")
+        return web.json_response({})
+
+    async def start(self) -> str:
+        app = web.Application()
+        app.router.add_get("/v2/anime/{mal_id}", self._anime)
+        app.router.add_get("/v2/users/{username}/animelist", self._animelist)
+        app.router.add_get("/ping", self._dbsentinel)
+        app.router.add_get("/tasks/refresh_entry", self._dbsentinel)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]  # type: ignore[union-attr]
+        self.url = f"http://127.0.0.1:{port}"
+        return self.url
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+def _git(cwd: str, *args: str) -> None:
+    subprocess.run(
+        ["git", "-c", "user.name=bench", "-c", "user.email=bench@localhost", *args],
+        cwd=cwd,
+        check=True,
+        capture_output=True,
+    )
+
+
+class FakeIdCache:
+    """
+    A synthetic mal-id-cache: a bare 'remote' repo, a working copy to push to it,
+    and a clone at clone_dir for the bot to pull
+    """
+
+    def __init__(self, base_dir: str, clone_dir: str) -> None:
+        self.remote = os.path.join(base_dir, "mal-id-cache-remote.git")
+        self.work = os.path.join(base_dir, "mal-id-cache-work")
+        self.clone_dir = clone_dir
+        self.sfw: List[int] = []
+        self.nsfw: List[int] = []
+
+    def _commit(self, message: str) -> None:
+        os.makedirs(os.path.join(self.work, "cache"), exist_ok=True)
+        with open(os.path.join(self.work, "cache", "anime_cache.json"), "w") as f:
+            json.dump({"sfw": sorted(self.sfw), "nsfw": sorted(self.nsfw)}, f, indent=4)
+        _git(self.work, "add", "-A")
+        _git(self.work, "commit", "-q", "-m", message)
+        _git(self.work, "push", "-q", "origin", "HEAD:master")
+
+    def create(self, sfw: List[int], nsfw: List[int]) -> None:
+        subprocess.run(
+            ["git", "init", "-q", "--bare", "-b", "master", self.remote], check=True
+        )
+        subprocess.run(["git", "init", "-q", "-b", "master", self.work], check=True)
+        _git(self.work, "remote", "add", "origin", self.remote)
+        self.sfw, self.nsfw = list(sfw), list(nsfw)
+        self._commit("initial")
+        subprocess.run(
+            ["git", "clone", "-q", self.remote, self.clone_dir],
+            check=True,
+            capture_output=True,
+        )
+
+    def add(self, sfw: List[int], nsfw: List[int]) -> None:
+        """Pushes a commit which approves more IDs"""
+        self.sfw.extend(sfw)
+        self.nsfw.extend(nsfw)
+        self._commit(f"add {len(sfw) + len(nsfw)} ids")
@@ -2,55 +2,109 @@ import os
 import sys
 import re
 import json
+import time
+import tempfile
 import traceback
-import pathlib
 import asyncio
 
-from typing import Dict, Optional, List, Any, Tuple
+from typing import Dict, Optional, List, Any, Tuple, Callable, Set, AsyncIterator
 from asyncio import sleep
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from datetime import datetime
 
 import aiohttp
 import yaml
 import requests
 import aiofiles  # type: ignore[import]
-from git.cmd import Git  # type: ignore[import]
 from logzero import logger  # type: ignore[import]
 
-from discord import errors, File, Message, Embed, TextChannel, Member, Intents
+from discord import (
+    errors,
+    File,
+    Message,
+    Embed,
+    TextChannel,
+    Member,
+    Guild,
+    Intents,
+    RawMessageDeleteEvent,
+    Object,
+)
 from discord.ext import commands
-from discord.utils import get
+from git.exc import GitCommandError  # type: ignore[import]
+from discord.utils import get, time_snowflake
 
+from .utils.startup import startup
 from .utils import (
     truncate,
-    extract_mal_id_from_url,
     log,
     remove_discord_link_suppression,
 )
 from .utils.embeds import (
     create_embed,
-    refresh_embed,
+    refresh_entry,
     add_source,
     remove_source,
-    get_source,
 )
-from .utils.user import download_users_list
+from .utils.user import download_users_list, UserList, UserListCache, mal_client
+from .utils.feed_index import FeedIndex
+from .utils.feed_entry import FeedEntry
+from .utils.search_index import SearchIndex, Row, embed_row
+from .utils.export import (
+    ExportCheckpoint,
+    ExportWriter,
+    ExportRecord,
+    read_export,
+    split_export,
+)
+from .utils.old_db import OldDatabase
+from .utils import id_cache
+from .utils.posting import RecentIds, already_posted, mark_posted, publish
+from .utils.journal import PostingJournal, JournalEntry
+from .utils.guilds import GuildConfig, GuildFeeds, fan_out
+from .utils.paginate import send_paginated
+from .utils.outbound import outbound, Priority
+from .utils.metrics import metrics
+from .utils.crawler import HistoryCrawler, FeedMessage, parse_feed_message
+from .utils.server import start_server
+from .utils.bulk_refresh import BulkRefresh, RefreshCheckpoint
+from .utils.refresher import MetadataRefresher
+from .utils.services import dbsentinel, checker_mal, ServiceUnavailable
+from .utils.paths import root_dir
 
-root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir))
 mal_id_cache_dir = os.path.join(root_dir, "mal-id-cache")
 mal_id_cache_json_file = os.path.join(mal_id_cache_dir, "cache", "anime_cache.json")
 token_file = os.path.join(root_dir, "token.yaml")
+# which servers get the feed, and the channels to post to
+guilds_file = os.path.join(root_dir, "guilds.yaml")
+# the last mal-id-cache commit which was completely processed
+last_commit_file = os.path.join(root_dir, "last_commit")
 
 old_db_file = os.path.join(root_dir, "old")
-assert os.path.exists(old_db_file)
-# arbitrary check to make sure the olddb isn't empty
-assert len(pathlib.Path(old_db_file).read_text()) > 10000
+# stages of the entries being posted, so posting can resume after a crash
+journal_file = os.path.join(root_dir, "posting_journal.jsonl")
+# bitmap snapshot of the IDs in 'old', with an append-only log next to it
+old_db_snapshot_file = os.path.join(root_dir, "old.bin")
 
-# file to export sources as a backup
-export_file = os.path.join(root_dir, "export.json")
+# sqlite database which maps MAL IDs to feed messages
+feed_index_file = os.path.join(root_dir, "feed_index.sqlite")
+# full text search over the entries in the feed
+search_index_file = os.path.join(root_dir, "search_index.sqlite")
 
-# bot object
-client = commands.Bot(
+# file to export sources as a backup
+export_file = os.path.join(root_dir, "export.ndjson.gz")
+# newest exported message per channel, and source edits since then
+export_checkpoint_file = os.path.join(root_dir, "export_checkpoint.json")
+# IDs left in the current bulk refresh, so it can resume after a restart
+refresh_checkpoint_file = os.path.join(root_dir, "refresh_checkpoint.json")
+# when each entry was last refreshed, for the background refresher
+refreshed_file = os.path.join(root_dir, "refreshed.sqlite")
+
+# how many servers a new entry is posted to at once
+FANOUT_CONCURRENCY = int(os.environ.get("MAL_NOTIFY_FANOUT", 8))
+
+# bot object, uses as many shards as discord recommends for the number of servers
+client = commands.AutoShardedBot(
     command_prefix=commands.when_mentioned,
     case_insensitive=False,
     intents=Intents.default(),
@@ -65,53 +119,57 @@ TRUSTED_ROLE = "trusted"
 @dataclass
 class GlobalsType:
     period: int = 60 * 5
+    # once the checker is pushing approved IDs, polling is only a safety net
+    safety_period: int = 60 * 30
+    last_push: Optional[float] = None
     export_period = 60 * 60 * 6  # once every 6 hours
     feed_channel: Any = None
     nsfw_feed_channel: Any = None
     old_db: Any = None
+    journal: Any = None
+    feed_index: Any = None
+    search_index: Any = None
+    bulk_refresh: Any = None
+    metadata_refresher: Any = None
+    export_checkpoint: Any = None
+    last_commit: Any = None
+    # the server whose feed sources/refresh/export use, and other servers mirroring it
+    primary_guild_id: Optional[int] = None
+    guild_config: Any = None
+    mirrors: List[GuildFeeds] = field(default_factory=list)
+    recent_ids: RecentIds = field(default_factory=lambda: RecentIds(maxlen=1000))
+    user_lists: UserListCache = field(
+        default_factory=lambda: UserListCache(window=60 * 60)
+    )
+    # HEAD of mal-id-cache, saved to last_commit once its entries are printed
+    pending_commit: Optional[str] = None
+    posting_lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    # so the export command and export_loop don't export at the same time
+    export_lock: asyncio.Lock = field(default_factory=asyncio.Lock)
 
 
 Globals = GlobalsType()
 
-
-class FileState:
-    """Parent class for managing file states"""
-
-    def __init__(self, filepath):
-        self.filepath = filepath
-
-    def file_exists(self):
-        return os.path.exists(self.filepath)
-
-    def __repr__(self):
-        return f"{self.__class__.__name__}(filepath={self.filepath})"
+startup.mark("imports")
 
 
-class OldDatabase(FileState):
-    """Models and interacts with the 'old' database file"""
-
-    def __init__(self, *, filepath):
-        super().__init__(filepath)
-
-    async def read(self):
-        async with aiofiles.open(self.filepath, mode="r") as old_f:
-            contents = await old_f.read()
-            return set(contents.splitlines())
-
-    async def dump(self, contents):
-        contents = sorted(list(contents), key=int)
-        async with aiofiles.open(self.filepath, mode="w") as old_f:
-            await old_f.write("\n".join(contents))
-            await old_f.flush()
+@log
+async def update_git_repo() -> str:
+    """Updates from the remote mal-id-cache, returns the HEAD commit"""
+    return await id_cache.pull(mal_id_cache_dir)
 
 
 @log
-async def update_git_repo():
-    """Updates from the remote mal-id-cache"""
-    g = Git(mal_id_cache_dir)
-    g.pull()
-    commit_id = g.log().splitlines()[0].split()[-1]
-    logger.debug(f"{g.working_dir} is at commit hash {commit_id}")
+async def read_new_ids(last_commit: Optional[str], commit_id: str) -> List[str]:
+    """
+    Returns IDs added to the cache since last_commit, using the git diff
+    Falls back to reading the whole cache if that isn't possible
+    """
+    if last_commit is not None and Globals.old_db.file_exists():
+        added = await id_cache.added_ids(mal_id_cache_dir, last_commit, commit_id)
+        if added is not None:
+            return list(map(str, added["sfw"] + added["nsfw"]))
+    return await read_json_cache()
 
 
 @log
@@ -123,15 +181,26 @@ async def read_json_cache():
     return list(map(str, contents["sfw"] + contents["nsfw"]))
 
 
+async def reply(ctx: commands.Context, content: Any = None, **kwargs: Any) -> Message:
+    """Replies in the channel the command was sent in"""
+    message: Message = await outbound.send(
+        ctx.channel, Priority.REPLY, content=content, **kwargs
+    )
+    return message
+
+
 def roles_from_context(ctx: commands.Context) -> List[str]:
     assert isinstance(ctx.author, Member)
+    # roles in mirroring servers don't give permissions to edit the main feed
+    if ctx.guild is None or ctx.guild.id != Globals.primary_guild_id:
+        return []
     return [role.name.lower() for role in ctx.author.roles]
 
 
 @client.event
 @log
 async def on_ready():  # include so that on_ready event shows up in logs
-    pass
+    startup.mark("ready")
 
 
 # override on_message so we can remove double spaces after the bot name,
@@ -140,72 +209,245 @@ async def on_ready():  # include so that on_ready event shows up in logs
 async def on_message(message):
     # remove weird spaces
     message.content = re.sub(r"\s{2,}", " ", message.content)
+    index_feed_message(message)
     await client.process_commands(message)
 
 
+@client.event
+async def on_message_edit(before: Message, after: Message) -> None:
+    index_feed_message(after)
+
+
+@client.event
+async def on_raw_message_delete(payload: RawMessageDeleteEvent) -> None:
+    if Globals.feed_index is not None:
+        Globals.feed_index.remove_message(payload.message_id)
+    if Globals.search_index is not None:
+        Globals.search_index.remove_message(payload.message_id)
+
+
+def is_feed_channel(channel: Any) -> bool:
+    return channel is not None and channel in (
+        Globals.feed_channel,
+        Globals.nsfw_feed_channel,
+    )
+
+
+def mal_id_from_message(message: Message) -> Optional[int]:
+    """Returns the MAL ID from a feed messages embed, if it has one"""
+    entry = parse_feed_message(message)
+    return None if entry is None else entry.mal_id
+
+
+def index_feed_message(message: Message) -> None:
+    """Keeps the feed/search indexes up to date with messages the bot sends/edits"""
+    if Globals.feed_index is None or not is_feed_channel(message.channel):
+        return
+    if message.author != client.user:
+        return
+    mal_id = mal_id_from_message(message)
+    if mal_id is not None:
+        Globals.feed_index.set(mal_id, message.channel.id, message.id)
+        if Globals.search_index is not None:
+            Globals.search_index.update(
+                mal_id, message.channel.id, message.id, message.embeds[0]
+            )
+
+
+def message_link(channel_id: int, message_id: int) -> str:
+    return f"https://discord.com/channels/{Globals.primary_guild_id}/{channel_id}/{message_id}"
+
+
+@log
+async def build_feed_index(channel: TextChannel) -> None:
+    """
+    Walks the entire history of a feed channel once, saving
+    each MAL ID to the feed and search indexes. After that, they're kept up
+    to date by the on_message/on_message_edit/on_raw_message_delete events
+    """
+    if Globals.feed_index.is_built(channel.id) and Globals.search_index.is_built(
+        channel.id
+    ):
+        logger.debug(f"{channel} is already indexed")
+        return
+    rows: List[Tuple[int, int, int]] = []
+    search_rows: List[Row] = []
+    async with HistoryCrawler([channel]) as crawler:
+        async for entry in crawler:
+            rows.append((entry.mal_id, channel.id, entry.message.id))
+            search_rows.append(
+                embed_row(entry.mal_id, channel.id, entry.message.id, entry.embed)
+            )
+    Globals.feed_index.set_many(rows)
+    Globals.feed_index.mark_built(channel.id)
+    Globals.search_index.update_many(search_rows)
+    Globals.search_index.mark_built(channel.id)
+    logger.info(f"Indexed {len(rows)} entries in {channel}")
+
+
 @log
 async def search_feed_for_mal_id(
-    mal_id: int, channel: TextChannel, limit: int = 99999
+    mal_id: int, *channels: TextChannel, limit: int = 99999
 ) -> Optional[Message]:
     """
-    checks a feed channel (which is filled with embeds) for a message
+    checks the feed channels (which are filled with embeds) for a message
+    uses the feed index if possible, only searching the history on a miss
+    the channels are searched at the same time, stopping at the first match
     returns the discord.Message object if it finds it within limit, else return None
     """
-    async for message in channel.history(limit=limit, oldest_first=False):
-        try:
-            embed = message.embeds[0]
-            if embed.url is not None:
-                embed_id = extract_mal_id_from_url(embed.url)
-                if embed_id is not None and int(embed_id) == int(mal_id):
-                    logger.debug("Found message: {}".format(message))
-                    return message
-        except Exception as e:
-            logger.warning("Error while searching history: {}".format(str(e)))
-            continue
+    mal_id = int(mal_id)
+    if Globals.feed_index is not None:
+        for channel in channels:
+            message_id = Globals.feed_index.get(mal_id, channel.id)
+            if message_id is None:
+                continue
+            try:
+                metrics.incr("discord_requests")
+                return await channel.fetch_message(message_id)
+            except errors.NotFound:
+                logger.debug(f"Indexed message {message_id} no longer exists")
+                Globals.feed_index.remove_message(message_id)
+    async with HistoryCrawler(channels, limit=limit) as crawler:
+        async for entry in crawler:
+            if entry.mal_id == mal_id:
+                logger.debug("Found message: {}".format(entry.message))
+                if Globals.feed_index is not None:
+                    Globals.feed_index.set(
+                        mal_id, entry.message.channel.id, entry.message.id
+                    )
+                return entry.message
     return None  # if we've exited the loop
 
 
-async def _export_channel(channel: TextChannel) -> Dict[str, str]:
-    results = {}
-    async for message in channel.history(limit=99999, oldest_first=False):
-        try:
-            embed = message.embeds[0]
-        except:
-            continue
+async def _export_channels(
+    channels: List[TextChannel], after: Optional[Dict[int, Optional[int]]] = None
+) -> AsyncIterator[FeedMessage]:
+    """
+    Yields each entry in the channels, crawling them at the same time
+    If after (a message ID for each channel ID) is given, only messages
+    newer than that are fetched, oldest first
+
+    Every entry seen is also saved to the search index
+    """
+    search_rows: List[Row] = []
+    # only the first message seen for each entry in a channel is indexed, since
+    # rows are flushed in batches and a later batch would replace it. when
+    # newest first thats the newest in its channel
+    indexed: Set[Tuple[int, int]] = set()
+    async with HistoryCrawler(
+        channels,
+        limit=99999 if after is None else None,
+        oldest_first=after is not None,
+        after=after,
+    ) as crawler:
+        async for entry in crawler:
+            channel_id = entry.message.channel.id
+            if after is not None or (entry.mal_id, channel_id) not in indexed:
+                indexed.add((entry.mal_id, channel_id))
+                search_rows.append(
+                    embed_row(entry.mal_id, channel_id, entry.message.id, entry.embed)
+                )
+            if len(search_rows) >= 1000 and Globals.search_index is not None:
+                Globals.search_index.update_many(search_rows)
+                search_rows = []
+            yield entry
+    if Globals.search_index is not None:
+        Globals.search_index.update_many(search_rows)
+
+
+def _merge_export(writer: ExportWriter, changed: Dict[int, Optional[str]]) -> None:
+    """Copies the previous export to writer, replacing/removing (if None) changed sources"""
+    for record in read_export(export_file):
+        if record.mal_id in changed:
+            source = changed.pop(record.mal_id)
+            if source is not None:
+                writer.write(ExportRecord(record.mal_id, source))
         else:
-            if embed.url is None:
-                continue
-            embed_id: Optional[str] = extract_mal_id_from_url(embed.url)
-            if embed_id is not None:
-                source: Optional[str] = get_source(embed)
-                if source is None:
-                    continue
-                results[embed_id] = source
-    return results
+            writer.write(record)
+    for mal_id, source in changed.items():
+        if source is not None:
+            writer.write(ExportRecord(mal_id, source))
 
 
 @log
-async def run_export() -> None:
-    """
-    Iterates through all the messages in the feeds
-    saving any sources to a JSON file
+async def run_export(full: bool = False) -> None:
     """
+    Iterates through the messages in the feeds saving any sources to
+    export_file, streaming them so memory use doesn't grow with the feed
 
-    feed_results: Dict[str, str] = await _export_channel(Globals.feed_channel)
-    nsfw_feed_results: Dict[str, str] = await _export_channel(Globals.nsfw_feed_channel)
-    feed_results.update(nsfw_feed_results)
-    with open(export_file, "w") as f:
-        f.write(json.dumps(feed_results, indent=4))
+    By default, only fetches messages newer than the last export, and merges
+    them and any source edits since then into the previous export. If full is
+    True (or there's no previous export), re-crawls the entire history of each feed
+    """
+    async with Globals.export_lock:
+        checkpoint: ExportCheckpoint = Globals.export_checkpoint
+        edits = dict(checkpoint.edits)
+        full = full or not os.path.exists(export_file)
+        # the newest message exported from each channel. only saved to the
+        # checkpoint once the export has been written, so if it fails part
+        # way through the next export starts from the same place
+        marks: Dict[int, int] = {}
+        channels = [Globals.feed_channel, Globals.nsfw_feed_channel]
+        with ExportWriter(filepath=export_file, exported_at=int(time.time())) as writer:
+            if full:
+                written: Set[int] = set()
+                async for entry in _export_channels(channels):
+                    channel_id, message_id = entry.message.channel.id, entry.message.id
+                    if message_id > marks.get(channel_id, 0):
+                        marks[channel_id] = message_id
+                    if entry.source is not None and entry.mal_id not in written:
+                        written.add(entry.mal_id)
+                        writer.write(ExportRecord(entry.mal_id, entry.source))
+            else:
+                # only the entries which changed since the last export are kept in memory
+                changed: Dict[int, Optional[str]] = {}
+                after = {
+                    channel.id: checkpoint.high_water_mark(channel.id)
+                    for channel in channels
+                }
+                async for entry in _export_channels(channels, after=after):
+                    marks[entry.message.channel.id] = entry.message.id
+                    if entry.source is not None:
+                        changed[entry.mal_id] = entry.source
+                logger.debug(
+                    f"Exporting {len(changed)} new sources, {len(edits)} edits"
+                )
+                changed.update(
+                    {int(mal_id): source for mal_id, source in edits.items()}
+                )
+                await asyncio.to_thread(_merge_export, writer, changed)
+        if full:
+            checkpoint.reset_high_water_marks()
+        for channel_id, message_id in marks.items():
+            checkpoint.set_high_water_mark(channel_id, message_id)
+        metrics.set_gauge("export_records", writer.count)
+        metrics.set_gauge("export_bytes", os.path.getsize(export_file))
+        # remove edits which have been applied, unless they changed while we were exporting
+        for edited_id, edit in edits.items():
+            if checkpoint.edits.get(edited_id, edit) == edit:
+                checkpoint.edits.pop(edited_id, None)
+        checkpoint.save()
+
+
+# discord's attachment size limit, the export is split into parts smaller than this
+MAX_ATTACHMENT_BYTES = int(os.environ.get("MAX_ATTACHMENT_BYTES", 8 * 1024 * 1024))
+# and the number of attachments per message
+MAX_ATTACHMENTS = 10
 
 
 @client.command()
 @log
-async def export(ctx):
+async def export(ctx: commands.Context, mode: str = "") -> None:
     if TRUSTED_ROLE not in roles_from_context(ctx):
-        await ctx.channel.send("Insufficient permissions")
+        await reply(ctx, "Insufficient permissions")
         return
-    await run_export()
-    await ctx.channel.send(file=File(export_file))
+    await run_export(full=mode.strip().lower() == "full")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        parts = await asyncio.to_thread(
+            split_export, export_file, MAX_ATTACHMENT_BYTES, tmp_dir
+        )
+        for i in range(0, len(parts), MAX_ATTACHMENTS):
+            await reply(ctx, files=[File(p) for p in parts[i : i + MAX_ATTACHMENTS]])
 
 
 async def export_loop():
@@ -218,40 +460,154 @@ async def export_loop():
         await sleep(Globals.export_period)
 
 
+@log
+async def validate_startup() -> None:
+    """
+    sanity checks on the data files, run once connected so
+    they don't delay logging in
+    """
+    old_db: OldDatabase = Globals.old_db
+    if not old_db.file_exists():
+        logger.critical(
+            f"Neither {old_db_snapshot_file} nor {old_db_file} (to import from) exist"
+        )
+        sys.exit(1)
+    # arbitrary check to make sure the olddb (the snapshot and its log) isn't empty
+    if len(old_db) <= 1000:
+        logger.critical(
+            f"{old_db_snapshot_file} only has {len(old_db)} IDs, it may have been truncated"
+        )
+        sys.exit(1)
+
+
+def update_mirrors() -> None:
+    if Globals.guild_config is None or Globals.primary_guild_id is None:
+        return
+    primary = Object(id=Globals.primary_guild_id)
+    Globals.mirrors = Globals.guild_config.mirrors(client.guilds, primary)
+    logger.info(f"Mirroring the feed to {len(Globals.mirrors)} other servers")
+
+
+@client.event
+async def on_guild_join(guild: Guild) -> None:
+    update_mirrors()
+
+
+@client.event
+async def on_guild_remove(guild: Guild) -> None:
+    update_mirrors()
+
+
 # run in event loop
 @log
 async def print_loop() -> None:
     """main loop - checks if entries exist periodically and prints them"""
     await client.wait_until_ready()
+    # authenticate with MAL in the background, instead of on the first request
+    mal_client.warm()
+    dbsentinel.start()
     # setup global variables
-    guilds = list(iter(client.guilds))
-    if len(guilds) != 1:
-        logger.critical("This bot should only be used on one server")
+    Globals.guild_config = GuildConfig(filepath=guilds_file)
+    primary = Globals.guild_config.primary_guild(list(client.guilds))
+    if primary is None:
+        logger.critical(
+            f"Couldn't find the primary server, set 'primary' in {guilds_file}"
+        )
         sys.exit(1)
-    channels = guilds[0].channels
-    Globals.feed_channel = get(channels, name="feed")
-    Globals.nsfw_feed_channel = get(channels, name="nsfw-feed")
+    Globals.primary_guild_id = primary.id
+    feeds = Globals.guild_config.resolve(primary)
+    Globals.feed_channel = feeds.feed if feeds else None
+    Globals.nsfw_feed_channel = feeds.nsfw_feed if feeds else None
+    update_mirrors()
     if Globals.feed_channel is None:
         logger.critical("Couldn't find the 'feed' channel")
     if Globals.nsfw_feed_channel is None:
         logger.critical("Couldn't find the 'nsfw-feed' channel")
-    Globals.old_db = OldDatabase(filepath=old_db_file)
+    Globals.old_db = OldDatabase(filepath=old_db_snapshot_file, import_from=old_db_file)
+    await Globals.old_db.load()
+    await validate_startup()
+    Globals.journal = PostingJournal(filepath=journal_file)
+    Globals.journal.load()
+    startup.mark("old_db")
+    Globals.feed_index = FeedIndex(filepath=feed_index_file)
+    Globals.search_index = SearchIndex(filepath=search_index_file)
+    Globals.export_checkpoint = ExportCheckpoint(filepath=export_checkpoint_file)
+    Globals.last_commit = id_cache.LastCommit(filepath=last_commit_file)
+    Globals.bulk_refresh = BulkRefresh(
+        RefreshCheckpoint(filepath=refresh_checkpoint_file),
+        refresh_feed_entry,
+        concurrency=int(os.environ.get("BULK_REFRESH_CONCURRENCY", 4)),
+    )
+    Globals.metadata_refresher = MetadataRefresher(
+        filepath=refreshed_file,
+        candidates=lambda: Globals.search_index.entries(
+            [Globals.feed_channel.id, Globals.nsfw_feed_channel.id]
+        ),
+        refresh_one=refresh_feed_entry,
+        # MAL requests per hour, 0 to disable
+        budget=float(os.environ.get("MAL_REFRESH_BUDGET", 60)),
+    )
+    startup.mark("initialized")
+    index_builds = {
+        channel: client.loop.create_task(build_feed_index(channel))
+        for channel in (Globals.feed_channel, Globals.nsfw_feed_channel)
+    }
+    client.loop.create_task(resume_bulk_refresh(index_builds))
+    client.loop.create_task(run_metadata_refresher(index_builds))
     client.loop.create_task(export_loop())
     while not client.is_closed():
         # if there are new entries, print them
-        await print_new_embeds()
-        logger.debug(f"Sleeping for {Globals.period}")
-        await sleep(Globals.period)
+        try:
+            await print_new_embeds()
+        except Exception:
+            # e.g. discord or MAL being down, tried again next poll
+            logger.exception("Couldn't print new entries")
+        period = poll_period()
+        logger.debug(f"Sleeping for {period}")
+        await sleep(period)
+
+
+def poll_period() -> int:
+    """Polls less often while IDs are being pushed to /ingest"""
+    if (
+        Globals.last_push is not None
+        and time.time() - Globals.last_push < Globals.safety_period * 2
+    ):
+        return Globals.safety_period
+    return Globals.period
+
+
+# most IDs a single push can post, anything more is left for polling
+MAX_PUSHED_IDS = 500
+
+
+@log
+async def ingest_ids(ids: List[int]) -> None:
+    """
+    Posts IDs pushed by the checker as soon as they're approved, instead
+    of waiting for them to be pushed to mal-id-cache and polled
+    """
+    Globals.last_push = time.time()
+    if Globals.old_db is None or Globals.feed_channel is None:
+        logger.info(f"Not initialized yet, leaving {ids} for polling")
+        return
+    new_ids = sorted({i for i in ids if i not in Globals.old_db})[:MAX_PUSHED_IDS]
+    if not new_ids:
+        return
+    metrics.incr("pushed_ids", len(new_ids))
+    # any which fail are left for polling
+    await fetch_new_entries(new_ids)
+    await post_new_embeds()
 
 
 @client.command()
 @log
 async def add_new(ctx):
     if TRUSTED_ROLE not in roles_from_context(ctx):
-        await ctx.channel.send("Insufficient permissions")
+        await reply(ctx, "Insufficient permissions")
         return
     await print_new_embeds()
-    await ctx.channel.send("Done!")
+    await reply(ctx, "Done!")
     return
 
 
@@ -259,30 +615,36 @@ async def add_new(ctx):
 @log
 async def restart(ctx):
     if ADMIN_ROLE not in roles_from_context(ctx):
-        await ctx.channel.send("Insufficient permissions")
+        await reply(ctx, "Insufficient permissions")
         return
-    await ctx.channel.send("Restarting...")
+    await reply(ctx, "Restarting...")
     sys.exit(0)
 
 
 @log
-async def create_new_embeds(
-    ctx: Optional[commands.Context] = None,
-) -> List[Tuple[Embed, bool]]:
+async def create_new_embeds(ctx: Optional[commands.Context] = None) -> None:
     """
-    git pulls, reads the json cache, and returns new embeds if they exist
-    this *is* blocking, but temporarily blocking seems better than managing multiple processes
+    git pulls, finds IDs added to the cache, and adds their embeds to the journal
+    if HEAD hasn't changed since the last processed commit, there's nothing to do
     """
-    await update_git_repo()
-    ids = await read_json_cache()
+    try:
+        commit_id = await update_git_repo()
+    except (GitCommandError, asyncio.TimeoutError) as e:
+        # e.g. github being slow, git is killed after a timeout
+        logger.warning(f"Couldn't pull mal-id-cache, skipping this poll: {e}")
+        return
+    last_commit = Globals.last_commit.read()
+    if commit_id == last_commit:
+        logger.debug(f"Already processed {commit_id}, skipping")
+        return
+    ids = await read_new_ids(last_commit, commit_id)
     new_ids = []
     if not Globals.old_db.file_exists():
         logger.info(f"{Globals.old_db.filepath} didn't exist, creating...")
-        with open(Globals.old_db.filepath):
-            await Globals.old_db.dump(ids)
+        await Globals.old_db.add_many(map(int, ids))
+        await Globals.old_db.compact()
     else:
-        old_ids = await Globals.old_db.read()
-        new_ids = sorted(list(set(ids) - set(old_ids)))
+        new_ids = sorted([i for i in ids if i not in Globals.old_db], key=int)
         logger.debug(f"new ids: {truncate(new_ids, 200)}")
         logger.debug(f"({len(new_ids)} new ids)")
 
@@ -292,100 +654,215 @@ async def create_new_embeds(
         error_message = f"There were {len(new_ids)} new entries, there must have been an error writing to the old_db file at '{Globals.old_db.filepath}'"
         logger.warning(error_message)
         if ctx:
-            await ctx.channel.send(error_message)
-        return []
+            await reply(ctx, error_message)
+        return
 
-    new_embeds = []
-    for new_id in new_ids:
-        await sleep(0)  # allow other items in the asyncio loop to run
-        new_embed = await create_embed(int(new_id), logger)
-        new_embeds.append(new_embed)
-    return new_embeds
+    failed = await fetch_new_entries([int(new_id) for new_id in new_ids])
+    if failed:
+        # pending_commit isn't set, so the next poll reads this commit's
+        # IDs again, and fetches the ones which aren't in the journal yet
+        logger.warning(
+            f"Couldn't fetch {len(failed)} new entries, retrying them next poll"
+        )
+        return
+    Globals.pending_commit = commit_id
+
+
+async def fetch_new_entries(new_ids: List[int]) -> List[int]:
+    """
+    Creates the embeds for new IDs, saving each to the journal as soon as
+    its fetched. IDs which are already in the journal aren't fetched again
+    Returns the IDs which couldn't be fetched
+    """
+    journal: PostingJournal = Globals.journal
+
+    async def _fetch(mal_id: int) -> None:
+        embed, sfw = await create_embed(mal_id, logger)
+        await journal.record(mal_id, "fetched", embed=embed.to_dict(), sfw=sfw)
+
+    to_fetch = [i for i in new_ids if i not in journal]
+    # requests run concurrently, the MAL client rate limits them
+    results = await asyncio.gather(
+        *(_fetch(mal_id) for mal_id in to_fetch), return_exceptions=True
+    )
+    failed: List[int] = []
+    for mal_id, result in zip(to_fetch, results):
+        if isinstance(result, BaseException):
+            logger.warning(f"Couldn't create embed for {mal_id}: {result}")
+            failed.append(mal_id)
+    return failed
 
 
 @log
 async def print_new_embeds():
-    old_ids = await Globals.old_db.read()
     # prevent broken old files from printing a bunch of messages
-    assert len(old_ids) > 10000
-    for embed, sfw in await create_new_embeds():
-        print_to_channel = Globals.feed_channel if sfw else Globals.nsfw_feed_channel
-        assert embed.url is not None, f"{embed.to_dict()}"
-        new_mal_id = extract_mal_id_from_url(embed.url)
-        assert new_mal_id is not None
-        # check if that message already exists in the channel
-        previous_message = await search_feed_for_mal_id(
-            mal_id=int(new_mal_id), channel=print_to_channel, limit=1000
-        )
-        if previous_message is not None:
-            logger.debug(
-                f"While attempting to print new id {new_mal_id}, found previously printed message: {previous_message}"
-            )
-        else:
-            logger.debug(
-                f"Couldn't find any message with id {new_mal_id}, printing new message"
-            )
-        if (
-            new_mal_id not in old_ids and previous_message is None
-        ):  # make sure we're not printing entries twice
-            logger.debug(
-                "Printing {} to {}".format(new_mal_id, "#feed" if sfw else "#nsfw-feed")
-            )
-            await print_to_channel.send(embed=embed)
-        await sleep(2)
-        # check that we actually printed the embed
-        printed_message = await search_feed_for_mal_id(
-            mal_id=int(new_mal_id), channel=print_to_channel, limit=1000
-        )
-        if printed_message:
-            logger.debug(
-                f"Found printed message in channel, adding {new_mal_id} to old ids"
-            )
-            old_ids.add(new_mal_id)
-            logger.debug("Attempting to publish message...")
+    assert len(Globals.old_db) > 10000
+    try:
+        await create_new_embeds()
+    finally:
+        # post anything in the journal, even if fetching some of them failed
+        await post_new_embeds()
+    # everything from this commit has been printed
+    if Globals.pending_commit is not None and len(Globals.journal) == 0:
+        Globals.last_commit.write(Globals.pending_commit)
+        Globals.pending_commit = None
+
+
+async def post_new_embeds() -> None:
+    """
+    Posts each entry in the journal, resuming from the last stage it completed
+    Polling and pushed IDs can both find the same entry, so only one posts at a time
+
+    If discord errors, the rest are left in the journal to retry next time,
+    unless its a client error (other than a 429) for that entry, which is skipped
+    """
+    journal: PostingJournal = Globals.journal
+    async with Globals.posting_lock:
+        for entry in list(journal):
+            if entry.mal_id in Globals.old_db:
+                logger.debug(f"{entry.mal_id} is already in old ids, skipping")
+                await journal.done(entry.mal_id)
+                continue
             try:
-                await printed_message.publish()
-            except Exception as publish_err:
-                logger.warning(f"Couldn't publish message {publish_err}")
-        else:
-            logger.warning(
-                f"Couldn't find printed message for id {new_mal_id} in channel"
+                await post_journaled(entry)
+            except errors.HTTPException as send_err:
+                if 400 <= send_err.status < 500 and send_err.status != 429:
+                    # retrying won't help (e.g. an invalid embed, or missing
+                    # permissions), so skip it instead of blocking the rest
+                    logger.error(
+                        f"Couldn't print message for id {entry.mal_id}, giving up: {send_err}"
+                    )
+                    if entry.reached("sent"):
+                        # its in the feed, so it shouldn't be posted again
+                        await Globals.old_db.add(entry.mal_id)
+                    await journal.failed(entry.mal_id, str(send_err))
+                    continue
+                logger.warning(
+                    f"Couldn't print message for id {entry.mal_id}, will retry: {send_err}"
+                )
+                return
+
+
+async def find_sent_message(
+    channel: TextChannel, mal_id: int, sending_at: float
+) -> Optional[Message]:
+    """
+    Checks the messages sent since 'sending_at' for the entry, for when
+    the bot stopped while it was being sent. Only reads what was posted since
+    """
+    # a minute of leeway, for clock differences
+    after = time_snowflake(datetime.fromtimestamp(sending_at - 60))
+    async with HistoryCrawler(
+        [channel], oldest_first=True, after={channel.id: after}
+    ) as crawler:
+        async for entry in crawler:
+            if entry.mal_id == mal_id:
+                return entry.message
+    return None
+
+
+async def post_journaled(entry: JournalEntry) -> None:
+    """
+    Takes one entry through the rest of its stages, recording each in the journal:
+    fetched -> sending -> sent (the message ID) -> verified (indexed) -> published
+    (crossposted, and sent to the other servers), and then adds it to old_db
+    """
+    journal: PostingJournal = Globals.journal
+    mal_id = entry.mal_id
+    embed = Embed.from_dict(entry.embed)
+    channel = Globals.feed_channel if entry.sfw else Globals.nsfw_feed_channel
+    logger.debug(f"Printing {mal_id} to {channel} from stage {entry.stage}")
+
+    async def _primary() -> None:
+        message: Optional[Message] = None
+        if entry.stage == "sending":
+            assert entry.sending_at is not None
+            message = await find_sent_message(channel, mal_id, entry.sending_at)
+        elif entry.message_id is not None:
+            try:
+                metrics.incr("discord_requests")
+                message = await channel.fetch_message(entry.message_id)
+            except errors.NotFound:
+                if entry.reached("verified"):
+                    # deleted since, so there's nothing to publish
+                    return
+        elif already_posted(mal_id, channel, Globals.recent_ids, Globals.feed_index):
+            # e.g. old_db was restored from a backup
+            logger.debug(f"{mal_id} was already posted to {channel}, skipping")
+            return
+        if message is None:
+            await journal.sending(mal_id, channel.id)
+            message = await outbound.send(channel, Priority.FEED, embed=embed)
+        if entry.message_id != message.id:
+            await journal.record(mal_id, "sent", message_id=message.id)
+        if not entry.reached("verified"):
+            # the message send returns confirms it was posted
+            mark_posted(
+                mal_id,
+                channel,
+                message,
+                recent=Globals.recent_ids,
+                feed_index=Globals.feed_index,
             )
-            sys.exit(1)
-    await Globals.old_db.dump(old_ids)
+            index_feed_message(message)
+            await journal.record(mal_id, "verified")
+        await publish(message)
+
+    if not entry.reached("published"):
+        # the embed is built once and sent to every server at the same time,
+        # mirrors check the feed index so they aren't posted twice either
+        await asyncio.gather(
+            _primary(),
+            fan_out(
+                Globals.mirrors,
+                embed,
+                mal_id,
+                entry.sfw,
+                recent=Globals.recent_ids,
+                feed_index=Globals.feed_index,
+                concurrency=FANOUT_CONCURRENCY,
+            ),
+        )
+        await journal.record(mal_id, "published")
+    await Globals.old_db.add(mal_id)
+    await journal.done(mal_id)
 
 
 @client.command()
 @log
 async def test_log(ctx):
     if ADMIN_ROLE not in roles_from_context(ctx):
-        await ctx.channel.send("Insufficient permissions")
+        await reply(ctx, "Insufficient permissions")
         return
     message = "test message. beep boop"
-    await Globals.feed_channel.send(message)
-    await Globals.nsfw_feed_channel.send(message)
+    await outbound.send(Globals.feed_channel, Priority.FEED, content=message)
+    await outbound.send(Globals.nsfw_feed_channel, Priority.FEED, content=message)
 
 
 @client.command()
 @log
 async def index(ctx: commands.Context, pages: int) -> None:
     if ADMIN_ROLE not in roles_from_context(ctx):
-        await ctx.channel.send("Insufficient permissions")
+        await reply(ctx, "Insufficient permissions")
         return
     # communicates with the https://github.com/Hiyori-API/checker_mal
     # instance to tell it to index more pages
-    resp = requests.get(f"http://localhost:4001/api/pages?type=anime&pages={pages}")
-    resp.raise_for_status()
-    await ctx.channel.send(
-        f"Successfully submitted request to index {pages} anime pages"
-    )
+    try:
+        status, _ = await checker_mal.get("/api/pages", type="anime", pages=pages)
+    except (aiohttp.ClientError, asyncio.TimeoutError, ServiceUnavailable) as e:
+        await reply(ctx, f"Couldn't connect to checker_mal: {e}")
+        return
+    if status != 200:
+        await reply(ctx, f"checker_mal responded with {status}")
+        return
+    await reply(ctx, f"Successfully submitted request to index {pages} anime pages")
 
 
 @client.command()
 @log
 async def source(ctx: commands.Context, mal_id: int, *, links: str) -> None:
     if TRUSTED_ROLE not in roles_from_context(ctx):
-        await ctx.channel.send("Insufficient permissions")
+        await reply(ctx, "Insufficient permissions")
         return
     adding_source = True
     possible_command: str = links.strip().lower()
@@ -404,102 +881,274 @@ async def source(ctx: commands.Context, mal_id: int, *, links: str) -> None:
     # get logs from feed
     message = await search_feed_for_mal_id(int(mal_id), Globals.feed_channel)
     if not message:
-        await ctx.channel.send(
+        await reply(
+            ctx,
             "Could not find a message that contains the MAL id {} in {}".format(
                 mal_id, Globals.feed_channel.mention
-            )
+            ),
         )
         return
     else:
         embed = message.embeds[0]
+        entry = FeedEntry.from_embed(embed)
         if adding_source:
             logger.debug(f"Editing {message} to include {valid_links}")
-            new_embed, is_new_source = await add_source(embed, valid_links)
-            await message.edit(embed=new_embed)
-            await ctx.channel.send(
+            new_entry, is_new_source = add_source(entry, valid_links)
+            if new_entry == entry:
+                await reply(ctx, f"'{embed.title}' already has that source.")
+                return
+            edited = await outbound.edit(
+                message, Priority.REPLY, embed=new_entry.to_embed()
+            )
+            index_feed_message(edited)
+            Globals.export_checkpoint.record_source(mal_id, new_entry.source)
+            await reply(
+                ctx,
                 "{} source for '{}' successfully.".format(
                     "Added" if is_new_source else "Replaced", embed.title
-                )
+                ),
             )
             return
         else:
-            new_embed = await remove_source(embed)
-            await message.edit(embed=new_embed)
-            await ctx.channel.send(
-                "Removed source for '{}' successfully.".format(embed.title)
+            if entry.source is None:
+                await reply(ctx, f"'{embed.title}' doesn't have a source.")
+                return
+            new_entry = remove_source(entry)
+            edited = await outbound.edit(
+                message, Priority.REPLY, embed=new_entry.to_embed()
+            )
+            index_feed_message(edited)
+            Globals.export_checkpoint.record_source(mal_id, None)
+            await reply(
+                ctx, "Removed source for '{}' successfully.".format(embed.title)
             )
             return
 
 
-dbsentinel_base_url = "http://localhost:5200"
-
-
 @client.command()
 @log
 async def refresh(ctx: commands.Context, mal_id: int) -> None:
     async def _update_embed() -> None:
         remove_image = "remove image" in ctx.message.content.lower()
         message = await search_feed_for_mal_id(
-            int(mal_id), Globals.feed_channel, limit=999999
+            int(mal_id),
+            Globals.feed_channel,
+            Globals.nsfw_feed_channel,
+            limit=999999,
         )
-        if not message:  # search nsfw channel
-            message = await search_feed_for_mal_id(
-                int(mal_id), Globals.nsfw_feed_channel, limit=999999
-            )
         if message:
             embed = message.embeds[0]
-            new_embed = await refresh_embed(embed, mal_id, remove_image, logger)
-            await message.edit(embed=new_embed)
-            await ctx.channel.send(
+            entry = FeedEntry.from_embed(embed)
+            new_entry = await refresh_entry(entry, mal_id, remove_image, logger)
+            if Globals.metadata_refresher is not None:
+                Globals.metadata_refresher.mark_refreshed(mal_id)
+            if new_entry == entry:
+                await reply(ctx, f"'{embed.title}' is already up to date.")
+                return
+            logger.debug(f"Refreshing {entry.diff(new_entry)} for {mal_id}")
+            edited = await outbound.edit(
+                message, Priority.REPLY, embed=new_entry.to_embed()
+            )
+            index_feed_message(edited)
+            await reply(
+                ctx,
                 "{} for '{}' successfully.".format(
                     "Removed image" if remove_image else "Updated fields", embed.title
-                )
+                ),
             )
         else:
-            await ctx.channel.send(
-                "Could not find a message that contains the MAL id {}".format(mal_id)
+            await reply(
+                ctx,
+                "Could not find a message that contains the MAL id {}".format(mal_id),
             )
 
     async def _dbsentinel_update() -> None:
-        async with aiohttp.ClientSession() as async_client:
-            if (await async_client.get(f"{dbsentinel_base_url}/ping")).status == 200:
-                logger.debug(
-                    f"dbsentinel is online, sending refresh request for {mal_id}"
-                )
-                resp = await async_client.get(
-                    f"{dbsentinel_base_url}/tasks/refresh_entry?entry_type=anime&entry_id={mal_id}"
-                )
-                if resp.status == 200:
-                    logger.debug(
-                        f"Successfully refreshed data on {mal_id} on dbsentinel"
-                    )
-                    await ctx.channel.send(
-                        f"Successfully refreshed data for {mal_id} on dbsentinel: <https://sean.fish/dbsentinel/anime/{mal_id}>"
-                    )
-                else:
-                    logger.warning(
-                        f"Failed to refresh data for {mal_id} on dbsentinel: {resp.text} {resp.text}"
-                    )
-                    error = str(resp.status)
-                    try:
-                        error = (await resp.json())["error"]
-                    except:
-                        pass
-                    await ctx.channel.send(
-                        f"Failed to refresh data for {mal_id} on dbsentinel: {error}"
-                    )
-            else:
-                logger.warning(
-                    f"dbsentinel is offline, skipping refresh request for {mal_id}"
-                )
-                await ctx.channel.send(
-                    f"dbsentinel is offline, skipping refresh request for {mal_id}"
-                )
+        # health is probed in the background, so this doesn't ping it first
+        if not dbsentinel.available:
+            logger.warning(
+                f"dbsentinel is offline, skipping refresh request for {mal_id}"
+            )
+            await reply(
+                ctx, f"dbsentinel is offline, skipping refresh request for {mal_id}"
+            )
+            return
+        logger.debug(f"dbsentinel is online, sending refresh request for {mal_id}")
+        error = await dbsentinel.refresh_entry(mal_id)
+        if error is None:
+            logger.debug(f"Successfully refreshed data on {mal_id} on dbsentinel")
+            await reply(
+                ctx,
+                f"Successfully refreshed data for {mal_id} on dbsentinel: <https://sean.fish/dbsentinel/anime/{mal_id}>",
+            )
+        else:
+            logger.warning(
+                f"Failed to refresh data for {mal_id} on dbsentinel: {error}"
+            )
+            await reply(
+                ctx,
+                f"Failed to refresh data for {mal_id} on dbsentinel: {error}",
+            )
 
     # run both refreshes in parallel
     await asyncio.gather(_update_embed(), _dbsentinel_update())
 
 
+async def find_indexed_message(mal_id: int) -> Optional[Message]:
+    """Finds the entry in either feed using only the feed index, never the history"""
+    for channel in (Globals.feed_channel, Globals.nsfw_feed_channel):
+        message_id = Globals.feed_index.get(mal_id, channel.id)
+        if message_id is None:
+            continue
+        try:
+            metrics.incr("discord_requests")
+            message: Message = await channel.fetch_message(message_id)
+            return message
+        except errors.NotFound:
+            Globals.feed_index.remove_message(message_id)
+    return None
+
+
+async def refresh_feed_entry(mal_id: int) -> bool:
+    """Refreshes the embed in the background, returns False if it isn't in the feed"""
+    message = await find_indexed_message(mal_id)
+    if message is None:
+        return False
+    entry = FeedEntry.from_embed(message.embeds[0])
+    new_entry = await refresh_entry(entry, mal_id, False, logger)
+    if Globals.metadata_refresher is not None:
+        Globals.metadata_refresher.mark_refreshed(mal_id)
+    # most entries haven't changed since they were posted
+    if new_entry == entry:
+        metrics.incr("unchanged_refreshes")
+    else:
+        edited = await outbound.edit(
+            message, Priority.BACKGROUND, embed=new_entry.to_embed()
+        )
+        index_feed_message(edited)
+    # sent in batches, so a bulk refresh doesn't wait on dbsentinel
+    dbsentinel.refresh_nowait(mal_id)
+    return True
+
+
+def bulk_refresh_status(message: Optional[Message]) -> Callable[[str], None]:
+    """Edits the bulk refresh status message, pending edits are coalesced by outbound"""
+
+    def _update(text: str) -> None:
+        logger.info(text)
+        if message is not None:
+            outbound.edit_nowait(message, Priority.PROGRESS, content=text)
+
+    return _update
+
+
+IndexBuilds = Dict[TextChannel, "asyncio.Task[None]"]
+
+
+async def wait_for_index_builds(index_builds: IndexBuilds) -> List[int]:
+    """Waits for the feed channels to be indexed, returns the IDs of the ones which were"""
+    results = await asyncio.gather(*index_builds.values(), return_exceptions=True)
+    built: List[int] = []
+    for channel, result in zip(index_builds, results):
+        if isinstance(result, BaseException):
+            logger.error(f"Couldn't index {channel}: {result!r}")
+        else:
+            built.append(channel.id)
+    return built
+
+
+async def resume_bulk_refresh(index_builds: IndexBuilds) -> None:
+    checkpoint: RefreshCheckpoint = Globals.bulk_refresh.checkpoint
+    if not checkpoint.active:
+        return
+    # refreshes find entries using the feed index, entries in a channel
+    # which couldn't be indexed are counted as missing
+    await wait_for_index_builds(index_builds)
+    if not checkpoint.active:
+        # cancelled while waiting
+        return
+    message: Optional[Message] = None
+    if checkpoint.status is not None:
+        channel_id, message_id = checkpoint.status
+        try:
+            message = await client.get_channel(channel_id).fetch_message(message_id)  # type: ignore[union-attr]
+        except Exception as e:
+            logger.warning(f"Couldn't find the bulk refresh status message: {e}")
+    logger.info(f"Resuming bulk refresh, {len(checkpoint.remaining)} entries left")
+    Globals.bulk_refresh.resume(bulk_refresh_status(message))
+
+
+async def run_metadata_refresher(index_builds: IndexBuilds) -> None:
+    # entries are picked from the search index, so only
+    # refresh the channels which were indexed
+    built = await wait_for_index_builds(index_builds)
+    if not built:
+        logger.error("No feed channels were indexed, not refreshing metadata")
+        return
+    Globals.metadata_refresher.candidates = lambda: Globals.search_index.entries(built)
+    await Globals.metadata_refresher.run()
+
+
+def parse_bulk_refresh(mode: str, args: Tuple[str, ...]) -> List[int]:
+    """Returns the IDs to refresh, for: ids <id...>, range <low> <high>, last <n>, all"""
+    channels = [Globals.feed_channel.id, Globals.nsfw_feed_channel.id]
+    if mode == "ids":
+        ids = [int(i) for arg in args for i in arg.split(",") if i.strip()]
+        return list(dict.fromkeys(ids))
+    if mode == "range":
+        low, high = int(args[0]), int(args[1])
+        return Globals.feed_index.mal_ids(channels, low=low, high=high)
+    if mode == "last":
+        return list(dict.fromkeys(Globals.feed_index.recent(channels, int(args[0]))))
+    if mode == "all":
+        return Globals.feed_index.mal_ids(channels)
+    raise ValueError(f"Unknown mode '{mode}'")
+
+
+@client.command()
+@log
+async def bulk_refresh(ctx: commands.Context, mode: str, *args: str) -> None:
+    if TRUSTED_ROLE not in roles_from_context(ctx):
+        await reply(ctx, "Insufficient permissions")
+        return
+    job: BulkRefresh = Globals.bulk_refresh
+    mode = mode.strip().lower()
+    if mode == "status":
+        await reply(ctx, job.summary() if job.running else "No bulk refresh is running")
+        return
+    if mode == "cancel":
+        # a saved refresh which hasn't resumed yet can be cancelled too
+        if not job.running and not job.checkpoint.active:
+            await reply(ctx, "No bulk refresh is running")
+            return
+        job.cancel()
+        await reply(ctx, "Cancelled the bulk refresh")
+        return
+    if job.running:
+        await reply(
+            ctx, f"A bulk refresh is already running ({job.summary()}), cancel it first"
+        )
+        return
+    if not all(
+        Globals.feed_index.is_built(c.id)
+        for c in (Globals.feed_channel, Globals.nsfw_feed_channel)
+    ):
+        await reply(ctx, "The feed is still being indexed, try again in a few minutes")
+        return
+    try:
+        ids = parse_bulk_refresh(mode, args)
+    except (ValueError, IndexError) as e:
+        await reply(
+            ctx,
+            f"Couldn't parse that ({e}). Use `ids <id...>`, `range <low> <high>`, `last <n>` or `all`",
+        )
+        return
+    if not ids:
+        await reply(ctx, "There aren't any entries in the feed to refresh")
+        return
+    message = await reply(ctx, f"Refreshing {len(ids)} entries...")
+    job.start(ids, (message.channel.id, message.id), bulk_refresh_status(message))
+
+
 CHECK_DISABLED = False
 
 
@@ -507,88 +1156,126 @@ CHECK_DISABLED = False
 @log
 async def check(ctx: commands.Context, mal_username: str, num: int) -> None:
     if CHECK_DISABLED:
-        await ctx.channel.send("check is currently disabled")
+        await reply(ctx, "check is currently disabled")
         return
     leftover_args = " ".join(ctx.message.content.strip().split()[4:])
     print_all = "all" in leftover_args.lower()
     print_not_completed = "not completed" in leftover_args.lower()
-    message = await ctx.channel.send(
-        "Downloading {}'s list (downloaded 0 anime entries...)".format(mal_username)
-    )
-    parsed: Dict[int, str] = {}
-    for resp in download_users_list(mal_username):
-        if "my_list_status" not in resp:
-            continue
-        parsed[int(resp["id"])] = str(resp["my_list_status"]["status"])
-        if len(parsed) > 0 and len(parsed) % 100 == 0:
-            await message.edit(
-                content=f"Downloading {mal_username}'s list (downloaded {len(parsed)} anime entries...)"
-            )
-    await message.edit(
-        content=f"Downloaded {mal_username}'s list (downloaded {len(parsed)} anime entries...)"
-    )
-    found_entry = False  # mark True if we find an entry the user hasn't watched
-    async for message in Globals.feed_channel.history(limit=num, oldest_first=False):
-        try:
-            embed = message.embeds[0]
-        except Exception:
-            continue
-        source_exists = "Source" in [f.name for f in embed.fields]
-        if source_exists or print_all:
-            assert embed.url, f"Could not find url in {embed}"
-            mal_id_str = extract_mal_id_from_url(embed.url)
-            assert mal_id_str, f"Could not extract url from {embed.url}"
-            mal_id = int(mal_id_str)
+    user_list = await Globals.user_lists.get(mal_username)
+    if user_list is None:
+        message = await reply(
+            ctx,
+            "Downloading {}'s list (downloaded 0 anime entries...)".format(
+                mal_username
+            ),
+        )
+        user_list = UserList()
+        async for resp in download_users_list(mal_username):
+            user_list.add(resp)
+            count = len(user_list.statuses)
+            if count > 0 and count % 1000 == 0:
+                outbound.edit_nowait(
+                    message,
+                    Priority.PROGRESS,
+                    content=f"Downloading {mal_username}'s list (downloaded {count} anime entries...)",
+                )
+        Globals.user_lists.put(mal_username, user_list)
+        await outbound.edit(
+            message,
+            Priority.PROGRESS,
+            content=f"Downloaded {mal_username}'s list (downloaded {len(user_list.statuses)} anime entries...)",
+        )
+    else:
+        await reply(
+            ctx,
+            f"Using recently downloaded list for {mal_username} ({len(user_list.statuses)} anime entries)",
+        )
+    parsed: Dict[int, str] = user_list.statuses
+    # collect results and send them all at once, instead of a message per entry
+    results: List[str] = []
+    async with HistoryCrawler([Globals.feed_channel], limit=num) as crawler:
+        async for entry in crawler:
+            embed = entry.embed
+            if entry.source is None and not print_all:
+                continue
+            mal_id = entry.mal_id
             on_your_list = mal_id in parsed
             on_your_ptw = mal_id in parsed and parsed[mal_id] == "plan_to_watch"
             on_your_completed = mal_id in parsed and parsed[mal_id] == "completed"
             if (not on_your_list) or (
                 on_your_ptw or (print_not_completed and not on_your_completed)
             ):
-                found_entry = True
-                if source_exists:
+                if entry.source is not None:
                     fixed_urls = " ".join(
-                        [
-                            "<{}>".format(url)
-                            for url in [
-                                f.value
-                                for f in embed.fields
-                                if f.name == "Source" and f.value
-                            ][0].split()
-                        ]
+                        ["<{}>".format(url) for url in entry.source.split()]
                     )
                     if on_your_ptw:
-                        await ctx.channel.send(
+                        results.append(
                             "{} is on your PTW, but it has a source: {}".format(
                                 embed.url, fixed_urls
                             )
                         )
                     elif print_not_completed:
-                        await ctx.channel.send(
+                        results.append(
                             "{} is not on your Completed, but it has a source: {}".format(
                                 embed.url, fixed_urls
                             )
                         )
                     else:
-                        await ctx.channel.send(
+                        results.append(
                             "{} isn't on your list, but it has a source: {}".format(
                                 embed.url, fixed_urls
                             )
                         )
                 else:
                     if print_all and not on_your_list:
-                        await ctx.channel.send(
-                            "{} isn't on your list.".format(embed.url)
-                        )
-
-    if not found_entry:
-        await ctx.channel.send(
+                        results.append("{} isn't on your list.".format(embed.url))
+
+    if results:
+        await send_paginated(
+            ctx.channel,
+            f"{len(results)} results for {mal_username} in the last {num} entries",
+            results,
+            filename=f"check-{mal_username}.txt",
+        )
+    else:
+        await reply(
+            ctx,
             "I couldn't find any MAL entries in the last {} entries that aren't on your list.".format(
                 num
-            )
+            ),
         )
 
-    await ctx.channel.send("Done!")
+    await reply(ctx, "Done!")
+
+
+@client.command()
+@log
+async def search(ctx: commands.Context, *, query: str) -> None:
+    start = time.perf_counter()
+    results = Globals.search_index.search(query)
+    took = (time.perf_counter() - start) * 1000
+    if not results:
+        await reply(ctx, f"Couldn't find any entries in the feed matching '{query}'")
+        return
+    await send_paginated(
+        ctx.channel,
+        f"{len(results)} results for '{query}' ({took:.0f}ms)",
+        [
+            f"[{r.title[:80]}](https://myanimelist.net/anime/{r.mal_id}) ({r.mal_id}) {message_link(r.channel_id, r.message_id)}"
+            for r in results
+        ],
+        filename="search.txt",
+    )
+
+
+@client.command()
+@log
+async def stats(ctx: commands.Context) -> None:
+    if ADMIN_ROLE not in roles_from_context(ctx):
+        await reply(ctx, "Insufficient permissions")
+        return
+    await send_paginated(ctx.channel, "mal-notify stats", metrics.summary())
 
 
 @client.command()
@@ -603,6 +1290,11 @@ async def help(ctx):
         value=f"Check the last 'n' in #feed entries for any items not on your MAL. Can add 'all' after the number of entries to check to list all items. By default only lists items which have sources. e.g. `{mentionbot} check Xinil 10 all`. `{mentionbot} check <mal_username> <n> not completed` will print any items that are not completed on your list which have a source in the last 'n' entries in #feed.",
         inline=False,
     )
+    embed.add_field(
+        name=f"{mentionbot} search <query>",
+        value=f"Search the titles, synopses, air dates and sources of the entries in #feed. e.g. `{mentionbot} search isekai 2023`",
+        inline=False,
+    )
     embed.add_field(name="'trusted' commands", value="\u200b", inline=False)
     embed.add_field(
         name=f"{mentionbot} add_new",
@@ -615,8 +1307,8 @@ async def help(ctx):
         inline=False,
     )
     embed.add_field(
-        name=f"{mentionbot} export",
-        value="Create a backup of all of the sources",
+        name=f"{mentionbot} export [full]",
+        value="Create a backup of all of the sources. Only fetches entries since the last backup, unless `full` is given",
         inline=False,
     )
     embed.add_field(
@@ -624,14 +1316,24 @@ async def help(ctx):
         value=f"Refreshes an embed - checks if the metadata (i.e. description, air date, image) has changed and updates accordingly. e.g. `{mentionbot} refresh 40020`",
         inline=False,
     )
+    embed.add_field(
+        name=f"{mentionbot} bulk_refresh <ids <id...>|range <low> <high>|last <n>|all|status|cancel>",
+        value=f"Refreshes many embeds in the background, editing one message with the progress. Resumes if the bot restarts. e.g. `{mentionbot} bulk_refresh last 500`",
+        inline=False,
+    )
     embed.add_field(name="'admin' commands", value="\u200b", inline=False)
     embed.add_field(name=f"{mentionbot} restart", value="Restart the bot", inline=False)
+    embed.add_field(
+        name=f"{mentionbot} stats",
+        value="Show call counts, errors and latencies for the bots functions, and counts of MAL/discord requests",
+        inline=False,
+    )
     embed.add_field(
         name=f"{mentionbot} index <pages>",
         value="Communicate with the process that indexes MAL, asking it to search <pages> of recently approved MAL entries for newly approved items",
         inline=False,
     )
-    await ctx.channel.send(embed=embed)
+    await reply(ctx, embed=embed)
 
 
 @client.event
@@ -651,30 +1353,45 @@ async def on_command_error(ctx, error):
 
     if isinstance(error, commands.CommandNotFound):
         if command_name is None:
-            await ctx.channel.send(
-                "Didn't provide a known command. Use `@notify help` to see a list of commands"
+            await reply(
+                ctx,
+                "Didn't provide a known command. Use `@notify help` to see a list of commands",
             )
         else:
-            await ctx.channel.send(
+            await reply(
+                ctx,
                 "Could not find the command `{}`. Use `@notify help` to see a list of commands.".format(
                     command_name
-                )
+                ),
             )
     elif isinstance(error, commands.CheckFailure):
-        await ctx.channel.send(
-            "You don't have sufficient permissions to run this command."
-        )
+        await reply(ctx, "You don't have sufficient permissions to run this command.")
     elif (
         isinstance(error, commands.MissingRequiredArgument) and command_name == "source"
     ):
-        await ctx.channel.send(
-            "You're missing one or more arguments for the `source` command.\nExample: `@notify source 31943 https://youtube/...`"
+        await reply(
+            ctx,
+            "You're missing one or more arguments for the `source` command.\nExample: `@notify source 31943 https://youtube/...`",
         )
     elif (
         isinstance(error, commands.MissingRequiredArgument)
         and command_name == "refresh"
     ):
-        await ctx.channel.send("Provide the MAL id you wish to refresh the embed for.")
+        await reply(ctx, "Provide the MAL id you wish to refresh the embed for.")
+    elif (
+        isinstance(error, commands.MissingRequiredArgument)
+        and command_name == "bulk_refresh"
+    ):
+        await reply(
+            ctx,
+            "Provide what to refresh: `ids <id...>`, `range <low> <high>`, `last <n>` or `all`. Use `status` or `cancel` for a running refresh",
+        )
+    elif (
+        isinstance(error, commands.MissingRequiredArgument) and command_name == "search"
+    ):
+        await reply(
+            ctx, "Provide something to search for, e.g. `@notify search isekai`"
+        )
     elif isinstance(error, commands.BadArgument) and command_name in [
         "source",
         "refresh",
@@ -683,53 +1400,59 @@ async def on_command_error(ctx, error):
         try:
             int(args[1])
         except ValueError:
-            await ctx.channel.send(
-                "Error converting `{}` to an integer.".format(args[1])
-            )
+            await reply(ctx, "Error converting `{}` to an integer.".format(args[1]))
     elif (
         isinstance(error, commands.MissingRequiredArgument) and command_name == "check"
     ):
-        await ctx.channel.send(
+        await reply(
+            ctx,
             "Provide your MAL username and then the number of entries in {} you want to check".format(
                 Globals.feed_channel.mention
-            )
+            ),
         )
     elif isinstance(error, commands.BadArgument) and command_name == "check":
         try:
             int(args[2])
         except ValueError:
-            await ctx.channel.send(
-                "Error converting `{}` to an integer.".format(args[2])
-            )
+            await reply(ctx, "Error converting `{}` to an integer.".format(args[2]))
     elif isinstance(error, commands.CommandInvokeError):
         original_error = error.original
         if isinstance(original_error, errors.HTTPException):
-            await ctx.channel.send(
-                "There was an issue connecting to the Discord API. Wait a few moments and try again."
+            await reply(
+                ctx,
+                "There was an issue connecting to the Discord API. Wait a few moments and try again.",
             )
         elif isinstance(original_error, RuntimeError):
             # couldn't find a user with that username
-            await ctx.channel.send(str(original_error))
+            await reply(ctx, str(original_error))
         elif isinstance(original_error, requests.exceptions.InvalidURL):
-            await ctx.channel.send(f"Error with that URL: {str(original_error)}")
+            await reply(ctx, f"Error with that URL: {str(original_error)}")
         else:
-            await ctx.channel.send(
+            await reply(
+                ctx,
                 "Uncaught error: {} - {}".format(
                     type(error.original).__name__, error.original
-                )
+                ),
             )
             logger.exception(error.original)
             logger.exception("".join(traceback.format_tb(error.original.__traceback__)))
     else:
-        await ctx.channel.send(
-            "Uncaught error: {} - {}".format(type(error).__name__, error)
-        )
+        await reply(ctx, "Uncaught error: {} - {}".format(type(error).__name__, error))
         logger.exception(error, exc_info=True)
 
 
 @client.event
 async def setup_hook() -> None:
+    # runs once logged in, before connecting to the gateway
+    startup.mark("login")
     client.loop.create_task(print_loop())  # waits until bot is ready
+    # serves prometheus metrics and the /ingest push endpoint on localhost
+    try:
+        await start_server(
+            port=int(os.environ.get("METRICS_PORT", 9091)), ingest=ingest_ids
+        )
+    except OSError as e:
+        logger.warning(f"Couldn't start metrics server: {e}")
 
 
 def main():
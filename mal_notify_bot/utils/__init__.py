@@ -1,6 +1,12 @@
+import os
 import re
+import json
+import time
+import logging
 import inspect
 
+from contextvars import ContextVar
+from dataclasses import dataclass
 from functools import wraps
 
 from typing import Optional, Iterator, Any
@@ -8,20 +14,64 @@ from typing import Optional, Iterator, Any
 from logzero import logger  # type: ignore[import]
 import backoff  # type: ignore[import]
 
+from .metrics import metrics
 
-class uuid:
-    """Represents function calls as processes so its easier to track where/when they start/end"""
 
-    _id: int = 0
+@dataclass(frozen=True)
+class Span:
+    """
+    Represents a function call, so its easier to track where/when they start/end
+    Spans started while this one is running (including in tasks it creates) are its children
+    """
 
-    @staticmethod
-    def get() -> int:
-        return uuid._id
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str] = None
 
     @staticmethod
-    def get_and_increment() -> int:
-        uuid._id += 1
-        return uuid._id
+    def start(name: str) -> "Span":
+        parent = current_span.get()
+        if parent is None:
+            return Span(name=name, trace_id=_new_id(), span_id=_new_id())
+        return Span(
+            name=name,
+            trace_id=parent.trace_id,
+            span_id=_new_id(),
+            parent_id=parent.span_id,
+        )
+
+
+def _new_id() -> str:
+    return os.urandom(8).hex()
+
+
+# asyncio copies the context when creating tasks, so this follows gather/create_task
+current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+# if set, spans are written as JSON lines to this file
+trace_logger = logging.getLogger("mal_notify.trace")
+trace_logger.propagate = False
+if trace_file := os.environ.get("MAL_NOTIFY_TRACE_FILE"):
+    _trace_handler = logging.FileHandler(trace_file)
+    _trace_handler.setFormatter(logging.Formatter("%(message)s"))
+    trace_logger.addHandler(_trace_handler)
+    trace_logger.setLevel(logging.INFO)
+else:
+    trace_logger.setLevel(logging.CRITICAL)
+
+
+def _trace(span: Span, event: str, **fields: Any) -> None:
+    record = {
+        "ts": time.time(),
+        "event": event,
+        "name": span.name,
+        "trace_id": span.trace_id,
+        "span_id": span.span_id,
+        "parent_id": span.parent_id,
+        **fields,
+    }
+    trace_logger.info(json.dumps(record, default=str))
 
 
 def extract_mal_id_from_url(url: str) -> Optional[str]:
@@ -36,6 +86,33 @@ def extract_mal_id_from_url(url: str) -> Optional[str]:
         return str(result[0])
 
 
+def truncate_partial_line(filepath: str) -> bool:
+    """
+    Truncates the file after its last newline, for append-only logs where a
+    crash can leave a partially written last line. Otherwise the next append
+    would be written onto the end of it. Returns True if anything was removed
+    """
+    with open(filepath, "rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        end = size
+        # read backwards a block at a time, lines are short so this is usually one
+        while end > 0:
+            start = max(0, end - 4096)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b"\n")
+            if newline != -1:
+                end = start + newline + 1
+                break
+            end = start
+        if end == size:
+            return False
+        f.truncate(end)
+        f.flush()
+        os.fsync(f.fileno())
+    logger.warning(f"Removed a partially written line from the end of {filepath}")
+    return True
+
+
 def remove_discord_link_suppression(link: str) -> str:
     link = link.strip()
     if link.startswith("<") and link.endswith(">"):
@@ -52,26 +129,56 @@ def fibo_long() -> Iterator[int]:
 
 def truncate(obj: Any, limit: int) -> str:
     """Truncates the length of args/kwargs for the @log decorator so that we can read logs easier"""
-    if len(repr(obj)) < limit:
-        return repr(obj)
+    text = repr(obj)
+    if len(text) < limit:
+        return text
     else:
-        return repr(obj)[:limit] + "... (truncated)"
+        return text[:limit] + "... (truncated)"
 
 
 def log(func):
-    """Decorator for functions, to log start/end times"""
+    """
+    Decorator for functions, to log start/end times
+    Also records call counts, errors and latency in metrics
+
+    Arguments are only formatted if debug logging or tracing is enabled
+    """
 
     @wraps(func)
     async def wrapper(*args, **kwargs):
-        _id = uuid.get_and_increment()
-        args_text = truncate(args, 2000)
-        kwargs_text = truncate(kwargs, 2000)
-        logger.debug(f"{func.__name__} ({_id}) called with {args_text} {kwargs_text}")
-        if inspect.iscoroutinefunction(func):
-            result = await func(*args, **kwargs)
-        else:
-            result = func(*args, **kwargs)
-        logger.debug(f"{func.__name__} ({_id}) finished")
+        debug = logger.isEnabledFor(logging.DEBUG)
+        tracing = trace_logger.isEnabledFor(logging.INFO)
+        span: Optional[Span] = None
+        if debug or tracing:
+            span = Span.start(func.__name__)
+            token = current_span.set(span)
+            args_text = truncate(args, 2000)
+            kwargs_text = truncate(kwargs, 2000)
+            if debug:
+                logger.debug(
+                    f"{func.__name__} ({span.span_id}) called with {args_text} {kwargs_text}"
+                )
+            if tracing:
+                _trace(span, "start", args=args_text, kwargs=kwargs_text)
+        start = time.perf_counter()
+        error = False
+        try:
+            if inspect.iscoroutinefunction(func):
+                result = await func(*args, **kwargs)
+            else:
+                result = func(*args, **kwargs)
+        except Exception:
+            error = True
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            metrics.observe_call(func.__name__, duration, error)
+            if span is not None:
+                if tracing:
+                    _trace(span, "end", duration=duration, error=error)
+                current_span.reset(token)
+        if span is not None and debug:
+            logger.debug(f"{func.__name__} ({span.span_id}) finished")
         return result
 
     return wrapper
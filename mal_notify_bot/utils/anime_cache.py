@@ -0,0 +1,98 @@
+import json
+import time
+import sqlite3
+
+from datetime import datetime
+from typing import Optional, Dict, Any
+
+from logzero import logger  # type: ignore[import]
+
+
+def _parse_updated_at(data: Dict[str, Any]) -> Optional[float]:
+    """Parses the 'updated_at' timestamp from a MAL API response"""
+    updated_at = data.get("updated_at")
+    if not isinstance(updated_at, str):
+        return None
+    try:
+        return datetime.fromisoformat(updated_at).timestamp()
+    except ValueError:
+        return None
+
+
+class AnimeCache:
+    """
+    Persistent cache for MAL anime details, keyed by MAL ID
+
+    A response is fresh for 'ttl' seconds after it was fetched. If MAL
+    says the entry hasn't been updated in a long time (using 'updated_at'),
+    that's extended to half the time since it was last updated, up to 'max_ttl'
+
+    Once there are more than 'max_entries', the least recently used are evicted
+    """
+
+    def __init__(
+        self,
+        *,
+        filepath: str,
+        ttl: float = 60 * 60 * 6,
+        max_ttl: float = 60 * 60 * 24 * 7,
+        max_entries: int = 5000,
+    ) -> None:
+        self.filepath = filepath
+        self.ttl = ttl
+        self.max_ttl = max_ttl
+        self.max_entries = max_entries
+        self.conn = sqlite3.connect(self.filepath)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS anime (
+                mal_id INTEGER PRIMARY KEY,
+                data TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )""")
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS anime_accessed_at ON anime (accessed_at)"
+        )
+        self.conn.commit()
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(filepath={self.filepath}, ttl={self.ttl})"
+
+    def _expires_at(self, data: Dict[str, Any], fetched_at: float) -> float:
+        ttl = self.ttl
+        updated_at = _parse_updated_at(data)
+        if updated_at is not None and updated_at < fetched_at:
+            ttl = max(ttl, (fetched_at - updated_at) / 2)
+        return fetched_at + min(ttl, self.max_ttl)
+
+    def get(self, mal_id: int) -> Optional[Dict[str, Any]]:
+        """Returns the cached response if its still fresh"""
+        now = time.time()
+        row = self.conn.execute(
+            "SELECT data, expires_at FROM anime WHERE mal_id = ?", (mal_id,)
+        ).fetchone()
+        if row is None or row[1] < now:
+            return None
+        self.conn.execute(
+            "UPDATE anime SET accessed_at = ? WHERE mal_id = ?", (now, mal_id)
+        )
+        self.conn.commit()
+        logger.debug(f"Using cached data for {mal_id}")
+        data: Dict[str, Any] = json.loads(row[0])
+        return data
+
+    def put(self, mal_id: int, data: Dict[str, Any]) -> None:
+        now = time.time()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO anime (mal_id, data, fetched_at, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (mal_id, json.dumps(data), now, self._expires_at(data, now), now),
+        )
+        # evict the least recently used entries
+        self.conn.execute(
+            "DELETE FROM anime WHERE mal_id IN (SELECT mal_id FROM anime ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
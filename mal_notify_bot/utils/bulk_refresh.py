@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import asyncio
+
+from typing import List, Optional, Any, Dict, Callable, Coroutine, Tuple
+
+from logzero import logger  # type: ignore[import]
+
+# refreshes the entry with this MAL ID, returns False if it isn't in the feed
+RefreshOne = Callable[[int], Coroutine[Any, Any, bool]]
+# called with a summary of the progress, e.g. to edit a status message
+StatusCallback = Callable[[str], None]
+
+
+class RefreshCheckpoint:
+    """
+    The IDs left in a bulk refresh and the counts so far, saved
+    so that the refresh resumes where it left off after a restart
+    """
+
+    def __init__(self, *, filepath: str):
+        self.filepath = filepath
+        self.remaining: List[int] = []
+        self.total = 0
+        self.refreshed = 0
+        self.missing: List[int] = []
+        self.failed: List[int] = []
+        # (channel_id, message_id) of the status message
+        self.status: Optional[Tuple[int, int]] = None
+        if os.path.exists(self.filepath):
+            with open(self.filepath, "r") as f:
+                data: Dict[str, Any] = json.load(f)
+            self.remaining = data.get("remaining", [])
+            self.total = data.get("total", 0)
+            self.refreshed = data.get("refreshed", 0)
+            self.missing = data.get("missing", [])
+            self.failed = data.get("failed", [])
+            if data.get("status") is not None:
+                self.status = (int(data["status"][0]), int(data["status"][1]))
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(filepath={self.filepath}, remaining={len(self.remaining)})"
+
+    @property
+    def active(self) -> bool:
+        return len(self.remaining) > 0
+
+    def start(self, ids: List[int], status: Optional[Tuple[int, int]]) -> None:
+        self.remaining = list(ids)
+        self.total = len(ids)
+        self.refreshed = 0
+        self.missing = []
+        self.failed = []
+        self.status = status
+        self.save()
+
+    def save(self) -> None:
+        tmp_file = self.filepath + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(
+                {
+                    "remaining": self.remaining,
+                    "total": self.total,
+                    "refreshed": self.refreshed,
+                    "missing": self.missing,
+                    "failed": self.failed,
+                    "status": self.status,
+                },
+                f,
+            )
+        os.replace(tmp_file, self.filepath)
+
+    def clear(self) -> None:
+        self.remaining = []
+        if os.path.exists(self.filepath):
+            os.remove(self.filepath)
+
+
+class BulkRefresh:
+    """
+    Refreshes many feed entries as a background job, 'concurrency' at a time
+
+    The MAL client and the outbound discord scheduler rate limit the requests
+    this makes, so it shares the same budgets as everything else. Progress is
+    saved every 'save_every' entries, and reported at most every 'status_interval'
+    seconds, so the status message is edited instead of sending one per entry
+    """
+
+    def __init__(
+        self,
+        checkpoint: RefreshCheckpoint,
+        refresh_one: RefreshOne,
+        *,
+        concurrency: int = 4,
+        save_every: int = 50,
+        status_interval: float = 5.0,
+    ) -> None:
+        self.checkpoint = checkpoint
+        self.refresh_one = refresh_one
+        self.concurrency = concurrency
+        self.save_every = save_every
+        self.status_interval = status_interval
+        self._task: Optional["asyncio.Task[None]"] = None
+        # IDs are taken in order, so whats left is the ones in progress and everything after _next
+        self._ids: List[int] = []
+        self._next = 0
+        self._in_progress: Dict[int, None] = {}
+        self._since_save = 0
+        self._last_status = 0.0
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(checkpoint={self.checkpoint}, running={self.running})"
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def summary(self) -> str:
+        cp = self.checkpoint
+        processed = cp.refreshed + len(cp.missing) + len(cp.failed)
+        text = f"Refreshed {cp.refreshed} entries, {processed}/{cp.total} processed"
+        if cp.missing:
+            text += f", {len(cp.missing)} not in the feed"
+        if cp.failed:
+            text += f", {len(cp.failed)} failed ({', '.join(map(str, cp.failed[:20]))})"
+        return text
+
+    def start(
+        self,
+        ids: List[int],
+        status: Optional[Tuple[int, int]],
+        on_status: StatusCallback,
+    ) -> None:
+        """Starts a new bulk refresh, replacing any saved progress"""
+        assert not self.running, "a bulk refresh is already running"
+        self.checkpoint.start(ids, status)
+        self.resume(on_status)
+
+    def resume(self, on_status: StatusCallback) -> None:
+        """Continues the refresh saved in the checkpoint"""
+        assert not self.running, "a bulk refresh is already running"
+        self._ids = list(self.checkpoint.remaining)
+        self._next = 0
+        self._in_progress = {}
+        self._task = asyncio.create_task(self._run(on_status))
+
+    def cancel(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+        self.checkpoint.clear()
+
+    def _save(self) -> None:
+        self.checkpoint.remaining = list(self._in_progress) + self._ids[self._next :]
+        self._since_save = 0
+        self.checkpoint.save()
+
+    def _report(self, on_status: StatusCallback) -> None:
+        now = time.monotonic()
+        if now - self._last_status >= self.status_interval:
+            self._last_status = now
+            on_status(self.summary())
+
+    async def _worker(self, on_status: StatusCallback) -> None:
+        cp = self.checkpoint
+        while self._next < len(self._ids):
+            mal_id = self._ids[self._next]
+            self._next += 1
+            self._in_progress[mal_id] = None
+            try:
+                if await self.refresh_one(mal_id):
+                    cp.refreshed += 1
+                else:
+                    cp.missing.append(mal_id)
+            except Exception as e:
+                logger.warning(f"Couldn't refresh {mal_id}: {e}")
+                cp.failed.append(mal_id)
+            del self._in_progress[mal_id]
+            self._since_save += 1
+            if self._since_save >= self.save_every:
+                self._save()
+            self._report(on_status)
+
+    async def _run(self, on_status: StatusCallback) -> None:
+        logger.info(f"Bulk refreshing {len(self._ids)} entries")
+        try:
+            await asyncio.gather(
+                *(self._worker(on_status) for _ in range(self.concurrency))
+            )
+        except asyncio.CancelledError:
+            # cancel() clears the checkpoint, otherwise the bot is shutting down
+            if self.checkpoint.active:
+                self._save()
+            on_status(f"Cancelled. {self.summary()}")
+            raise
+        on_status(f"Done! {self.summary()}")
+        logger.info(self.summary())
+        self.checkpoint.clear()
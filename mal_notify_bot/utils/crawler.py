@@ -0,0 +1,153 @@
+import asyncio
+
+from dataclasses import dataclass
+from functools import cached_property
+
+from typing import (
+    Optional,
+    List,
+    Dict,
+    Mapping,
+    Sequence,
+    Union,
+    AsyncIterator,
+    Any,
+)
+
+from discord import Embed, Message, TextChannel, Object
+
+from . import extract_mal_id_from_url
+from .embeds import get_source
+from .metrics import count_history, HISTORY_PAGE_SIZE
+
+
+@dataclass(frozen=True)
+class FeedMessage:
+    """A message in one of the feeds, with the entry its embed is for"""
+
+    mal_id: int
+    embed: Embed
+    message: Message
+
+    @cached_property
+    def source(self) -> Optional[str]:
+        # only parsed when its used, most crawls are looking for an ID
+        return get_source(self.embed)
+
+
+def parse_feed_message(message: Message) -> Optional[FeedMessage]:
+    """Returns None if the message isn't a feed entry (e.g. it has no embed)"""
+    if not message.embeds:
+        return None
+    embed = message.embeds[0]
+    if embed.url is None:
+        return None
+    embed_id = extract_mal_id_from_url(embed.url)
+    if embed_id is None:
+        return None
+    return FeedMessage(int(embed_id), embed, message)
+
+
+# a page of messages from one of the channels, None once that channel
+# is exhausted, or the error that stopped it
+_Page = Union[List[Message], None, Exception]
+
+
+class HistoryCrawler:
+    """
+    Walks the history of one or more channels concurrently, yielding each feed
+    entry as it goes
+
+    Each channel is paged by its own task, which fetches the next page while
+    the current one is being processed. At most 'prefetch' pages wait to be
+    processed, so memory use doesn't grow with the size of the channels.
+    Messages from one channel are in order, but messages from different
+    channels are interleaved
+
+    before/after are message IDs for each channel ID, to only crawl messages
+    older/newer than that. Leaving the 'async with' block early stops fetching
+
+    async with HistoryCrawler([channel], limit=100) as crawler:
+        async for entry in crawler:
+            ...
+    """
+
+    def __init__(
+        self,
+        channels: Sequence[TextChannel],
+        *,
+        limit: Optional[int] = None,
+        oldest_first: bool = False,
+        before: Optional[Mapping[int, Optional[int]]] = None,
+        after: Optional[Mapping[int, Optional[int]]] = None,
+        prefetch: int = 2,
+    ) -> None:
+        self.channels = list(channels)
+        self.limit = limit
+        self.oldest_first = oldest_first
+        self.before = dict(before or {})
+        self.after = dict(after or {})
+        self.prefetch = prefetch
+        self._pages: "asyncio.Queue[_Page]" = asyncio.Queue(maxsize=max(1, prefetch))
+        self._tasks: List["asyncio.Task[None]"] = []
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(channels={self.channels}, limit={self.limit}, oldest_first={self.oldest_first})"
+
+    def _history(self, channel: TextChannel) -> AsyncIterator[Message]:
+        kwargs: Dict[str, Any] = {}
+        if (before := self.before.get(channel.id)) is not None:
+            kwargs["before"] = Object(id=before)
+        if (after := self.after.get(channel.id)) is not None:
+            kwargs["after"] = Object(id=after)
+        return count_history(
+            channel.history(limit=self.limit, oldest_first=self.oldest_first, **kwargs)
+        )
+
+    async def _page(self, channel: TextChannel) -> None:
+        page: List[Message] = []
+        try:
+            async for message in self._history(channel):
+                page.append(message)
+                if len(page) >= HISTORY_PAGE_SIZE:
+                    await self._pages.put(page)
+                    page = []
+            if page:
+                await self._pages.put(page)
+        except Exception as e:
+            await self._pages.put(e)
+            return
+        await self._pages.put(None)
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._page(channel)) for channel in self.channels
+            ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def __aenter__(self) -> "HistoryCrawler":
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        await self.stop()
+
+    async def __aiter__(self) -> AsyncIterator[FeedMessage]:
+        self.start()
+        running = len(self.channels)
+        while running > 0:
+            page = await self._pages.get()
+            if page is None:
+                running -= 1
+            elif isinstance(page, Exception):
+                raise page
+            else:
+                for message in page:
+                    entry = parse_feed_message(message)
+                    if entry is not None:
+                        yield entry
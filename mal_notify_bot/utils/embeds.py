@@ -1,6 +1,7 @@
+import os
 import re
 import logging
-import asyncio
+from dataclasses import replace
 from typing import List
 
 import discord  # type: ignore[import]
@@ -9,21 +10,32 @@ from typing import Optional, Dict, Any, Tuple
 
 from . import log
 
-from .user import session
+from .user import mal_client
+from .anime_cache import AnimeCache
+from .mal_client import MAL_API_URL
+from .paths import root_dir
+from .feed_entry import FeedEntry
 
-assert session is not None
+anime_cache = AnimeCache(
+    filepath=os.path.join(root_dir, "anime_cache.sqlite"),
+    ttl=float(os.environ.get("MAL_CACHE_TTL", 60 * 60 * 6)),
+    max_entries=int(os.environ.get("MAL_CACHE_SIZE", 5000)),
+)
 
 
-BASE_ANIME_URL = "https://api.myanimelist.net/v2/anime/{}?nsfw=true"
+BASE_ANIME_URL = MAL_API_URL + "/anime/{}?nsfw=true"
 
 ANIME_FIELDS = "fields=id,title,main_picture,alternative_titles,start_date,end_date,synopsis,mean,rank,popularity,num_list_users,num_scoring_users,nsfw,created_at,updated_at,media_type,status,genres,num_episodes,start_season,broadcast,source,average_episode_duration,rating,pictures,background,related_anime,related_manga,recommendations,studios,statistics"
 
 
-def fetch_anime_details(anime_id: int) -> Dict[str, Any]:
-    """Fetches anime details from MAL"""
+async def fetch_anime_details(anime_id: int, use_cache: bool = True) -> Dict[str, Any]:
+    """Fetches anime details from MAL, or the cache if use_cache is True"""
+    if use_cache and (cached := anime_cache.get(anime_id)) is not None:
+        return cached
     api_url = BASE_ANIME_URL.format(anime_id) + "&" + ANIME_FIELDS
-    assert session is not None
-    return session.safe_json_request(api_url)
+    data = await mal_client.get_json(api_url)
+    anime_cache.put(anime_id, data)
+    return data
 
 
 def _get_mal_image(data: dict) -> Optional[str]:
@@ -40,16 +52,26 @@ def unslugify(slug: str) -> str:
     return " ".join([w.capitalize() for w in slug.split("_")])
 
 
+def format_synopsis(synopsis: Optional[str]) -> Optional[str]:
+    """Collapses blank lines and truncates the synopsis to fit in the embed"""
+    if synopsis is None:
+        return None
+    synopsis = re.sub(r"\n\s*\n", "\n", synopsis.replace("\r", "").strip()).strip()
+    if len(synopsis) > 400:
+        synopsis = synopsis[:400].strip() + "..."
+    # return something so that there form POST has value in case synopsis is empty
+    if synopsis == "":
+        synopsis = "No Synopsis"
+    return synopsis
+
+
 @log
 async def get_data(
-    mal_id: int, ignore_image: bool = False, **kwargs: logging.Logger
+    mal_id: int,
+    ignore_image: bool = False,
+    use_cache: bool = True,
+    **kwargs: logging.Logger,
 ) -> Tuple[str, Optional[str], Optional[str], bool, Optional[str], str]:
-    logger: Optional[logging.Logger] = kwargs.get("logger", None)
-
-    if logger:
-        logger.debug("Sleeping before MAL request...")
-    await asyncio.sleep(1)
-
     # return values
     name: str
     image: Optional[str] = None
@@ -58,7 +80,7 @@ async def get_data(
     status: Optional[str] = None
     sfw: bool
 
-    resp: Dict[str, Any] = fetch_anime_details(mal_id)
+    resp: Dict[str, Any] = await fetch_anime_details(mal_id, use_cache=use_cache)
     name = str(resp["title"])
     if not ignore_image:
         image = _get_mal_image(resp)
@@ -67,57 +89,13 @@ async def get_data(
         "https://myanimelist.cdn-dena.com/img/sp/icon/"
     ):
         image = None
-    # return something so that there form POST has value in case synopsis is empty
-    synopsis = resp.get("synopsis", "No Synopsis")
-    if synopsis is not None:
-        synopsis.replace("\r", "")
-        synopsis = re.sub(r"\n\s*\n", "\n", synopsis.strip()).strip()
-        if len(synopsis) > 400:
-            synopsis = synopsis[:400].strip() + "..."
-        if synopsis.strip() == "":
-            synopsis = "No Synopsis"
+    synopsis = format_synopsis(resp.get("synopsis", "No Synopsis"))
     status = str(unslugify(resp.get("status", "Unknown")))
     airdate = resp.get("start_date", "No Air Date")
     sfw = "Hentai" not in [g.get("name") for g in resp.get("genres", [])]
     return name, image, synopsis, sfw, airdate, status
 
 
-def embed_value_helper(embed_dict: Any, name: str) -> Any:
-    """Only call this when you know that the value is in the embed, returns the value for the name"""
-    for f in embed_dict.fields:
-        if f.name == name:
-            return f.value
-    raise RuntimeError("Could not find {} on embed object".format(name))
-
-
-def add_to_embed(
-    discord_embed_object: discord.Embed,
-    embed_dict: Any,
-    name: str,
-    value: Any,
-    inline: bool,
-) -> discord.Embed:
-    if embed_dict is not None:
-        # this was already in the embed_dict
-        if name in [f.name for f in embed_dict.fields]:
-            if value is not None:
-                # prefer the recent value from MAL, if it exists
-                discord_embed_object.add_field(name=name, value=value, inline=inline)
-            else:
-                # get it from the previous embed message
-                discord_embed_object.add_field(
-                    name=name, value=embed_value_helper(embed_dict, name), inline=inline
-                )
-        # if this field wasn't in the fields previously, add it to the embed object
-        else:
-            if value is not None:
-                discord_embed_object.add_field(name=name, value=value, inline=inline)
-    # if there is no embed_dict, this is a new embed object
-    else:
-        discord_embed_object.add_field(name=name, value=value, inline=inline)
-    return discord_embed_object
-
-
 @log
 async def create_embed(
     mal_id: int, logger: logging.Logger
@@ -125,77 +103,49 @@ async def create_embed(
     title, image, synopsis, sfw, airdate, status = await get_data(
         mal_id, False, logger=logger
     )
-    embed = discord.Embed(
+    entry = FeedEntry(
         title=title,
         url="https://myanimelist.net/anime/{}".format(mal_id),
-        color=discord.Colour.dark_blue(),
+        thumbnail=image,
+        status=status,
+        air_date=airdate,
+        mal_id=mal_id,
+        synopsis=synopsis,
     )
-    if image is not None:
-        embed.set_thumbnail(url=image)
-    embed = add_to_embed(embed, None, "Status", status, inline=True)
-    embed = add_to_embed(embed, None, "Air Date", airdate, inline=True)
-    embed = add_to_embed(embed, None, "MAL ID", mal_id, inline=True)
-    embed = add_to_embed(embed, None, "Synopsis", synopsis, inline=False)
-    return embed, sfw
+    return entry.to_embed(), sfw
 
 
 @log
-async def refresh_embed(
-    embed: discord.Embed, mal_id: int, remove_image: bool, logger: logging.Logger
-) -> discord.Embed:
+async def refresh_entry(
+    entry: FeedEntry, mal_id: int, remove_image: bool, logger: logging.Logger
+) -> FeedEntry:
+    """
+    Updates the entry with the current data from MAL. Fields MAL doesn't
+    have a value for keep their previous value, the source is kept as is
+    """
+    # skip the cache, this is asking for the current data from MAL
     title, image, synopsis, _, airdate, status = await get_data(
-        mal_id, remove_image, logger=logger
+        mal_id, remove_image, use_cache=False, logger=logger
     )
-    if synopsis is not None and len(synopsis) > 400:
-        synopsis = synopsis[:400] + "..."
-    new_embed = discord.Embed(
+    return replace(
+        entry,
         title=title,
         url="https://myanimelist.net/anime/{}".format(mal_id),
-        color=discord.Color.dark_blue(),
+        thumbnail=None if remove_image else image,
+        status=status if status is not None else entry.status,
+        air_date=airdate if airdate is not None else entry.air_date,
+        mal_id=mal_id,
+        synopsis=synopsis if synopsis is not None else entry.synopsis,
     )
-    if not remove_image and image is not None:
-        new_embed.set_thumbnail(url=image)
-    new_embed = add_to_embed(new_embed, embed, "Status", status, inline=True)
-    new_embed = add_to_embed(new_embed, embed, "Air Date", airdate, inline=True)
-    new_embed = add_to_embed(new_embed, embed, "MAL ID", mal_id, inline=True)
-    new_embed = add_to_embed(new_embed, embed, "Synopsis", synopsis, inline=False)
-    new_embed = add_to_embed(new_embed, embed, "Source", None, inline=False)
-    return new_embed
 
 
-@log
-async def add_source(
-    embed: discord.Embed, valid_links: List[str]
-) -> Tuple[discord.Embed, bool]:
-    new_embed = discord.Embed(
-        title=embed.title, url=embed.url, color=discord.Color.dark_blue()
-    )
-    if hasattr(embed, "thumbnail"):
-        new_embed.set_thumbnail(url=embed.thumbnail.url)
-    is_new_source = "Source" not in [f.name for f in embed.fields]
-    new_embed = add_to_embed(new_embed, embed, "Status", None, inline=True)
-    new_embed = add_to_embed(new_embed, embed, "Air Date", None, inline=True)
-    new_embed = add_to_embed(new_embed, embed, "MAL ID", None, inline=True)
-    new_embed = add_to_embed(new_embed, embed, "Synopsis", None, inline=True)
-    new_embed = add_to_embed(
-        new_embed, embed, "Source", " ".join(valid_links), inline=False
-    )
-    return new_embed, is_new_source
+def add_source(entry: FeedEntry, valid_links: List[str]) -> Tuple[FeedEntry, bool]:
+    is_new_source = entry.source is None
+    return replace(entry, source=" ".join(valid_links)), is_new_source
 
 
-@log
-async def remove_source(embed: discord.Embed) -> discord.Embed:
-    new_embed = discord.Embed(
-        title=embed.title, url=embed.url, color=discord.Color.dark_blue()
-    )
-
-    if hasattr(embed, "thumbnail"):
-        new_embed.set_thumbnail(url=embed.thumbnail.url)
-    new_embed = add_to_embed(new_embed, embed, "Status", None, inline=True)
-    new_embed = add_to_embed(new_embed, embed, "Air Date", None, inline=True)
-    new_embed = add_to_embed(new_embed, embed, "MAL ID", None, inline=True)
-    new_embed = add_to_embed(new_embed, embed, "Synopsis", None, inline=False)
-    return new_embed
+def remove_source(entry: FeedEntry) -> FeedEntry:
+    return replace(entry, source=None)
 
 
 def get_source(embed: discord.Embed) -> Optional[str]:
@@ -0,0 +1,184 @@
+import os
+import gzip
+import json
+import tempfile
+
+from typing import Dict, Optional, Any, List, Iterator, NamedTuple, BinaryIO
+
+
+class ExportCheckpoint:
+    """
+    Saves the newest message ID exported from each feed channel, and any
+    source edits which happened since the last export, so that
+    the next export only has to fetch what changed
+    """
+
+    def __init__(self, *, filepath: str):
+        self.filepath = filepath
+        self.channels: Dict[str, int] = {}
+        self.edits: Dict[str, Optional[str]] = {}
+        if os.path.exists(self.filepath):
+            with open(self.filepath, "r") as f:
+                data: Dict[str, Any] = json.load(f)
+            self.channels = data.get("channels", {})
+            self.edits = data.get("edits", {})
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(filepath={self.filepath})"
+
+    def high_water_mark(self, channel_id: int) -> Optional[int]:
+        return self.channels.get(str(channel_id))
+
+    def set_high_water_mark(self, channel_id: int, message_id: int) -> None:
+        self.channels[str(channel_id)] = message_id
+
+    def record_source(self, mal_id: int, source: Optional[str]) -> None:
+        """Remember a source being added (or removed, if None) until the next export"""
+        self.edits[str(mal_id)] = source
+        self.save()
+
+    def reset_high_water_marks(self) -> None:
+        """For a full export, which replaces every mark"""
+        self.channels = {}
+
+    def save(self) -> None:
+        tmp_file = self.filepath + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump({"channels": self.channels, "edits": self.edits}, f)
+        os.replace(tmp_file, self.filepath)
+
+
+# bump when the format of the records changes
+EXPORT_FORMAT = "mal-notify-bot-export"
+EXPORT_VERSION = 1
+
+
+class ExportRecord(NamedTuple):
+    mal_id: int
+    source: str
+
+
+class ExportWriter:
+    """
+    Writes an export as gzipped NDJSON: a header line with the format and
+    version, then one line per record. Records are written to a temporary file
+    as they're added, and it only replaces filepath once its been synced to
+    disk, so a crash part way through leaves the previous export as it was
+
+    with ExportWriter(filepath=...) as writer:
+        writer.write(ExportRecord(1, "https://..."))
+    """
+
+    def __init__(self, *, filepath: str, **header: Any):
+        self.filepath = filepath
+        # unique, so overlapping exports can't write to the same file
+        fd, self.tmp_file = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(self.filepath)),
+            prefix=os.path.basename(self.filepath) + ".",
+            suffix=".tmp",
+        )
+        self.count = 0
+        self._raw: BinaryIO = os.fdopen(fd, "wb")
+        self._gz = gzip.GzipFile(fileobj=self._raw, mode="wb")
+        self._write_line({"format": EXPORT_FORMAT, "version": EXPORT_VERSION, **header})
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(filepath={self.filepath}, count={self.count})"
+        )
+
+    def __enter__(self) -> "ExportWriter":
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _write_line(self, data: Dict[str, Any]) -> None:
+        self._gz.write(json.dumps(data, separators=(",", ":")).encode() + b"\n")
+
+    def write(self, record: ExportRecord) -> None:
+        self._write_line(record._asdict())
+        self.count += 1
+
+    @property
+    def compressed_size(self) -> int:
+        """Bytes written to disk so far, not counting what gzip has buffered"""
+        return self._raw.tell()
+
+    def close(self) -> None:
+        self._gz.close()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        self._raw.close()
+        os.replace(self.tmp_file, self.filepath)
+        # so the rename itself is durable
+        dir_fd = os.open(os.path.dirname(os.path.abspath(self.filepath)), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    def abort(self) -> None:
+        self._gz.close()
+        self._raw.close()
+        os.remove(self.tmp_file)
+
+
+def read_export_header(filepath: str) -> Dict[str, Any]:
+    with gzip.open(filepath, "rt") as f:
+        return _check_header(f.readline())
+
+
+def _check_header(line: str) -> Dict[str, Any]:
+    header: Dict[str, Any] = json.loads(line)
+    if header.get("format") != EXPORT_FORMAT:
+        raise ValueError(f"Not an export: {line[:100]}")
+    if int(header["version"]) > EXPORT_VERSION:
+        raise ValueError(
+            f"Export is version {header['version']}, only {EXPORT_VERSION} is supported"
+        )
+    return header
+
+
+def read_export(filepath: str) -> Iterator[ExportRecord]:
+    """Yields the records in an export one at a time, without reading the whole file"""
+    with gzip.open(filepath, "rt") as f:
+        _check_header(f.readline())
+        for line in f:
+            data = json.loads(line)
+            yield ExportRecord(int(data["mal_id"]), str(data["source"]))
+
+
+def split_export(filepath: str, max_bytes: int, out_dir: str) -> List[str]:
+    """
+    Splits an export into parts which are each at most around max_bytes,
+    so they can be uploaded separately. Each part is a complete export,
+    with a header saying which part it is
+
+    Returns [filepath] if it doesn't need to be split
+    """
+    if os.path.getsize(filepath) <= max_bytes:
+        return [filepath]
+    header = read_export_header(filepath)
+    header.pop("format")
+    header.pop("version")
+    name = os.path.basename(filepath).split(".")[0]
+    parts: List[str] = []
+    writer: Optional[ExportWriter] = None
+    # what gzip may still have buffered, which compressed_size doesn't include
+    limit = max_bytes - min(256 * 1024, max_bytes // 4)
+    for record in read_export(filepath):
+        if writer is None or writer.compressed_size >= limit:
+            if writer is not None:
+                writer.close()
+            parts.append(
+                os.path.join(out_dir, f"{name}.part{len(parts) + 1}.ndjson.gz")
+            )
+            writer = ExportWriter(filepath=parts[-1], part=len(parts), **header)
+        writer.write(record)
+    if writer is not None:
+        writer.close()
+    return parts
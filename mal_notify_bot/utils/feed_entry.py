@@ -0,0 +1,93 @@
+from dataclasses import dataclass, fields
+from typing import Optional, Tuple, List, Dict
+
+import discord  # type: ignore[import]
+
+# name, value, inline, for fields this doesn't know about
+ExtraField = Tuple[str, str, bool]
+
+# the names of the embed fields, in the order they're posted in
+FIELD_NAMES: Dict[str, str] = {
+    "status": "Status",
+    "air_date": "Air Date",
+    "mal_id": "MAL ID",
+    "synopsis": "Synopsis",
+    "source": "Source",
+}
+INLINE: Dict[str, bool] = {
+    "Status": True,
+    "Air Date": True,
+    "MAL ID": True,
+    "Synopsis": False,
+    "Source": False,
+}
+_ATTRS = {name: attr for attr, name in FIELD_NAMES.items()}
+
+
+@dataclass(frozen=True)
+class FeedEntry:
+    """
+    The contents of a feed embed. Two entries are equal if they
+    would display the same, so comparing the entry before and after
+    a change tells whether the message has to be edited
+
+    None means the embed doesn't have that field
+    """
+
+    title: str
+    url: Optional[str] = None
+    thumbnail: Optional[str] = None
+    status: Optional[str] = None
+    air_date: Optional[str] = None
+    mal_id: Optional[int] = None
+    synopsis: Optional[str] = None
+    source: Optional[str] = None
+    extra: Tuple[ExtraField, ...] = ()
+
+    @classmethod
+    def from_embed(cls, embed: discord.Embed) -> "FeedEntry":
+        values: Dict[str, Optional[str]] = {}
+        extra: List[ExtraField] = []
+        for f in embed.fields:
+            name, value = str(f.name), str(f.value)
+            attr = _ATTRS.get(name)
+            # keep anything unexpected (e.g. a non-numeric MAL ID) as it was
+            if (
+                attr is None
+                or attr in values
+                or (attr == "mal_id" and not value.isdigit())
+            ):
+                extra.append((name, value, bool(f.inline)))
+            else:
+                values[attr] = value
+        mal_id = values.pop("mal_id", None)
+        return cls(
+            title=embed.title or "",
+            url=embed.url,
+            thumbnail=embed.thumbnail.url,
+            mal_id=int(mal_id) if mal_id is not None else None,
+            extra=tuple(extra),
+            **values,
+        )
+
+    def to_embed(self) -> discord.Embed:
+        embed = discord.Embed(
+            title=self.title, url=self.url, color=discord.Colour.dark_blue()
+        )
+        if self.thumbnail is not None:
+            embed.set_thumbnail(url=self.thumbnail)
+        for attr, name in FIELD_NAMES.items():
+            value = getattr(self, attr)
+            if value is not None:
+                embed.add_field(name=name, value=value, inline=INLINE[name])
+        for name, value, inline in self.extra:
+            embed.add_field(name=name, value=value, inline=inline)
+        return embed
+
+    def diff(self, other: "FeedEntry") -> List[str]:
+        """Names of the attributes which are different in 'other'"""
+        return [
+            f.name
+            for f in fields(self)
+            if getattr(self, f.name) != getattr(other, f.name)
+        ]
@@ -0,0 +1,108 @@
+import sqlite3
+
+from typing import Optional, Tuple, Iterable, List, Sequence
+
+from logzero import logger  # type: ignore[import]
+
+
+class FeedIndex:
+    """
+    Persistent mapping of MAL IDs to the feed message which contains them,
+    so that finding an entry doesn't require walking the channel history
+    """
+
+    def __init__(self, *, filepath: str):
+        self.filepath = filepath
+        self.conn = sqlite3.connect(self.filepath)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS feed (
+                mal_id INTEGER NOT NULL,
+                channel_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                PRIMARY KEY (mal_id, channel_id)
+            )""")
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS feed_message_id ON feed (message_id)"
+        )
+        # channels which have had their entire history indexed
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS built (channel_id INTEGER PRIMARY KEY)"
+        )
+        self.conn.commit()
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(filepath={self.filepath})"
+
+    def __len__(self) -> int:
+        return int(self.conn.execute("SELECT COUNT(*) FROM feed").fetchone()[0])
+
+    def get(self, mal_id: int, channel_id: int) -> Optional[int]:
+        """Returns the message ID for this MAL ID in the channel, if its been indexed"""
+        row = self.conn.execute(
+            "SELECT message_id FROM feed WHERE mal_id = ? AND channel_id = ?",
+            (mal_id, channel_id),
+        ).fetchone()
+        return None if row is None else int(row[0])
+
+    def set(self, mal_id: int, channel_id: int, message_id: int) -> None:
+        self.conn.execute(
+            "INSERT OR REPLACE INTO feed (mal_id, channel_id, message_id) VALUES (?, ?, ?)",
+            (mal_id, channel_id, message_id),
+        )
+        self.conn.commit()
+
+    def set_many(self, rows: Iterable[Tuple[int, int, int]]) -> None:
+        """Bulk insert (mal_id, channel_id, message_id) rows"""
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO feed (mal_id, channel_id, message_id) VALUES (?, ?, ?)",
+            rows,
+        )
+        self.conn.commit()
+
+    def mal_ids(
+        self,
+        channel_ids: Sequence[int],
+        low: Optional[int] = None,
+        high: Optional[int] = None,
+    ) -> List[int]:
+        """MAL IDs in the channels, optionally only those between low and high (inclusive)"""
+        marks = ",".join("?" for _ in channel_ids)
+        rows = self.conn.execute(
+            f"""SELECT DISTINCT mal_id FROM feed WHERE channel_id IN ({marks})
+            AND mal_id >= ? AND mal_id <= ? ORDER BY mal_id""",
+            (
+                *channel_ids,
+                low if low is not None else 0,
+                high if high is not None else 2**62,
+            ),
+        ).fetchall()
+        return [int(r[0]) for r in rows]
+
+    def recent(self, channel_ids: Sequence[int], limit: int) -> List[int]:
+        """MAL IDs of the last 'limit' messages in the channels, newest first"""
+        marks = ",".join("?" for _ in channel_ids)
+        rows = self.conn.execute(
+            f"""SELECT mal_id FROM feed WHERE channel_id IN ({marks})
+            ORDER BY message_id DESC LIMIT ?""",
+            (*channel_ids, limit),
+        ).fetchall()
+        return [int(r[0]) for r in rows]
+
+    def remove_message(self, message_id: int) -> None:
+        self.conn.execute("DELETE FROM feed WHERE message_id = ?", (message_id,))
+        self.conn.commit()
+
+    def is_built(self, channel_id: int) -> bool:
+        row = self.conn.execute(
+            "SELECT 1 FROM built WHERE channel_id = ?", (channel_id,)
+        ).fetchone()
+        return row is not None
+
+    def mark_built(self, channel_id: int) -> None:
+        logger.debug(f"Marking channel {channel_id} as indexed")
+        self.conn.execute(
+            "INSERT OR IGNORE INTO built (channel_id) VALUES (?)", (channel_id,)
+        )
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
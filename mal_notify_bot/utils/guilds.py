@@ -0,0 +1,147 @@
+import os
+import asyncio
+
+from dataclasses import dataclass
+from typing import Dict, Optional, Any, List, Iterable, Union
+
+import yaml
+from discord import Embed
+from discord.utils import get
+from logzero import logger  # type: ignore[import]
+
+from .feed_index import FeedIndex
+from .posting import RecentIds, post_embed
+
+# channel names used for servers which aren't listed in the config file
+DEFAULT_FEED = "feed"
+DEFAULT_NSFW_FEED = "nsfw-feed"
+
+ChannelRef = Union[int, str]
+
+
+@dataclass
+class GuildFeeds:
+    """The feed channels of a server which receives new entries"""
+
+    guild_id: int
+    feed: Any
+    # None if this server doesn't want NSFW entries
+    nsfw_feed: Any = None
+
+    def channel_for(self, sfw: bool) -> Any:
+        return self.feed if sfw else self.nsfw_feed
+
+
+class GuildConfig:
+    """
+    Which server is the primary one, and which channels each server
+    wants entries posted to. The file looks like:
+
+    primary: 123456789
+    guilds:
+      123456789:
+        feed: feed
+        nsfw_feed: nsfw-feed
+      987654321:
+        feed: 112233445566  # channel names or IDs
+        nsfw_feed: null  # don't post NSFW entries
+
+    Servers which aren't listed use the 'feed' and 'nsfw-feed' channels, if they have them
+    """
+
+    def __init__(self, *, filepath: str):
+        self.filepath = filepath
+        self.primary: Optional[int] = None
+        self.guilds: Dict[int, Dict[str, Optional[ChannelRef]]] = {}
+        if os.path.exists(self.filepath):
+            with open(self.filepath, "r") as f:
+                data: Dict[str, Any] = yaml.load(f, Loader=yaml.FullLoader) or {}
+            if data.get("primary") is not None:
+                self.primary = int(data["primary"])
+            self.guilds = {
+                int(guild_id): channels or {}
+                for guild_id, channels in (data.get("guilds") or {}).items()
+            }
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(filepath={self.filepath}, primary={self.primary}, guilds={len(self.guilds)})"
+
+    def _channel(self, guild: Any, ref: Optional[ChannelRef]) -> Any:
+        if ref is None:
+            return None
+        if isinstance(ref, int):
+            return get(guild.channels, id=ref)
+        return get(guild.channels, name=ref)
+
+    def resolve(self, guild: Any) -> Optional[GuildFeeds]:
+        """Returns the servers feed channels, or None if it has no feed"""
+        channels = self.guilds.get(
+            guild.id, {"feed": DEFAULT_FEED, "nsfw_feed": DEFAULT_NSFW_FEED}
+        )
+        feed = self._channel(guild, channels.get("feed", DEFAULT_FEED))
+        if feed is None:
+            return None
+        return GuildFeeds(
+            guild_id=guild.id,
+            feed=feed,
+            nsfw_feed=self._channel(guild, channels.get("nsfw_feed")),
+        )
+
+    def primary_guild(self, guilds: List[Any]) -> Optional[Any]:
+        """The server whose feed is the source of truth, for sources/refresh/export"""
+        if self.primary is not None:
+            return get(guilds, id=self.primary)
+        if len(guilds) == 1:
+            return guilds[0]
+        return None
+
+    def mirrors(self, guilds: Iterable[Any], primary: Any) -> List[GuildFeeds]:
+        """Feeds of every server other than the primary one"""
+        feeds: List[GuildFeeds] = []
+        for guild in guilds:
+            if guild.id == primary.id:
+                continue
+            resolved = self.resolve(guild)
+            if resolved is not None:
+                feeds.append(resolved)
+        return feeds
+
+
+async def fan_out(
+    mirrors: List[GuildFeeds],
+    embed: Embed,
+    mal_id: int,
+    sfw: bool,
+    *,
+    recent: RecentIds,
+    feed_index: Optional[FeedIndex] = None,
+    concurrency: int = 8,
+) -> int:
+    """
+    Posts an already built embed to each mirrors feed, at most
+    'concurrency' at a time. A server which fails (e.g. the bot lost
+    permissions there) is logged and skipped, it doesn't stop the others
+
+    Returns how many servers it was posted to
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _post(feeds: GuildFeeds) -> bool:
+        channel = feeds.channel_for(sfw)
+        if channel is None:
+            return False
+        async with semaphore:
+            try:
+                return (
+                    await post_embed(
+                        channel, embed, mal_id, recent=recent, feed_index=feed_index
+                    )
+                    is not None
+                )
+            except Exception as e:
+                logger.warning(
+                    f"Couldn't post {mal_id} to {channel} in {feeds.guild_id}: {e}"
+                )
+                return False
+
+    return sum(await asyncio.gather(*(_post(f) for f in mirrors)))
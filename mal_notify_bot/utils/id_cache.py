@@ -0,0 +1,131 @@
+"""
+Helpers for the local clone of mal-id-cache
+"""
+
+import os
+import re
+import asyncio
+
+from typing import Optional, Dict, List, Tuple, Set
+
+from git.cmd import Git  # type: ignore[import]
+from git.exc import GitCommandError  # type: ignore[import]
+from logzero import logger  # type: ignore[import]
+
+# path to the anime cache, relative to the root of the repo
+ANIME_CACHE_PATH = "cache/anime_cache.json"
+
+HUNK_HEADER = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,\d+)? @@")
+BUCKET_KEY = re.compile(r'"(sfw|nsfw)"\s*:')
+# lines in the cache which aren't IDs, but don't change what bucket an ID is in
+STRUCTURAL_LINES = {"", "{", "}", "[", "]", "],", '"sfw": [', '"nsfw": ['}
+
+
+async def pull(repo_dir: str, timeout: int = 120) -> str:
+    """
+    Pulls the repo in a thread so the event loop isn't blocked,
+    killing git if it takes longer than timeout. Returns the HEAD commit
+    """
+    g = Git(repo_dir)
+    await asyncio.to_thread(g.pull, kill_after_timeout=timeout)
+    commit_id: str = await asyncio.to_thread(g.rev_parse, "HEAD")
+    logger.debug(f"{g.working_dir} is at commit hash {commit_id}")
+    return commit_id.strip()
+
+
+class LastCommit:
+    """Saves the last mal-id-cache commit which was completely processed"""
+
+    def __init__(self, *, filepath: str):
+        self.filepath = filepath
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(filepath={self.filepath})"
+
+    def read(self) -> Optional[str]:
+        if not os.path.exists(self.filepath):
+            return None
+        with open(self.filepath, "r") as f:
+            return f.read().strip() or None
+
+    def write(self, commit_id: str) -> None:
+        tmp_file = self.filepath + ".tmp"
+        with open(tmp_file, "w") as f:
+            f.write(commit_id)
+        os.replace(tmp_file, self.filepath)
+
+
+def _bucket_lines(g: Git, commit_id: str, path: str) -> Optional[List[Tuple[int, str]]]:
+    """Returns the line numbers of the "sfw"/"nsfw" keys in the cache at commit_id"""
+    try:
+        output: str = g.grep("-n", "-E", BUCKET_KEY.pattern, commit_id, "--", path)
+    except GitCommandError:
+        return None
+    prefix = f"{commit_id}:{path}:"
+    buckets: List[Tuple[int, str]] = []
+    for line in output.splitlines():
+        if not line.startswith(prefix):
+            return None
+        lineno, content = line[len(prefix) :].split(":", 1)
+        keys = BUCKET_KEY.findall(content)
+        # if both keys are on one line, the diff won't tell us anything useful
+        if len(keys) != 1:
+            return None
+        buckets.append((int(lineno), keys[0]))
+    return sorted(buckets) or None
+
+
+def _added_ids(
+    repo_dir: str, since: str, until: str, path: str
+) -> Optional[Dict[str, List[int]]]:
+    g = Git(repo_dir)
+    try:
+        g.merge_base("--is-ancestor", since, until)
+    except GitCommandError:
+        logger.info(f"{since} isn't an ancestor of {until}, history was rewritten")
+        return None
+    buckets = _bucket_lines(g, until, path)
+    if buckets is None:
+        logger.info(f"Couldn't find sfw/nsfw keys in {path} at {until}")
+        return None
+    added: Dict[str, List[int]] = {"sfw": [], "nsfw": []}
+    # IDs which only had a trailing comma added/removed show up on both sides
+    removed: Set[int] = set()
+    lineno = 0
+    for line in g.diff("-U0", "--no-color", since, until, "--", path).splitlines():
+        if line.startswith("@@"):
+            match = HUNK_HEADER.match(line)
+            if match is None:
+                return None
+            lineno = int(match.group(1))
+        elif line.startswith("+") and not line.startswith("+++"):
+            content = line[1:].strip()
+            if content.rstrip(",").isdigit():
+                preceding = [
+                    bucket for key_line, bucket in buckets if key_line < lineno
+                ]
+                if not preceding:
+                    return None
+                added[preceding[-1]].append(int(content.rstrip(",")))
+            elif content not in STRUCTURAL_LINES:
+                logger.info(f"Couldn't parse added line in diff: {content[:100]}")
+                return None
+            lineno += 1
+        elif line.startswith("-") and not line.startswith("---"):
+            content = line[1:].strip().rstrip(",")
+            if content.isdigit():
+                removed.add(int(content))
+    return {
+        bucket: [i for i in ids if i not in removed] for bucket, ids in added.items()
+    }
+
+
+async def added_ids(
+    repo_dir: str, since: str, until: str, path: str = ANIME_CACHE_PATH
+) -> Optional[Dict[str, List[int]]]:
+    """
+    Uses the diff between two commits to find IDs added to the cache,
+    grouped by their sfw/nsfw bucket. Returns None if history was rewritten
+    or the diff couldn't be parsed, in which case the whole cache should be read
+    """
+    return await asyncio.to_thread(_added_ids, repo_dir, since, until, path)
@@ -0,0 +1,151 @@
+import os
+import json
+import time
+import asyncio
+
+from dataclasses import dataclass, field, asdict
+from typing import Dict, Any, Optional, Iterator
+
+from logzero import logger  # type: ignore[import]
+
+from . import truncate_partial_line
+
+# the stages a new entry goes through, in order. 'sending' is written right
+# before the message is sent, so a crash while sending can be told apart
+# from one before it, and the feed checked instead of posting it again
+STAGES = ("fetched", "sending", "sent", "verified", "published")
+# written once the entry is in old_db, so it can be dropped from the journal
+DONE = "done"
+# written if discord won't accept the entry (e.g. a 400 for an invalid embed),
+# so it doesn't block the entries after it. dropped from the journal like DONE
+FAILED = "failed"
+
+
+@dataclass
+class JournalEntry:
+    mal_id: int
+    stage: str
+    # Embed.to_dict() of the embed built from MAL
+    embed: Dict[str, Any] = field(default_factory=dict)
+    sfw: bool = True
+    # time.time() right before the message was sent
+    sending_at: Optional[float] = None
+    channel_id: Optional[int] = None
+    message_id: Optional[int] = None
+
+    def reached(self, stage: str) -> bool:
+        return STAGES.index(self.stage) >= STAGES.index(stage)
+
+
+class PostingJournal:
+    """
+    Write-ahead log of entries which are being posted to the feed. Each stage
+    an entry completes is appended (and fsync'd) as a line of JSON before the
+    next one starts, so after a crash posting resumes where it left off,
+    without fetching from MAL or posting anything twice
+
+    Only unfinished entries are kept, once none are left the file is truncated.
+    If some are stuck (e.g. discord keeps erroring), its compacted to just
+    those entries after compact_after lines
+    """
+
+    def __init__(self, *, filepath: str, compact_after: int = 1000) -> None:
+        self.filepath = filepath
+        self.compact_after = compact_after
+        self.entries: Dict[int, JournalEntry] = {}
+        self._lines = 0
+        self._lock = asyncio.Lock()
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(filepath={self.filepath}, pending={len(self.entries)})"
+
+    def __contains__(self, mal_id: object) -> bool:
+        return mal_id in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __iter__(self) -> Iterator[JournalEntry]:
+        """Yields unfinished entries, lowest MAL ID first"""
+        for mal_id in sorted(self.entries):
+            yield self.entries[mal_id]
+
+    def load(self) -> None:
+        self.entries = {}
+        self._lines = 0
+        if not os.path.exists(self.filepath):
+            return
+        # so the next line isn't appended onto a partially written one
+        truncate_partial_line(self.filepath)
+        with open(self.filepath, "r") as f:
+            for line in f:
+                self._lines += 1
+                data: Dict[str, Any] = json.loads(line)
+                mal_id = int(data["mal_id"])
+                if data["stage"] in (DONE, FAILED):
+                    self.entries.pop(mal_id, None)
+                elif mal_id in self.entries:
+                    entry = self.entries[mal_id]
+                    for key, val in data.items():
+                        setattr(entry, key, val)
+                else:
+                    self.entries[mal_id] = JournalEntry(**data)
+        if self.entries:
+            logger.info(f"Resuming {len(self.entries)} entries from {self.filepath}")
+
+    def _append(self, data: Dict[str, Any]) -> None:
+        with open(self.filepath, "a") as f:
+            f.write(json.dumps(data, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._lines += 1
+
+    def _compact(self) -> None:
+        """Atomically rewrites the file with one line for each unfinished entry"""
+        tmp_file = self.filepath + ".tmp"
+        with open(tmp_file, "w") as f:
+            for entry in self:
+                f.write(json.dumps(asdict(entry), separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.filepath)
+        self._lines = len(self.entries)
+
+    async def record(self, mal_id: int, stage: str, **data: Any) -> JournalEntry:
+        """Durably records that the entry reached stage, with any data that stage produced"""
+        assert stage in STAGES, stage
+        async with self._lock:
+            await asyncio.to_thread(
+                self._append, {"mal_id": mal_id, "stage": stage, **data}
+            )
+            entry = self.entries.get(mal_id)
+            if entry is None:
+                entry = self.entries[mal_id] = JournalEntry(mal_id, stage, **data)
+            else:
+                entry.stage = stage
+                for key, val in data.items():
+                    setattr(entry, key, val)
+            return entry
+
+    async def sending(self, mal_id: int, channel_id: int) -> JournalEntry:
+        return await self.record(
+            mal_id, "sending", channel_id=channel_id, sending_at=time.time()
+        )
+
+    async def _finish(self, mal_id: int, stage: str, **data: Any) -> None:
+        async with self._lock:
+            self.entries.pop(mal_id, None)
+            if not self.entries or self._lines >= self.compact_after:
+                # empty if theres nothing left to resume
+                await asyncio.to_thread(self._compact)
+            else:
+                await asyncio.to_thread(
+                    self._append, {"mal_id": mal_id, "stage": stage, **data}
+                )
+
+    async def done(self, mal_id: int) -> None:
+        await self._finish(mal_id, DONE)
+
+    async def failed(self, mal_id: int, error: str) -> None:
+        """Gives up on posting the entry"""
+        await self._finish(mal_id, FAILED, error=error)
@@ -0,0 +1,157 @@
+import os
+import time
+import asyncio
+
+from typing import Optional, Dict, Any, Set, Callable, TYPE_CHECKING
+
+import aiohttp
+import backoff  # type: ignore[import]
+from logzero import logger  # type: ignore[import]
+
+from .ratelimit import TokenBucket
+from .metrics import metrics
+
+MAL_API_URL = os.environ.get("MAL_API_URL", "https://api.myanimelist.net/v2")
+
+# statuses which are worth retrying, anything else is raised immediately
+RETRY_STATUSES: Set[int] = {401, 429, 500, 502, 503, 504}
+
+if TYPE_CHECKING:
+    # importing malexport takes most of a second, so its only imported when authenticating
+    from malexport.exporter.mal_session import MalSession
+
+SessionFactory = Callable[[], "MalSession"]
+
+
+def _log_giveup(details: Any) -> None:
+    # a bad token isn't a temporary problem, so make it stand out
+    status = getattr(details.get("exception"), "status", None)
+    if status in (401, 403):
+        logger.error(
+            f"MAL responded with {status} after {details['tries']} tries, the token may be invalid"
+        )
+
+
+class RetryableResponse(Exception):
+    def __init__(self, status: int, url: str) -> None:
+        super().__init__(f"{status} from {url}")
+        self.status = status
+
+
+class MalClient:
+    """
+    Async client for the MAL API, sharing one connection pool
+    and rate limit between all requests
+
+    Authentication is borrowed from the malexport MalSession, which is
+    created by session_factory on the first request instead of at import.
+    After that, the token is refreshed in the background every refresh_interval
+    seconds, and whenever MAL responds with a 401
+    """
+
+    def __init__(
+        self,
+        session_factory: SessionFactory,
+        *,
+        rate: float = 1.0,
+        burst: int = 3,
+        connections: int = 10,
+        refresh_interval: float = 60 * 60 * 24 * 7,
+    ) -> None:
+        self.session_factory = session_factory
+        self.session: Optional["MalSession"] = None
+        self.limiter = TokenBucket(rate=rate, capacity=burst)
+        self.connections = connections
+        self.refresh_interval = refresh_interval
+        self._client: Optional[aiohttp.ClientSession] = None
+        self._session_lock: Optional[asyncio.Lock] = None
+        self._refreshing: Optional["asyncio.Future[None]"] = None
+        self._refresher: Optional["asyncio.Task[None]"] = None
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(session={self.session}, limiter={self.limiter})"
+        )
+
+    def _get_client(self) -> aiohttp.ClientSession:
+        # created lazily, since it has to be created inside the event loop
+        if self._client is None or self._client.closed:
+            self._client = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.connections),
+                timeout=aiohttp.ClientTimeout(total=30),
+            )
+        return self._client
+
+    async def get_session(self) -> "MalSession":
+        """Authenticates on first use, in a thread since it reads config files"""
+        if self.session is not None:
+            return self.session
+        if self._session_lock is None:
+            self._session_lock = asyncio.Lock()
+        async with self._session_lock:
+            if self.session is None:
+                start = time.perf_counter()
+                self.session = await asyncio.to_thread(self.session_factory)
+                logger.info(
+                    f"Authenticated with MAL in {time.perf_counter() - start:.2f}s"
+                )
+                self._refresher = asyncio.create_task(self._refresh_loop())
+        return self.session
+
+    def warm(self) -> "asyncio.Task[MalSession]":
+        """Authenticates in the background, so the first request doesn't wait for it"""
+        task = asyncio.create_task(self.get_session())
+        task.add_done_callback(self._warmed)
+        return task
+
+    @staticmethod
+    def _warmed(task: "asyncio.Task[MalSession]") -> None:
+        # retried on the first request, but a bad token/config shouldn't go unnoticed
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Couldn't authenticate with MAL: {task.exception()!r}")
+
+    async def refresh_token(self) -> None:
+        """Refreshes the access token, requests which get a 401 at the same time share one refresh"""
+        session = await self.get_session()
+        if self._refreshing is None or self._refreshing.done():
+            logger.info("Refreshing MAL token...")
+            self._refreshing = asyncio.ensure_future(
+                asyncio.to_thread(session.refresh_token)
+            )
+        await asyncio.shield(self._refreshing)
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh_token()
+            except Exception as e:
+                logger.warning(f"Couldn't refresh MAL token: {e}")
+
+    @backoff.on_exception(
+        backoff.expo,
+        (aiohttp.ClientError, asyncio.TimeoutError, RetryableResponse),
+        max_tries=5,
+        giveup=lambda e: isinstance(e, aiohttp.ClientResponseError),
+        on_giveup=_log_giveup,
+    )
+    async def get_json(self, url: str) -> Dict[str, Any]:
+        await self.limiter.acquire()
+        metrics.incr("mal_requests")
+        logger.debug(f"Requesting {url}")
+        session = await self.get_session()
+        headers = {"Authorization": str(session.session.headers["Authorization"])}
+        async with self._get_client().get(url, headers=headers) as resp:
+            if resp.status in RETRY_STATUSES:
+                if resp.status == 401:
+                    await self.refresh_token()
+                raise RetryableResponse(resp.status, url)
+            resp.raise_for_status()
+            data: Dict[str, Any] = await resp.json()
+            return data
+
+    async def close(self) -> None:
+        if self._refresher is not None:
+            self._refresher.cancel()
+        if self._client is not None:
+            await self._client.close()
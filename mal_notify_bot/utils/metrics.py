@@ -0,0 +1,142 @@
+import bisect
+
+from typing import Dict, List, Tuple, AsyncIterator, TypeVar
+
+T = TypeVar("T")
+
+# upper bounds (in seconds) for the latency histograms
+BUCKETS: Tuple[float, ...] = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    300,
+    float("inf"),
+)
+
+# discord returns 100 messages per history request
+HISTORY_PAGE_SIZE = 100
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts: List[int] = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Estimates the quantile, as the upper bound of the bucket it falls in"""
+        if self.count == 0:
+            return 0.0
+        target = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return self.buckets[-1]
+
+
+class Metrics:
+    """Call counts, error counts and latencies per function, named counters and gauges"""
+
+    def __init__(self, prefix: str = "mal_notify") -> None:
+        self.prefix = prefix
+        self.calls: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self.latency: Dict[str, Histogram] = {}
+        self.counters: Dict[str, int] = {}
+        self.gauges: Dict[str, float] = {}
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(functions={len(self.calls)}, counters={self.counters})"
+
+    def incr(self, name: str, value: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float) -> None:
+        self.gauges[name] = value
+
+    def observe_call(self, function: str, seconds: float, error: bool) -> None:
+        self.calls[function] = self.calls.get(function, 0) + 1
+        if error:
+            self.errors[function] = self.errors.get(function, 0) + 1
+        if function not in self.latency:
+            self.latency[function] = Histogram()
+        self.latency[function].observe(seconds)
+
+    def prometheus(self) -> str:
+        """Renders the metrics in the prometheus text format"""
+        p = self.prefix
+        lines: List[str] = [
+            f"# TYPE {p}_function_calls_total counter",
+            *(
+                f'{p}_function_calls_total{{function="{f}"}} {n}'
+                for f, n in sorted(self.calls.items())
+            ),
+            f"# TYPE {p}_function_errors_total counter",
+            *(
+                f'{p}_function_errors_total{{function="{f}"}} {self.errors.get(f, 0)}'
+                for f in sorted(self.calls)
+            ),
+            f"# TYPE {p}_function_seconds histogram",
+        ]
+        for f, hist in sorted(self.latency.items()):
+            cumulative = 0
+            for bound, count in zip(hist.buckets, hist.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else str(bound)
+                lines.append(
+                    f'{p}_function_seconds_bucket{{function="{f}",le="{le}"}} {cumulative}'
+                )
+            lines.append(f'{p}_function_seconds_sum{{function="{f}"}} {hist.sum}')
+            lines.append(f'{p}_function_seconds_count{{function="{f}"}} {hist.count}')
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"# TYPE {p}_{name}_total counter")
+            lines.append(f"{p}_{name}_total {value}")
+        for name, gauge in sorted(self.gauges.items()):
+            lines.append(f"# TYPE {p}_{name} gauge")
+            lines.append(f"{p}_{name} {gauge}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> List[str]:
+        """Human readable lines, for the stats command"""
+        lines: List[str] = [
+            f"{f}: {n} calls, {self.errors.get(f, 0)} errors, "
+            f"p50 <={self.latency[f].quantile(0.5)}s, p95 <={self.latency[f].quantile(0.95)}s"
+            for f, n in sorted(self.calls.items(), key=lambda kv: -kv[1])
+        ]
+        lines.extend(
+            f"{name}: {value}" for name, value in sorted(self.counters.items())
+        )
+        lines.extend(f"{name}: {gauge}" for name, gauge in sorted(self.gauges.items()))
+        return lines
+
+
+metrics = Metrics()
+
+
+async def count_history(history: AsyncIterator[T]) -> AsyncIterator[T]:
+    """Wraps channel.history, counting the pages fetched"""
+    i = 0
+    async for message in history:
+        if i % HISTORY_PAGE_SIZE == 0:
+            metrics.incr("history_pages")
+            metrics.incr("discord_requests")
+        i += 1
+        yield message
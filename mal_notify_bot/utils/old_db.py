@@ -0,0 +1,167 @@
+import os
+import asyncio
+
+from typing import Iterable, Iterator, Optional, List
+
+from logzero import logger  # type: ignore[import]
+
+from . import truncate_partial_line
+
+SNAPSHOT_HEADER = b"MALOLD1\n"
+
+
+class IntSet:
+    """A set of non-negative integers, backed by a bitmap"""
+
+    def __init__(self, bitmap: Optional[bytes] = None) -> None:
+        self.bitmap = bytearray(bitmap or b"")
+        self._len = sum(bin(b).count("1") for b in self.bitmap)
+
+    def add(self, i: int) -> bool:
+        """Adds the integer to the set, returns True if it wasn't already in the set"""
+        if i < 0:
+            raise ValueError(f"Can't add a negative integer: {i}")
+        byte, bit = divmod(i, 8)
+        if byte >= len(self.bitmap):
+            # grow by at least a quarter so repeated adds don't keep reallocating
+            self.bitmap.extend(
+                bytes(max(byte + 1 - len(self.bitmap), len(self.bitmap) // 4))
+            )
+        if self.bitmap[byte] & (1 << bit):
+            return False
+        self.bitmap[byte] |= 1 << bit
+        self._len += 1
+        return True
+
+    def __contains__(self, i: object) -> bool:
+        if not isinstance(i, int) or i < 0:
+            return False
+        byte, bit = divmod(i, 8)
+        return byte < len(self.bitmap) and bool(self.bitmap[byte] & (1 << bit))
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator[int]:
+        """Yields the integers in ascending order"""
+        for byte, val in enumerate(self.bitmap):
+            if val:
+                for bit in range(8):
+                    if val & (1 << bit):
+                        yield byte * 8 + bit
+
+
+class OldDatabase:
+    """
+    Models and interacts with the 'old' database, the set of already printed MAL IDs
+
+    IDs are kept in memory as a bitmap. The bitmap is saved as a snapshot file,
+    and new IDs are appended (and fsync'd) to a log file next to it. Once the log
+    is large enough its compacted back into the snapshot
+
+    If the snapshot doesn't exist, IDs are imported from import_from,
+    the plaintext format with one ID per line
+    """
+
+    def __init__(
+        self,
+        *,
+        filepath: str,
+        import_from: Optional[str] = None,
+        compact_after: int = 1000,
+    ) -> None:
+        self.filepath = filepath
+        self.log_filepath = filepath + ".log"
+        self.import_from = import_from
+        self.compact_after = compact_after
+        self.ids = IntSet()
+        self._log_lines = 0
+        self._lock = asyncio.Lock()
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(filepath={self.filepath})"
+
+    def file_exists(self) -> bool:
+        return os.path.exists(self.filepath) or (
+            self.import_from is not None and os.path.exists(self.import_from)
+        )
+
+    def __contains__(self, mal_id: object) -> bool:
+        return int(mal_id) in self.ids if isinstance(mal_id, (int, str)) else False
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.ids)
+
+    def _load(self) -> None:
+        if os.path.exists(self.filepath):
+            with open(self.filepath, "rb") as snap_f:
+                data = snap_f.read()
+            if not data.startswith(SNAPSHOT_HEADER):
+                raise RuntimeError(f"{self.filepath} is not an old database snapshot")
+            self.ids = IntSet(data[len(SNAPSHOT_HEADER) :])
+        elif self.import_from is not None and os.path.exists(self.import_from):
+            logger.info(f"Importing old ids from {self.import_from}")
+            self.ids = IntSet()
+            with open(self.import_from, "r") as old_f:
+                for line in old_f:
+                    if line.strip():
+                        self.ids.add(int(line))
+            self._write_snapshot()
+        self._log_lines = 0
+        if os.path.exists(self.log_filepath):
+            # so the next ID isn't appended onto a partially written one
+            truncate_partial_line(self.log_filepath)
+            with open(self.log_filepath, "r") as log_f:
+                for line in log_f:
+                    self.ids.add(int(line))
+                    self._log_lines += 1
+
+    async def load(self) -> None:
+        """Reads the snapshot and replays the log"""
+        async with self._lock:
+            await asyncio.to_thread(self._load)
+        logger.debug(f"Loaded {len(self.ids)} old ids")
+
+    def _write_snapshot(self) -> None:
+        tmp_file = self.filepath + ".tmp"
+        with open(tmp_file, "wb") as snap_f:
+            snap_f.write(SNAPSHOT_HEADER)
+            snap_f.write(self.ids.bitmap)
+            snap_f.flush()
+            os.fsync(snap_f.fileno())
+        os.replace(tmp_file, self.filepath)
+
+    def _compact(self) -> None:
+        self._write_snapshot()
+        # the snapshot has everything in the log, so it can be truncated
+        with open(self.log_filepath, "w"):
+            pass
+        self._log_lines = 0
+
+    async def compact(self) -> None:
+        """Atomically rewrites the snapshot and truncates the log"""
+        async with self._lock:
+            await asyncio.to_thread(self._compact)
+
+    def _append(self, new_ids: List[int]) -> None:
+        with open(self.log_filepath, "a") as log_f:
+            log_f.write("".join(f"{i}\n" for i in new_ids))
+            log_f.flush()
+            os.fsync(log_f.fileno())
+        self._log_lines += len(new_ids)
+
+    async def add_many(self, mal_ids: Iterable[int]) -> None:
+        async with self._lock:
+            new_ids = sorted({int(i) for i in mal_ids if int(i) not in self.ids})
+            if new_ids:
+                await asyncio.to_thread(self._append, new_ids)
+                for i in new_ids:
+                    self.ids.add(i)
+                if self._log_lines >= self.compact_after:
+                    await asyncio.to_thread(self._compact)
+
+    async def add(self, mal_id: int) -> None:
+        await self.add_many([mal_id])
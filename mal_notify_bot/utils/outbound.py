@@ -0,0 +1,221 @@
+import os
+import heapq
+import asyncio
+import itertools
+
+from enum import IntEnum
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from logzero import logger  # type: ignore[import]
+
+from .ratelimit import TokenBucket
+from .metrics import metrics
+
+Route = Tuple[str, int]
+
+
+class Priority(IntEnum):
+    """Lower values are sent first"""
+
+    FEED = 0
+    REPLY = 1
+    PROGRESS = 2
+    # bulk jobs, only sent when nothing else is waiting
+    BACKGROUND = 3
+
+
+@dataclass(order=True)
+class _Job:
+    priority: int
+    seq: int
+    route: Route = field(compare=False)
+    target: Any = field(compare=False)
+    method: str = field(compare=False)
+    kwargs: Dict[str, Any] = field(compare=False)
+    future: "asyncio.Future[Any]" = field(compare=False)
+    superseded: bool = field(default=False, compare=False)
+
+
+class Outbound:
+    """
+    Schedules all outgoing discord requests
+
+    Requests are sent in priority order, so new entries in the feed are never
+    stuck behind command replies or progress updates. Requests on the same route
+    (e.g. sending to a channel) run one at a time and are limited by a token
+    bucket per route, while different routes run concurrently
+
+    Edits to a message which haven't been sent yet are coalesced, so only the
+    latest content is sent
+    """
+
+    def __init__(
+        self,
+        *,
+        concurrency: int = 4,
+        route_rate: float = 1.0,
+        route_burst: int = 5,
+    ) -> None:
+        self.concurrency = concurrency
+        self.route_rate = route_rate
+        self.route_burst = route_burst
+        self.buckets: Dict[Route, TokenBucket] = {}
+        self.coalesced = 0
+        self._queue: List[_Job] = []
+        self._pending_edits: Dict[int, _Job] = {}
+        self._busy: Set[Route] = set()
+        self._inflight = 0
+        self._seq = itertools.count()
+        self._cond: Optional[asyncio.Condition] = None
+        self._dispatcher: Optional["asyncio.Task[None]"] = None
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(queued={len(self._queue)}, inflight={self._inflight})"
+
+    def _ensure_started(self) -> asyncio.Condition:
+        # started lazily, since it has to be created inside the event loop
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        return self._cond
+
+    def _bucket(self, route: Route) -> TokenBucket:
+        if route not in self.buckets:
+            self.buckets[route] = TokenBucket(
+                rate=self.route_rate, capacity=self.route_burst
+            )
+        return self.buckets[route]
+
+    async def _submit(self, job: _Job) -> Any:
+        cond = self._ensure_started()
+        async with cond:
+            heapq.heappush(self._queue, job)
+            cond.notify_all()
+        return await asyncio.shield(job.future)
+
+    def _pop_ready(self) -> Optional[_Job]:
+        """Pops the highest priority job whose route isn't busy"""
+        if self._inflight >= self.concurrency:
+            return None
+        skipped: List[_Job] = []
+        job: Optional[_Job] = None
+        while self._queue:
+            candidate = heapq.heappop(self._queue)
+            if candidate.superseded:
+                continue
+            if candidate.route in self._busy:
+                skipped.append(candidate)
+                continue
+            job = candidate
+            break
+        for s in skipped:
+            heapq.heappush(self._queue, s)
+        return job
+
+    async def _dispatch(self) -> None:
+        assert self._cond is not None
+        while True:
+            async with self._cond:
+                job = self._pop_ready()
+                while job is None:
+                    await self._cond.wait()
+                    job = self._pop_ready()
+                self._busy.add(job.route)
+                self._inflight += 1
+                if (
+                    job.method == "edit"
+                    and self._pending_edits.get(job.target.id) is job
+                ):
+                    del self._pending_edits[job.target.id]
+            asyncio.create_task(self._execute(job))
+
+    async def _execute(self, job: _Job) -> None:
+        assert self._cond is not None
+        try:
+            await self._bucket(job.route).acquire()
+            metrics.incr("discord_requests")
+            result = await getattr(job.target, job.method)(**job.kwargs)
+        except Exception as e:
+            logger.warning(f"{job.method} on {job.route} failed: {e}")
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            async with self._cond:
+                self._busy.discard(job.route)
+                self._inflight -= 1
+                self._cond.notify_all()
+
+    def _job(
+        self, priority: Priority, route: Route, target: Any, method: str, **kwargs: Any
+    ) -> _Job:
+        return _Job(
+            priority=int(priority),
+            seq=next(self._seq),
+            route=route,
+            target=target,
+            method=method,
+            kwargs=kwargs,
+            future=asyncio.get_running_loop().create_future(),
+        )
+
+    async def send(self, channel: Any, priority: Priority, **kwargs: Any) -> Any:
+        """Sends a message to the channel, returns the sent message"""
+        return await self._submit(
+            self._job(priority, ("send", channel.id), channel, "send", **kwargs)
+        )
+
+    async def publish(self, message: Any) -> Any:
+        return await self._submit(
+            self._job(
+                Priority.FEED, ("publish", message.channel.id), message, "publish"
+            )
+        )
+
+    async def edit(self, message: Any, priority: Priority, **kwargs: Any) -> Any:
+        """
+        Edits the message. If theres already an edit for this message waiting to be
+        sent, its replaced with this one, and both return the same result
+        """
+        self._ensure_started()
+        pending = self._pending_edits.get(message.id)
+        if pending is not None:
+            self.coalesced += 1
+            metrics.incr("coalesced_edits")
+            pending.kwargs = {**pending.kwargs, **kwargs}
+            if priority < pending.priority:
+                # requeue at the higher priority, sharing the same future
+                pending.superseded = True
+                job = self._job(
+                    priority,
+                    pending.route,
+                    message,
+                    "edit",
+                    **pending.kwargs,
+                )
+                job.future = pending.future
+                self._pending_edits[message.id] = job
+                return await self._submit(job)
+            return await asyncio.shield(pending.future)
+        job = self._job(
+            priority, ("edit", message.channel.id), message, "edit", **kwargs
+        )
+        self._pending_edits[message.id] = job
+        return await self._submit(job)
+
+    def edit_nowait(
+        self, message: Any, priority: Priority, **kwargs: Any
+    ) -> "asyncio.Task[Any]":
+        """Queues an edit without waiting for it, e.g. for progress updates"""
+        task = asyncio.create_task(self.edit(message, priority, **kwargs))
+        # errors are already logged when the edit fails
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return task
+
+
+# requests on different routes (e.g. each servers feed) which can run at once
+outbound = Outbound(concurrency=int(os.environ.get("DISCORD_CONCURRENCY", 8)))
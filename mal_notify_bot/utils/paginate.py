@@ -0,0 +1,91 @@
+import io
+
+from typing import List, Optional, Dict, Any
+
+import discord  # type: ignore[import]
+
+from .outbound import outbound, Priority
+
+# discord allows 4096 characters in an embed description
+PAGE_CHARS = 4000
+# once there are more results than this, attach them as a text file as well
+FILE_THRESHOLD = 50
+
+
+def paginate_lines(lines: List[str], max_chars: int = PAGE_CHARS) -> List[str]:
+    """Groups lines into pages, each at most max_chars long"""
+    pages: List[str] = []
+    current: List[str] = []
+    length = 0
+    for line in lines:
+        line = line[:max_chars]
+        if current and length + len(line) + 1 > max_chars:
+            pages.append("\n".join(current))
+            current, length = [], 0
+        current.append(line)
+        length += len(line) + 1
+    if current:
+        pages.append("\n".join(current))
+    return pages
+
+
+class PageView(discord.ui.View):
+    """Previous/Next buttons which flip through pages of an embed"""
+
+    def __init__(self, title: str, pages: List[str], timeout: float = 60 * 10):
+        super().__init__(timeout=timeout)
+        self.title = title
+        self.pages = pages
+        self.page = 0
+
+    def embed(self) -> discord.Embed:
+        embed = discord.Embed(
+            title=self.title,
+            description=self.pages[self.page],
+            color=discord.Colour.dark_blue(),
+        )
+        if len(self.pages) > 1:
+            embed.set_footer(text=f"Page {self.page + 1}/{len(self.pages)}")
+        return embed
+
+    async def _show(self, interaction: discord.Interaction, page: int) -> None:
+        self.page = page % len(self.pages)
+        await interaction.response.edit_message(embed=self.embed(), view=self)
+
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary)
+    async def previous(
+        self, interaction: discord.Interaction, button: discord.ui.Button
+    ) -> None:
+        await self._show(interaction, self.page - 1)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary)
+    async def next(
+        self, interaction: discord.Interaction, button: discord.ui.Button
+    ) -> None:
+        await self._show(interaction, self.page + 1)
+
+
+async def send_paginated(
+    channel: discord.abc.Messageable,
+    title: str,
+    lines: List[str],
+    filename: str = "results.txt",
+) -> Optional[discord.Message]:
+    """
+    Sends lines as a single embed, with buttons to flip through pages if they
+    don't fit in one. If there are lots of lines, they're also attached as a file
+    """
+    if not lines:
+        return None
+    view = PageView(title, paginate_lines(lines))
+    kwargs: Dict[str, Any] = {}
+    if len(lines) > FILE_THRESHOLD:
+        kwargs["file"] = discord.File(
+            io.BytesIO("\n".join(lines).encode()), filename=filename
+        )
+    if len(view.pages) > 1:
+        kwargs["view"] = view
+    message: discord.Message = await outbound.send(
+        channel, Priority.REPLY, embed=view.embed(), **kwargs
+    )
+    return message
@@ -0,0 +1,8 @@
+import os
+
+# directory which holds the token, the mal-id-cache clone and the bots state files
+# can be overridden to run the bot (or the benchmarks) against another directory
+root_dir = os.environ.get(
+    "MAL_NOTIFY_ROOT",
+    os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")),
+)
@@ -0,0 +1,95 @@
+from collections import OrderedDict
+from typing import Optional, Any, Hashable, Tuple
+
+from discord import Embed, Message, TextChannel
+from logzero import logger  # type: ignore[import]
+
+from .feed_index import FeedIndex
+from .outbound import outbound, Priority
+
+
+class RecentIds:
+    """
+    Bounded set of recently posted (channel ID, MAL ID) pairs, evicting the oldest first
+    """
+
+    def __init__(self, maxlen: int = 1000) -> None:
+        self.maxlen = maxlen
+        self._ids: "OrderedDict[Hashable, None]" = OrderedDict()
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(maxlen={self.maxlen}, size={len(self)})"
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._ids
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, key: Hashable) -> None:
+        self._ids[key] = None
+        self._ids.move_to_end(key)
+        while len(self._ids) > self.maxlen:
+            self._ids.popitem(last=False)
+
+
+def _recent_key(mal_id: int, channel: TextChannel) -> Tuple[int, int]:
+    return (channel.id, mal_id)
+
+
+def already_posted(
+    mal_id: int,
+    channel: TextChannel,
+    recent: RecentIds,
+    feed_index: Optional[FeedIndex] = None,
+) -> bool:
+    """Checks whether this entry was posted, without making any requests to discord"""
+    if _recent_key(mal_id, channel) in recent:
+        return True
+    return feed_index is not None and feed_index.get(mal_id, channel.id) is not None
+
+
+async def post_embed(
+    channel: TextChannel,
+    embed: Embed,
+    mal_id: int,
+    *,
+    recent: RecentIds,
+    feed_index: Optional[FeedIndex] = None,
+) -> Optional[Message]:
+    """
+    Sends the embed to the channel, unless its already been posted there
+    Returns the sent message, or None if it was a duplicate
+
+    The message returned by send is the confirmation that it was posted,
+    so there's no need to search the channel history afterwards
+    """
+    if already_posted(mal_id, channel, recent, feed_index):
+        logger.debug(f"{mal_id} was already posted to {channel}, skipping")
+        return None
+    message: Message = await outbound.send(channel, Priority.FEED, embed=embed)
+    mark_posted(mal_id, channel, message, recent=recent, feed_index=feed_index)
+    await publish(message)
+    return message
+
+
+def mark_posted(
+    mal_id: int,
+    channel: TextChannel,
+    message: Message,
+    *,
+    recent: RecentIds,
+    feed_index: Optional[FeedIndex] = None,
+) -> None:
+    """Records the message, so already_posted finds it"""
+    recent.add(_recent_key(mal_id, channel))
+    if feed_index is not None:
+        feed_index.set(mal_id, channel.id, message.id)
+
+
+async def publish(message: Any) -> None:
+    logger.debug("Attempting to publish message...")
+    try:
+        await outbound.publish(message)
+    except Exception as publish_err:
+        logger.warning(f"Couldn't publish message {publish_err}")
@@ -0,0 +1,36 @@
+import time
+import asyncio
+
+
+class TokenBucket:
+    """
+    Rate limiter which allows bursts of up to 'capacity' requests,
+    refilling at 'rate' tokens per second
+    """
+
+    def __init__(self, rate: float, capacity: int) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(rate={self.rate}, capacity={self.capacity})"
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    async def acquire(self) -> None:
+        """Waits until a token is available, and takes it"""
+        # the lock makes waiters take tokens in FIFO order
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
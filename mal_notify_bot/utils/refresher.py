@@ -0,0 +1,190 @@
+import time
+import heapq
+import sqlite3
+import asyncio
+from datetime import datetime, date
+
+from typing import List, Optional, Tuple, Iterable, Iterator, Callable, Any, Coroutine
+
+from logzero import logger  # type: ignore[import]
+
+from .ratelimit import TokenBucket
+from .metrics import metrics
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+# (mal_id, message_id, status, air date) of an entry in the feed
+Candidate = Tuple[int, int, str, str]
+# refreshes the entry with this MAL ID, returns False if it isn't in the feed
+RefreshOne = Callable[[int], Coroutine[Any, Any, bool]]
+
+# how overdue an entry can count as, so entries which were posted years ago
+# and rarely change don't always come before recent ones which might have
+MAX_OVERDUE = 3.0
+
+# (-priority, refresh interval, due at, mal_id), so the highest priority is first
+QueueItem = Tuple[float, float, float, int]
+
+# discord snowflakes are milliseconds since this, shifted left 22 bits
+DISCORD_EPOCH = 1420070400000
+
+
+def posted_at(message_id: int) -> float:
+    """When the message was sent, as a unix timestamp"""
+    return ((message_id >> 22) + DISCORD_EPOCH) / 1000
+
+
+def parse_air_date(air_date: str) -> Optional[date]:
+    """Returns None for placeholders like 'No Air Date', or partial dates like '2024-10'"""
+    try:
+        return datetime.strptime(air_date.strip(), "%Y-%m-%d").date()
+    except ValueError:
+        return None
+
+
+def refresh_interval(status: str, air_date: str, today: date) -> float:
+    """
+    How long after it was last refreshed an entry is worth refreshing again,
+    shorter the more likely it is that MAL has changed something
+    """
+    if status == "Finished Airing":
+        return 90 * DAY
+    if status == "Currently Airing":
+        # until it finishes
+        return 3 * DAY
+    if status != "Not Yet Aired":
+        return 7 * DAY
+    start = parse_air_date(air_date)
+    if start is None:
+        # the air date is still a placeholder
+        return 3 * DAY
+    days_until = (start - today).days
+    if days_until < 0:
+        # should have started airing by now, so the status is stale
+        return 6 * HOUR
+    if days_until <= 7:
+        return 12 * HOUR
+    if days_until <= 30:
+        return 2 * DAY
+    return 14 * DAY
+
+
+class MetadataRefresher:
+    """
+    Refreshes feed entries in the background, spending at most 'budget'
+    MAL requests an hour. An entry is due its refresh_interval after it was
+    last refreshed (or posted). Its priority is how many intervals overdue
+    it is (up to MAX_OVERDUE), with ties going to shorter intervals, since
+    those are the entries most likely to have changed
+
+    The queue is rebuilt from 'candidates' every rebuild_interval seconds,
+    and only holds as many entries as the budget can refresh before the next
+    rebuild. refresh_one should call mark_refreshed, so entries refreshed some
+    other way (e.g. bulk_refresh) aren't refreshed again
+    """
+
+    def __init__(
+        self,
+        *,
+        filepath: str,
+        candidates: Callable[[], Iterable[Candidate]],
+        refresh_one: RefreshOne,
+        budget: float = 60,
+        rebuild_interval: float = HOUR,
+    ) -> None:
+        self.filepath = filepath
+        self.candidates = candidates
+        self.refresh_one = refresh_one
+        self.budget = budget
+        self.rebuild_interval = rebuild_interval
+        self.limiter = TokenBucket(rate=budget / HOUR, capacity=1)
+        self.queue: List[QueueItem] = []
+        # time.time() the queue was last rebuilt
+        self.rebuilt_at: Optional[float] = None
+        self.conn = sqlite3.connect(self.filepath)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS refreshed (mal_id INTEGER PRIMARY KEY, refreshed_at REAL NOT NULL)"
+        )
+        self.conn.commit()
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(filepath={self.filepath}, budget={self.budget}, queued={len(self.queue)})"
+
+    def mark_refreshed(self, mal_id: int, at: Optional[float] = None) -> None:
+        self.conn.execute(
+            "INSERT OR REPLACE INTO refreshed (mal_id, refreshed_at) VALUES (?, ?)",
+            (mal_id, time.time() if at is None else at),
+        )
+        self.conn.commit()
+
+    def refreshed_at(self, mal_id: int) -> Optional[float]:
+        row = self.conn.execute(
+            "SELECT refreshed_at FROM refreshed WHERE mal_id = ?", (mal_id,)
+        ).fetchone()
+        return float(row[0]) if row is not None else None
+
+    def rebuild(self) -> None:
+        now = time.time()
+        today = datetime.fromtimestamp(now).date()
+        refreshed = dict(
+            self.conn.execute("SELECT mal_id, refreshed_at FROM refreshed")
+        )
+        horizon = now + self.rebuild_interval
+        overdue = 0
+
+        def _due() -> Iterator[QueueItem]:
+            nonlocal overdue
+            for mal_id, message_id, status, air_date in self.candidates():
+                last = max(refreshed.get(mal_id, 0.0), posted_at(message_id))
+                interval = refresh_interval(status, air_date, today)
+                due = last + interval
+                if due <= horizon:
+                    overdue += due <= now
+                    priority = min((now - last) / interval, MAX_OVERDUE)
+                    yield (-priority, interval, due, mal_id)
+
+        # twice what the budget allows, since some may be refreshed some other way
+        size = max(1, int(self.budget * self.rebuild_interval / HOUR) * 2)
+        # nsmallest is sorted, so its already a heap
+        self.queue = heapq.nsmallest(size, _due())
+        self.rebuilt_at = now
+        metrics.set_gauge("metadata_refresh_overdue", overdue)
+        logger.debug(f"Rebuilt refresh queue, {overdue} entries overdue")
+
+    async def run(self) -> None:
+        if self.budget <= 0:
+            logger.info("Background metadata refresh is disabled")
+            return
+        while True:
+            if (
+                self.rebuilt_at is None
+                or time.time() - self.rebuilt_at >= self.rebuild_interval
+            ):
+                self.rebuild()
+            assert self.rebuilt_at is not None
+            now = time.time()
+            if not self.queue or self.queue[0][2] > now:
+                wait = self.rebuilt_at + self.rebuild_interval - now
+                if self.queue:
+                    wait = min(wait, self.queue[0][2] - now)
+                await asyncio.sleep(max(1.0, wait))
+                continue
+            mal_id = heapq.heappop(self.queue)[3]
+            refreshed_at = self.refreshed_at(mal_id)
+            if refreshed_at is not None and refreshed_at >= self.rebuilt_at:
+                # refreshed since the queue was built
+                continue
+            await self.limiter.acquire()
+            try:
+                if not await self.refresh_one(mal_id):
+                    logger.debug(f"{mal_id} is no longer in the feed")
+                    self.mark_refreshed(mal_id)
+                metrics.incr("metadata_refreshes")
+            except Exception as e:
+                logger.warning(f"Couldn't refresh {mal_id} in the background: {e}")
+                # so it isn't retried until its due again
+                self.mark_refreshed(mal_id)
+
+    def close(self) -> None:
+        self.conn.close()
@@ -0,0 +1,216 @@
+import re
+import sqlite3
+
+from typing import Optional, List, Dict, Iterable, Iterator, Tuple, NamedTuple
+
+import discord  # type: ignore[import]
+
+# bm25 weight of each column: title, synopsis, status, air date, source
+WEIGHTS: Tuple[float, ...] = (10.0, 1.0, 2.0, 2.0, 5.0)
+
+TOKEN = re.compile(r"\w+", re.UNICODE)
+
+Row = Tuple[int, int, int, str, str, str, str, str]
+
+
+class SearchResult(NamedTuple):
+    mal_id: int
+    channel_id: int
+    message_id: int
+    title: str
+
+
+def embed_row(
+    mal_id: int, channel_id: int, message_id: int, embed: discord.Embed
+) -> Row:
+    """The searchable text from a feed embed"""
+    fields = {f.name: str(f.value) for f in embed.fields if f.value is not None}
+    return (
+        mal_id,
+        channel_id,
+        message_id,
+        embed.title or "",
+        fields.get("Synopsis", ""),
+        fields.get("Status", ""),
+        fields.get("Air Date", ""),
+        fields.get("Source", ""),
+    )
+
+
+def fts_query(query: str) -> Optional[str]:
+    """
+    Turns user input into an FTS query, so quotes/operators in it can't cause
+    syntax errors. Every word has to match, the last one as a prefix
+    """
+    tokens = TOKEN.findall(query)
+    if not tokens:
+        return None
+    quoted = [f'"{t}"' for t in tokens]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+class SearchIndex:
+    """
+    Full text index of the title, synopsis, status, air date
+    and source of each entry in the feed, kept up to date as
+    entries are posted and edited
+    """
+
+    def __init__(self, *, filepath: str):
+        self.filepath = filepath
+        self.conn = sqlite3.connect(self.filepath)
+        self._migrate()
+        # one row for each entry in each channel, like the feed index, so
+        # deleting the message in one feed leaves the entry in the other.
+        # id is the rowid of its text in 'entries'
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY,
+                mal_id INTEGER NOT NULL,
+                channel_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                UNIQUE (mal_id, channel_id)
+            )""")
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS messages_message_id ON messages (message_id)"
+        )
+        self.conn.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS entries USING fts5(
+                title,
+                synopsis,
+                status,
+                air_date,
+                source,
+                tokenize = 'unicode61 remove_diacritics 2'
+            )""")
+        # channels which have had their entire history indexed
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS built (channel_id INTEGER PRIMARY KEY)"
+        )
+        self.conn.commit()
+
+    def _migrate(self) -> None:
+        """
+        Indexes from before 'messages' existed had one row per MAL ID in
+        'entries', those are dropped so the channels are indexed again on startup
+        """
+        tables = {
+            str(r[0])
+            for r in self.conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"
+            )
+        }
+        if "entries" in tables and "messages" not in tables:
+            self.conn.execute("DROP TABLE entries")
+            self.conn.execute("DROP TABLE IF EXISTS built")
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(filepath={self.filepath})"
+
+    def __len__(self) -> int:
+        """Number of entries, an entry in more than one channel is counted once"""
+        row = self.conn.execute(
+            "SELECT COUNT(DISTINCT mal_id) FROM messages"
+        ).fetchone()
+        return int(row[0])
+
+    def _upsert(self, rows: Iterable[Row]) -> None:
+        # if an entry is in the batch more than once for a channel (e.g. it
+        # was reposted), keep the newest message
+        newest: Dict[Tuple[int, int], Row] = {}
+        for row in rows:
+            key = (row[0], row[1])
+            if key not in newest or row[2] > newest[key][2]:
+                newest[key] = row
+        for key in sorted(newest):
+            mal_id, channel_id, message_id, *text = newest[key]
+            found = self.conn.execute(
+                "SELECT id FROM messages WHERE mal_id = ? AND channel_id = ?", key
+            ).fetchone()
+            if found is None:
+                rowid = self.conn.execute(
+                    "INSERT INTO messages (mal_id, channel_id, message_id) VALUES (?, ?, ?)",
+                    (mal_id, channel_id, message_id),
+                ).lastrowid
+            else:
+                rowid = int(found[0])
+                self.conn.execute(
+                    "UPDATE messages SET message_id = ? WHERE id = ?",
+                    (message_id, rowid),
+                )
+                self.conn.execute("DELETE FROM entries WHERE rowid = ?", (rowid,))
+            self.conn.execute(
+                """INSERT INTO entries (rowid, title, synopsis, status, air_date, source)
+                VALUES (?, ?, ?, ?, ?, ?)""",
+                (rowid, *text),
+            )
+        self.conn.commit()
+
+    def update(
+        self, mal_id: int, channel_id: int, message_id: int, embed: discord.Embed
+    ) -> None:
+        self._upsert([embed_row(mal_id, channel_id, message_id, embed)])
+
+    def update_many(self, rows: Iterable[Row]) -> None:
+        """Bulk upsert rows from embed_row"""
+        self._upsert(rows)
+
+    def remove_message(self, message_id: int) -> None:
+        ids = [
+            (r[0],)
+            for r in self.conn.execute(
+                "SELECT id FROM messages WHERE message_id = ?", (message_id,)
+            )
+        ]
+        self.conn.executemany("DELETE FROM entries WHERE rowid = ?", ids)
+        self.conn.executemany("DELETE FROM messages WHERE id = ?", ids)
+        self.conn.commit()
+
+    def is_built(self, channel_id: int) -> bool:
+        row = self.conn.execute(
+            "SELECT 1 FROM built WHERE channel_id = ?", (channel_id,)
+        ).fetchone()
+        return row is not None
+
+    def mark_built(self, channel_id: int) -> None:
+        self.conn.execute(
+            "INSERT OR IGNORE INTO built (channel_id) VALUES (?)", (channel_id,)
+        )
+        self.conn.commit()
+
+    def entries(self, channel_ids: List[int]) -> Iterator[Tuple[int, int, str, str]]:
+        """
+        (mal_id, message_id, status, air date) of every entry in these channels
+        An entry in more than one of them is only included once, with its newest message
+        """
+        marks = ", ".join("?" * len(channel_ids))
+        # sqlite takes the other columns from the row MAX picks
+        yield from self.conn.execute(
+            f"""SELECT m.mal_id, MAX(m.message_id), e.status, e.air_date
+            FROM messages m JOIN entries e ON e.rowid = m.id
+            WHERE m.channel_id IN ({marks}) GROUP BY m.mal_id""",
+            channel_ids,
+        )
+
+    def search(self, query: str, limit: int = 25) -> List[SearchResult]:
+        """Returns the best matches first, each entry once"""
+        match = fts_query(query)
+        if match is None:
+            return []
+        weights = ", ".join(map(str, WEIGHTS))
+        results: Dict[int, SearchResult] = {}
+        # an entry in more than one channel matches once for each, the
+        # cursor is lazy so this stops reading once there are enough
+        for r in self.conn.execute(
+            f"""SELECT m.mal_id, m.channel_id, m.message_id, e.title
+            FROM entries e JOIN messages m ON m.id = e.rowid
+            WHERE entries MATCH ? ORDER BY bm25(entries, {weights}), m.message_id DESC""",
+            (match,),
+        ):
+            if r[0] not in results:
+                results[r[0]] = SearchResult(int(r[0]), int(r[1]), int(r[2]), str(r[3]))
+                if len(results) >= limit:
+                    break
+        return list(results.values())
+
+    def close(self) -> None:
+        self.conn.close()
@@ -0,0 +1,64 @@
+"""
+Local HTTP server, for exposing metrics, and for the checker
+to push newly approved IDs to
+"""
+
+import asyncio
+
+from typing import Any, Callable, Coroutine, List, Optional
+
+from aiohttp import web
+from logzero import logger  # type: ignore[import]
+
+from .metrics import metrics
+
+# called with the IDs pushed to /ingest
+IngestCallback = Callable[[List[int]], Coroutine[Any, Any, None]]
+
+routes = web.RouteTableDef()
+
+
+@routes.get("/metrics")
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(text=metrics.prometheus(), content_type="text/plain")
+
+
+async def _pushed_ids(request: web.Request) -> List[int]:
+    """IDs from ?ids=1,2,3 or a JSON body like {"ids": [1, 2, 3]}"""
+    if "ids" in request.query:
+        return [int(i) for i in request.query["ids"].split(",") if i.strip()]
+    data = await request.json()
+    return [int(i) for i in data["ids"]]
+
+
+@routes.post("/ingest")
+async def ingest_handler(request: web.Request) -> web.Response:
+    ingest: Optional[IngestCallback] = request.app.get("ingest")
+    if ingest is None:
+        return web.json_response({"error": "ingest is disabled"}, status=503)
+    try:
+        ids = await _pushed_ids(request)
+    except (ValueError, KeyError, TypeError) as e:
+        return web.json_response({"error": f"couldn't parse IDs: {e}"}, status=400)
+    # respond right away, the IDs are posted in the background
+    task = asyncio.create_task(ingest(ids))
+    request.app["tasks"].add(task)
+    task.add_done_callback(request.app["tasks"].discard)
+    return web.json_response({"queued": len(ids)}, status=202)
+
+
+async def start_server(
+    host: str = "127.0.0.1",
+    port: int = 9091,
+    ingest: Optional[IngestCallback] = None,
+) -> web.AppRunner:
+    app = web.Application()
+    app["ingest"] = ingest
+    # keep references to running ingest tasks, so they aren't garbage collected
+    app["tasks"] = set()
+    app.add_routes(routes)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Serving metrics and /ingest on http://{host}:{port}")
+    return runner
@@ -0,0 +1,249 @@
+import os
+import json
+import time
+import asyncio
+
+from typing import Optional, Dict, Any, Tuple
+
+import aiohttp
+from logzero import logger  # type: ignore[import]
+
+from .metrics import metrics
+
+# responses which mean the bot isn't allowed to use the service (e.g. a bad
+# token or config), which retrying or waiting for it to come back won't fix
+AUTH_STATUSES = {401, 403}
+
+
+class ServiceUnavailable(Exception):
+    pass
+
+
+class ServiceClient:
+    """
+    Long lived client for one of the local services the bot talks to,
+    sharing a single connection pool between all requests
+
+    Instead of pinging before every request, health_path (if the service has
+    one) is probed every probe_interval seconds in the background. Requests
+    which fail also count against the service: after failure_threshold in a
+    row the circuit opens, and requests fail immediately until reset_after
+    seconds have passed, when one is let through to test it again. Until
+    that one finishes, other requests keep failing immediately
+    """
+
+    def __init__(
+        self,
+        name: str,
+        base_url: str,
+        *,
+        health_path: Optional[str] = None,
+        probe_interval: float = 30,
+        failure_threshold: int = 3,
+        reset_after: float = 30,
+        connections: int = 4,
+        timeout: float = 30,
+    ) -> None:
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.health_path = health_path
+        self.probe_interval = probe_interval
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.connections = connections
+        self.timeout = timeout
+        # None until the first probe finishes
+        self.healthy: Optional[bool] = None
+        self.failures = 0
+        self.open_until = 0.0
+        # whether the request testing an open circuit is in flight
+        self._probing = False
+        self._client: Optional[aiohttp.ClientSession] = None
+        self._prober: Optional["asyncio.Task[None]"] = None
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(name={self.name}, base_url={self.base_url}, available={self.available})"
+
+    def _get_client(self) -> aiohttp.ClientSession:
+        # created lazily, since it has to be created inside the event loop
+        if self._client is None or self._client.closed:
+            self._client = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.connections),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._client
+
+    @property
+    def available(self) -> bool:
+        """Whether a request is worth sending, without making one"""
+        if self.healthy is False:
+            return False
+        if self.open_until == 0.0:
+            return True
+        return time.monotonic() >= self.open_until and not self._probing
+
+    def _set_healthy(self, healthy: bool) -> None:
+        if healthy != self.healthy:
+            log = logger.info if healthy else logger.warning
+            log(f"{self.name} is {'online' if healthy else 'offline'}")
+        self.healthy = healthy
+        metrics.set_gauge(f"{self.name}_healthy", int(healthy))
+
+    def _auth_error(self, status: int, path: str) -> None:
+        logger.error(
+            f"{self.name} responded with {status} to {path}, check the bots credentials/config for it"
+        )
+
+    def _success(self) -> None:
+        self.failures = 0
+        self.open_until = 0.0
+
+    def _failure(self) -> None:
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            if self.open_until == 0.0:
+                logger.warning(
+                    f"{self.name} failed {self.failures} times in a row, pausing requests for {self.reset_after}s"
+                )
+            self.open_until = time.monotonic() + self.reset_after
+
+    async def probe(self) -> bool:
+        assert self.health_path is not None
+        try:
+            async with self._get_client().get(
+                self.base_url + self.health_path,
+                timeout=aiohttp.ClientTimeout(total=5),
+            ) as resp:
+                healthy = resp.status == 200
+                if resp.status in AUTH_STATUSES:
+                    self._auth_error(resp.status, self.health_path)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            healthy = False
+        self._set_healthy(healthy)
+        if healthy:
+            self._success()
+        return healthy
+
+    async def _probe_loop(self) -> None:
+        while True:
+            await self.probe()
+            await asyncio.sleep(self.probe_interval)
+
+    def start(self) -> None:
+        """Starts probing the service in the background"""
+        if self.health_path is not None and (
+            self._prober is None or self._prober.done()
+        ):
+            self._prober = asyncio.create_task(self._probe_loop())
+
+    async def get(self, path: str, **params: Any) -> Tuple[int, Any]:
+        """Returns the status and the JSON body (or text, if it isn't JSON)"""
+        if not self.available:
+            raise ServiceUnavailable(f"{self.name} is offline")
+        # if the circuit was open, this is the one request let through to test it
+        probing = self.open_until != 0.0
+        if probing:
+            self._probing = True
+        metrics.incr(f"{self.name}_requests")
+        try:
+            async with self._get_client().get(
+                self.base_url + path, params=params
+            ) as resp:
+                text = await resp.text()
+                status = resp.status
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self._failure()
+            raise
+        else:
+            if status >= 500:
+                self._failure()
+            else:
+                self._success()
+        finally:
+            if probing:
+                self._probing = False
+        if status in AUTH_STATUSES:
+            self._auth_error(status, path)
+        try:
+            data: Any = json.loads(text) if text else None
+        except ValueError:
+            data = text
+        return status, data
+
+    async def close(self) -> None:
+        if self._prober is not None:
+            self._prober.cancel()
+        if self._client is not None:
+            await self._client.close()
+
+
+class Dbsentinel(ServiceClient):
+    """
+    https://github.com/seanbreckenridge/dbsentinel, which keeps its own copy of
+    MAL data. Refreshes for many entries at once (e.g. from bulk_refresh) are
+    queued, and sent together every batch_delay seconds without waiting on them
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        *,
+        batch_delay: float = 2.0,
+        batch_concurrency: int = 4,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__("dbsentinel", base_url, health_path="/ping", **kwargs)
+        self.batch_delay = batch_delay
+        self.batch_concurrency = batch_concurrency
+        self._pending: Dict[int, None] = {}
+        self._flusher: Optional["asyncio.Task[None]"] = None
+
+    async def refresh_entry(self, mal_id: int) -> Optional[str]:
+        """Asks dbsentinel to refresh an entry, returns an error message if that failed"""
+        try:
+            status, data = await self.get(
+                "/tasks/refresh_entry", entry_type="anime", entry_id=mal_id
+            )
+        except (aiohttp.ClientError, asyncio.TimeoutError, ServiceUnavailable) as e:
+            return str(e) or type(e).__name__
+        if status == 200:
+            return None
+        if isinstance(data, dict) and "error" in data:
+            return str(data["error"])
+        return str(status)
+
+    def refresh_nowait(self, mal_id: int) -> None:
+        """Queues a refresh, the same ID queued more than once is only sent once"""
+        self._pending[mal_id] = None
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush())
+
+    async def _flush(self) -> None:
+        while self._pending:
+            await asyncio.sleep(self.batch_delay)
+            batch = list(self._pending)
+            self._pending.clear()
+            if not self.available:
+                logger.debug(
+                    f"dbsentinel is offline, skipping {len(batch)} refresh requests"
+                )
+                continue
+            semaphore = asyncio.Semaphore(self.batch_concurrency)
+
+            async def _send(mal_id: int) -> None:
+                async with semaphore:
+                    error = await self.refresh_entry(mal_id)
+                if error is not None:
+                    logger.debug(f"Failed to refresh {mal_id} on dbsentinel: {error}")
+
+            await asyncio.gather(*(_send(mal_id) for mal_id in batch))
+            logger.debug(f"Sent {len(batch)} refresh requests to dbsentinel")
+
+
+dbsentinel = Dbsentinel(os.environ.get("DBSENTINEL_URL", "http://localhost:5200"))
+
+# https://github.com/Hiyori-API/checker_mal, which has no health endpoint,
+# so its only marked offline by the circuit breaker
+checker_mal = ServiceClient(
+    "checker_mal", os.environ.get("CHECKER_MAL_URL", "http://localhost:4001")
+)
@@ -0,0 +1,47 @@
+import os
+import time
+
+from typing import Dict
+
+from logzero import logger  # type: ignore[import]
+
+from .metrics import metrics
+
+
+def _process_age() -> float:
+    """Seconds since this process was started, or 0 if that can't be read"""
+    try:
+        with open("/proc/self/stat") as f:
+            # fields after the command name, starttime is the 22nd field
+            started = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - started / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+class StartupTimer:
+    """
+    Seconds from process start until each startup phase finished,
+    logged and exposed as metrics gauges
+    """
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter() - _process_age()
+        self.phases: Dict[str, float] = {}
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(phases={self.phases})"
+
+    def mark(self, phase: str) -> None:
+        # on_ready fires again on reconnects, only the first time is startup
+        if phase in self.phases:
+            return
+        elapsed = time.perf_counter() - self.start
+        self.phases[phase] = elapsed
+        metrics.set_gauge(f"startup_{phase}_seconds", round(elapsed, 4))
+        logger.info(f"Startup: {phase} after {elapsed:.2f}s")
+
+
+startup = StartupTimer()
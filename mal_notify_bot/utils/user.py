@@ -1,22 +1,135 @@
 import os
+import time
 
-from typing import Dict, Any, Iterator, List
+from dataclasses import dataclass, field
+from typing import Dict, Any, AsyncIterator, Optional, TYPE_CHECKING
 
-from malexport.exporter.account import Account
-from malexport.exporter.mal_session import MalSession
-from malexport.exporter.api_list import BASE_URL
+import aiohttp
 
-acc = Account.from_username(os.environ.get("MAL_USERNAME", "purplepinapples"))
-acc.mal_api_authenticate()
-session = acc.mal_session
+from .mal_client import MalClient, MAL_API_URL
 
+if TYPE_CHECKING:
+    from malexport.exporter.mal_session import MalSession
 
-def first_page(username: str) -> str:
-    return BASE_URL.format(list_type="anime", username=username)
 
+def authenticate() -> "MalSession":
+    """Loads the MAL API token for MAL_USERNAME, called on the first request"""
+    from malexport.exporter.account import Account
 
-def download_users_list(username: str) -> Iterator[Dict[str, Any]]:
+    acc = Account.from_username(os.environ.get("MAL_USERNAME", "purplepinapples"))
+    session = acc.mal_api_authenticate()
     assert session is not None
-    for resp in session.paginate_all_data(first_page(username)):
-        for entry in resp:
+    return session
+
+
+# shared async client, MAL_RATE_LIMIT requests per second with bursts of MAL_BURST
+mal_client = MalClient(
+    authenticate,
+    rate=float(os.environ.get("MAL_RATE_LIMIT", 1)),
+    burst=int(os.environ.get("MAL_BURST", 3)),
+)
+
+# only the list status is used, so skip the rest of the fields malexport requests
+USER_LIST_URL = (
+    MAL_API_URL
+    + "/users/{username}/animelist?limit=1000&nsfw=true&fields=my_list_status"
+)
+
+# newest list update, used to check if a cached list is still up to date
+PROBE_URL = (
+    MAL_API_URL
+    + "/users/{username}/animelist?limit=1&sort=list_updated_at&nsfw=true&fields=my_list_status"
+)
+
+
+def first_page(username: str) -> str:
+    return USER_LIST_URL.format(username=username)
+
+
+async def _get_user_page(url: str, username: str) -> Dict[str, Any]:
+    try:
+        return await mal_client.get_json(url)
+    except aiohttp.ClientResponseError as e:
+        if e.status == 404:
+            raise RuntimeError(f"Couldn't find a user with the username {username}")
+        if e.status == 403:
+            raise RuntimeError(f"{username}'s list is private")
+        raise
+
+
+async def download_users_list(username: str) -> AsyncIterator[Dict[str, Any]]:
+    url: Optional[str] = first_page(username)
+    while url is not None:
+        resp = await _get_user_page(url, username)
+        for entry in resp["data"]:
             yield entry["node"]
+        url = resp.get("paging", {}).get("next")
+
+
+@dataclass
+class UserList:
+    """A users list statuses, and when the list was last updated"""
+
+    statuses: Dict[int, str] = field(default_factory=dict)
+    newest_updated_at: Optional[str] = None
+    fetched_at: float = field(default_factory=time.time)
+
+    def add(self, node: Dict[str, Any]) -> None:
+        if "my_list_status" not in node:
+            return
+        self.statuses[int(node["id"])] = str(node["my_list_status"]["status"])
+        updated_at = node["my_list_status"].get("updated_at")
+        # ISO 8601 timestamps in the same timezone sort lexicographically
+        if updated_at is not None and (
+            self.newest_updated_at is None or updated_at > self.newest_updated_at
+        ):
+            self.newest_updated_at = updated_at
+
+
+class UserListCache:
+    """
+    Keeps downloaded lists in memory for 'window' seconds. A cached list is
+    only used if the newest update on the users list hasn't changed
+    """
+
+    def __init__(self, window: float = 60 * 60) -> None:
+        self.window = window
+        self.lists: Dict[str, UserList] = {}
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(window={self.window}, users={len(self.lists)})"
+        )
+
+    async def probe(self, username: str) -> Optional[str]:
+        """Returns when the users list was last updated, with a single request"""
+        resp = await _get_user_page(PROBE_URL.format(username=username), username)
+        probe = UserList()
+        for entry in resp["data"]:
+            probe.add(entry["node"])
+        return probe.newest_updated_at
+
+    def expired(self, user_list: UserList) -> bool:
+        return time.time() - user_list.fetched_at > self.window
+
+    async def get(self, username: str) -> Optional[UserList]:
+        """Returns the cached list, if its recent and still up to date"""
+        key = username.lower()
+        cached = self.lists.get(key)
+        if cached is None:
+            return None
+        if (
+            self.expired(cached)
+            or await self.probe(username) != cached.newest_updated_at
+        ):
+            # its going to be downloaded again, dont keep the old one around
+            self.lists.pop(key, None)
+            return None
+        return cached
+
+    def put(self, username: str, user_list: UserList) -> None:
+        # drop lists too old to be used, so users that only
+        # check their list once don't stay in memory
+        for key in [k for k, v in self.lists.items() if self.expired(v)]:
+            del self.lists[key]
+        self.lists[username.lower()] = user_list
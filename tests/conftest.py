@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# the bot writes its state files to MAL_NOTIFY_ROOT, which is read on import
+os.environ.setdefault("MAL_NOTIFY_ROOT", tempfile.mkdtemp(prefix="mal-notify-test-"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
@@ -0,0 +1,36 @@
+import asyncio
+import logging
+
+from typing import Any, Dict
+
+
+from mal_notify_bot.utils import embeds
+from mal_notify_bot.utils.feed_entry import FeedEntry
+
+logger = logging.getLogger(__name__)
+
+DETAILS: Dict[str, Any] = {
+    "title": "Entry",
+    "synopsis": "word " * 200,
+    "status": "finished_airing",
+    "start_date": "2020-01-01",
+    "genres": [],
+}
+
+
+def test_refresh_long_synopsis_is_a_no_op(monkeypatch: Any) -> None:
+    async def fetch_anime_details(
+        anime_id: int, use_cache: bool = True
+    ) -> Dict[str, Any]:
+        return DETAILS
+
+    monkeypatch.setattr(embeds, "fetch_anime_details", fetch_anime_details)
+
+    async def run() -> None:
+        embed, _ = await embeds.create_embed(1, logger)
+        entry = FeedEntry.from_embed(embed)
+        assert entry.synopsis is not None and entry.synopsis.endswith("word...")
+        refreshed = await embeds.refresh_entry(entry, 1, False, logger)
+        assert refreshed == entry
+
+    asyncio.run(run())
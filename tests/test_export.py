@@ -0,0 +1,53 @@
+import asyncio
+
+from typing import Any, AsyncIterator, Optional
+
+import pytest
+
+from benchmarks.fakes import FakeChannel, FakeMessage
+from mal_notify_bot import main as bot
+from mal_notify_bot.utils.export import ExportCheckpoint, read_export
+
+
+class FlakyChannel(FakeChannel):
+    """Raises part way through the next crawl, like discord returning a 503"""
+
+    fail_after: Optional[int] = None
+
+    async def history(self, *args: Any, **kwargs: Any) -> AsyncIterator[FakeMessage]:
+        fail_after, self.fail_after = self.fail_after, None
+        i = 0
+        async for message in super().history(*args, **kwargs):
+            if fail_after is not None and i >= fail_after:
+                raise RuntimeError("503 Service Unavailable")
+            i += 1
+            yield message
+
+
+def test_failed_export_is_retried_from_the_same_place(tmp_path: Any) -> None:
+    async def run() -> None:
+        feed = FlakyChannel("feed", latency=0)
+        nsfw_feed = FlakyChannel("nsfw-feed", latency=0)
+        for mal_id in range(1, 201):
+            feed.add_entry(mal_id, f"https://source/{mal_id}")
+        bot.export_file = str(tmp_path / "export.ndjson.gz")
+        bot.Globals.feed_channel = feed
+        bot.Globals.nsfw_feed_channel = nsfw_feed
+        bot.Globals.search_index = None
+        bot.Globals.export_checkpoint = ExportCheckpoint(
+            filepath=str(tmp_path / "export_checkpoint.json")
+        )
+        await bot.run_export()
+
+        for mal_id in range(201, 401):
+            feed.add_entry(mal_id, f"https://source/{mal_id}")
+        feed.fail_after = 100
+        with pytest.raises(RuntimeError):
+            await bot.run_export()
+        # e.g. the next export_loop iteration
+        await bot.run_export()
+
+        exported = {record.mal_id for record in read_export(bot.export_file)}
+        assert exported == set(range(1, 401))
+
+    asyncio.run(run())
@@ -0,0 +1,20 @@
+import asyncio
+
+from typing import Any
+
+from mal_notify_bot.utils.journal import PostingJournal
+
+
+def test_torn_line_is_dropped(tmp_path: Any) -> None:
+    async def run() -> None:
+        journal = PostingJournal(filepath=str(tmp_path / "journal.jsonl"))
+        await journal.record(1, "fetched")
+        # a crash part way through writing a line, then more lines after a restart
+        with open(journal.filepath, "a") as f:
+            f.write('{"mal_id":2,"sta')
+        journal.load()
+        await journal.record(3, "fetched")
+        journal.load()
+        assert sorted(journal.entries) == [1, 3]
+
+    asyncio.run(run())
@@ -0,0 +1,20 @@
+import asyncio
+
+from typing import Any
+
+from mal_notify_bot.utils.old_db import OldDatabase
+
+
+def test_torn_line_is_dropped(tmp_path: Any) -> None:
+    async def run() -> None:
+        old_db = OldDatabase(filepath=str(tmp_path / "old.bin"))
+        await old_db.add(1)
+        # a crash part way through writing an ID, then more IDs after a restart
+        with open(old_db.log_filepath, "a") as f:
+            f.write("12")
+        await old_db.load()
+        await old_db.add(345)
+        await old_db.load()
+        assert list(old_db) == [1, 345]
+
+    asyncio.run(run())
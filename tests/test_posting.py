@@ -0,0 +1,59 @@
+import asyncio
+
+from typing import Any, Optional, Set
+
+from discord import Embed, errors
+
+from benchmarks.fakes import FakeChannel, FakeMessage
+from mal_notify_bot import main as bot
+from mal_notify_bot.utils.journal import PostingJournal
+from mal_notify_bot.utils.old_db import OldDatabase
+from mal_notify_bot.utils.posting import RecentIds
+
+
+class _Response:
+    def __init__(self, status: int) -> None:
+        self.status = status
+        self.reason = "Bad Request"
+
+
+class RejectingChannel(FakeChannel):
+    """Responds to sending some entries with a 400, like discord does for an invalid embed"""
+
+    rejected: Set[str] = set()
+
+    async def send(
+        self, content: Any = None, *, embed: Optional[Embed] = None, **kwargs: Any
+    ) -> FakeMessage:
+        if embed is not None and embed.url in self.rejected:
+            raise errors.HTTPException(_Response(400), "Invalid Form Body")  # type: ignore[arg-type]
+        return await super().send(content, embed=embed, **kwargs)
+
+
+def test_permanent_failure_doesnt_block_later_entries(tmp_path: Any) -> None:
+    async def run() -> None:
+        feed = RejectingChannel("feed", latency=0)
+        urls = {
+            mal_id: f"https://myanimelist.net/anime/{mal_id}" for mal_id in (1, 2, 3)
+        }
+        feed.rejected = {urls[2]}
+        bot.Globals.feed_channel = feed
+        bot.Globals.nsfw_feed_channel = FakeChannel("nsfw-feed", latency=0)
+        bot.Globals.mirrors = []
+        bot.Globals.feed_index = None
+        bot.Globals.search_index = None
+        bot.Globals.recent_ids = RecentIds()
+        bot.Globals.old_db = OldDatabase(filepath=str(tmp_path / "old.bin"))
+        journal = PostingJournal(filepath=str(tmp_path / "journal.jsonl"))
+        bot.Globals.journal = journal
+        for mal_id, url in urls.items():
+            embed = Embed(title=f"Entry {mal_id}", url=url)
+            await journal.record(mal_id, "fetched", embed=embed.to_dict(), sfw=True)
+
+        await bot.post_new_embeds()
+
+        assert [m.embeds[0].url for m in feed.messages] == [urls[1], urls[3]]
+        assert len(journal) == 0
+        assert list(bot.Globals.old_db) == [1, 3]
+
+    asyncio.run(run())
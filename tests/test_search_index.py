@@ -0,0 +1,60 @@
+import sqlite3
+
+from typing import Any
+
+from discord import Embed
+
+from mal_notify_bot.utils.search_index import SearchIndex, embed_row
+
+FEED = 1
+NSFW_FEED = 2
+
+
+def _embed(title: str) -> Embed:
+    embed = Embed(title=title, url="https://myanimelist.net/anime/5")
+    embed.add_field(name="Status", value="Finished Airing")
+    return embed
+
+
+def test_deleting_from_one_feed_keeps_the_other() -> None:
+    index = SearchIndex(filepath=":memory:")
+    index.update_many(
+        [
+            embed_row(5, FEED, 100, _embed("Entry")),
+            embed_row(5, FEED, 101, _embed("Entry")),
+            embed_row(5, NSFW_FEED, 200, _embed("Entry")),
+        ]
+    )
+    assert len(index) == 1
+    assert [r.message_id for r in index.search("entry")] == [200]
+
+    index.remove_message(200)
+    assert [(r.channel_id, r.message_id) for r in index.search("entry")] == [
+        (FEED, 101)
+    ]
+    assert list(index.entries([FEED, NSFW_FEED])) == [(5, 101, "Finished Airing", "")]
+
+    index.update(5, FEED, 102, _embed("Renamed"))
+    assert index.search("entry") == []
+    assert [r.message_id for r in index.search("renamed")] == [102]
+
+    index.remove_message(102)
+    assert len(index) == 0
+    assert index.search("renamed") == []
+
+
+def test_one_row_per_entry_index_is_rebuilt(tmp_path: Any) -> None:
+    filepath = str(tmp_path / "search_index.sqlite")
+    conn = sqlite3.connect(filepath)
+    conn.execute(
+        "CREATE VIRTUAL TABLE entries USING fts5(title, channel_id UNINDEXED, message_id UNINDEXED)"
+    )
+    conn.execute("CREATE TABLE built (channel_id INTEGER PRIMARY KEY)")
+    conn.execute("INSERT INTO built (channel_id) VALUES (?)", (FEED,))
+    conn.commit()
+    conn.close()
+
+    index = SearchIndex(filepath=filepath)
+    assert not index.is_built(FEED)
+    index.update(5, FEED, 100, _embed("Entry"))
+    assert [r.mal_id for r in index.search("entry")] == [5]
@@ -0,0 +1,56 @@
+import asyncio
+
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator
+
+import pytest
+
+from mal_notify_bot.utils.services import ServiceClient, ServiceUnavailable
+
+
+class _Response:
+    status = 200
+
+    async def text(self) -> str:
+        return ""
+
+
+class _SlowSession:
+    """Stands in for the aiohttp session, responds once 'release' is set"""
+
+    closed = False
+
+    def __init__(self) -> None:
+        self.release = asyncio.Event()
+        self.requests = 0
+
+    @asynccontextmanager
+    async def get(self, url: str, **kwargs: Any) -> AsyncIterator[_Response]:
+        self.requests += 1
+        await self.release.wait()
+        yield _Response()
+
+
+def test_open_circuit_lets_one_request_through() -> None:
+    async def run() -> None:
+        client = ServiceClient(
+            "service", "http://localhost", failure_threshold=1, reset_after=0
+        )
+        session = _SlowSession()
+        client._client = session  # type: ignore[assignment]
+        client._failure()
+
+        probe = asyncio.create_task(client.get("/"))
+        await asyncio.sleep(0)
+        assert not client.available
+        with pytest.raises(ServiceUnavailable):
+            await client.get("/")
+        assert session.requests == 1
+
+        session.release.set()
+        assert await probe == (200, None)
+        assert client.available
+        assert await client.get("/") == (200, None)
+        assert session.requests == 2
+
+    asyncio.run(run())
@@ -0,0 +1,16 @@
+import asyncio
+import time
+
+from mal_notify_bot.utils.user import UserList, UserListCache
+
+
+def test_expired_lists_are_evicted() -> None:
+    cache = UserListCache(window=60)
+    cache.put("Old", UserList(fetched_at=time.time() - 120))
+    cache.put("Other", UserList(fetched_at=time.time() - 120))
+
+    assert asyncio.run(cache.get("old")) is None
+    assert "old" not in cache.lists
+
+    cache.put("new", UserList())
+    assert list(cache.lists) == ["new"]